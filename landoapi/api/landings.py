@@ -6,18 +6,22 @@ Landing API
 See the OpenAPI Specification for this API in the spec/swagger.yml file.
 """
 import logging
-import urllib.parse
 
-from connexion import problem
+from connexion import problem, ProblemException
 from flask import current_app, g, jsonify, request
-from sqlalchemy.orm.exc import NoResultFound
 
 from landoapi import auth
-from landoapi.commit_message import format_commit_message
-from landoapi.decorators import lazy, require_phabricator_api_key
-from landoapi.hgexportbuilder import build_patch_for_revision
+from landoapi.decorators import (
+    lazy,
+    prefetch,
+    require_phabricator_api_key,
+)
+from landoapi.idempotency import idempotent
 from landoapi.landings import (
+    assessment_cache_key,
+    cache_assessment,
     check_landing_conditions,
+    get_cached_assessment,
     LandingAssessment,
     LandingInProgress,
     lazy_get_diff,
@@ -30,12 +34,18 @@ from landoapi.landings import (
     lazy_get_reviewers_extra_state,
     lazy_get_revision,
     lazy_get_revision_status,
+    lazy_get_stack,
     lazy_reviewers_search,
+    merge_stack_assessments,
 )
+from landoapi.metrics import LANDINGS
 from landoapi.models.landing import Landing, LandingStatus
-from landoapi.patches import upload
-from landoapi.phabricator import ReviewerStatus
-from landoapi.reviews import reviewer_identity
+from landoapi.patch_preparation import (
+    PatchSource,
+    prepare_patches,
+    speculate_patches,
+)
+from landoapi.phabricator import RevisionQueryProfile
 from landoapi.storage import db
 from landoapi.transplant_client import TransplantClient, TransplantError
 from landoapi.validation import revision_id_to_int
@@ -47,56 +57,188 @@ def unmarshal_landing_request(data):
     return (revision_id_to_int(data['revision_id']), data['diff_id'])
 
 
+def unmarshal_stack_request(data):
+    """Return the (revision_id, diff_id) tuples of a request in landing order.
+
+    The revisions of the optional `stack` land first, in the order they
+    are given, followed by the requested revision.
+    """
+    entries = [unmarshal_landing_request(e) for e in data.get('stack') or []]
+    entries.append(unmarshal_landing_request(data))
+
+    revision_ids = [revision_id for revision_id, _ in entries]
+    if len(set(revision_ids)) != len(revision_ids):
+        raise ProblemException(
+            400,
+            'Bad Request',
+            'A revision may only appear once in a landing request.',
+            type='https://developer.mozilla.org/en-US/docs/Web/HTTP/Status/400'  # noqa
+        )  # yapf: disable
+
+    return entries
+
+
+def _landing_loaders(phab, revision_id, diff_id, landing_before=()):
+    """Return the lazy getters used to assess and land a revision.
+
+    Args:
+        phab: A PhabricatorClient instance.
+        revision_id: The integer id of the revision.
+        diff_id: The integer id of the diff to land.
+        landing_before: Integer ids of the revisions landing before this
+            one in the same request.
+
+    Returns:
+        A dict of the getter keyword arguments of
+        `check_landing_conditions` to their LazyValues.
+    """
+    get_revision = lazy_get_revision(phab, revision_id)
+    get_latest_diff = lazy_get_latest_diff(phab, get_revision)
+    get_diff = lazy_get_diff(phab, diff_id, get_latest_diff)
+    get_stack = lazy_get_stack(phab, get_revision)
+    get_reviewers = lazy_get_reviewers(get_revision)
+    return {
+        'get_revision': get_revision,
+        'get_latest_diff': get_latest_diff,
+        'get_latest_landed': lazy(Landing.latest_landed)(revision_id),
+        'get_repository': lazy_get_repository(phab, get_revision),
+        'get_landing_repo': lazy_get_landing_repo(
+            phab, get_revision, current_app.config.get('ENVIRONMENT')
+        ),
+        'get_diff': get_diff,
+        'get_diff_author': lazy_get_diff_author(get_diff),
+        'get_open_parents': lazy_get_open_parents(
+            phab, get_stack, get_revision, frozenset(landing_before)
+        ),
+        'get_reviewers': get_reviewers,
+        'get_reviewer_info': lazy_reviewers_search(phab, get_reviewers),
+        'get_reviewers_extra_state': lazy_get_reviewers_extra_state(
+            get_reviewers, get_diff
+        ),
+        'get_revision_status': lazy_get_revision_status(get_revision),
+    }  # yapf: disable
+
+
+def _assess_revision(
+    phab, revision_id, diff_id, loaders, *, landing_before=(), landing=False
+):
+    """Return the LandingAssessment of a single revision.
+
+    Assessments of revisions which land on their own, or at the bottom
+    of a stack, are cached for the next dryrun or landing of the same
+    revision state. Whether a parent is open depends on the revisions
+    landing before it, so no other assessment is cached.
+
+    Args:
+        landing: True if the assessment is for an actual landing, in
+            which case a cached assessment is only reused if it is not
+            blocked, so that blockers are always reported fresh, and the
+            checks stop at the first blocker.
+    """
+    cache_key = None
+    if not landing_before:
+        cache_key = assessment_cache_key(
+            phab, g.auth0_user, diff_id, loaders['get_revision'](),
+            Landing.latest(revision_id)
+        )
+
+    assessment = get_cached_assessment(cache_key)
+    if landing:
+        if assessment is None or assessment.blockers:
+            assessment = check_landing_conditions(
+                g.auth0_user,
+                revision_id,
+                diff_id,
+                short_circuit=True,
+                **loaders
+            )
+        return assessment
+
+    if assessment is None:
+        if loaders['get_revision']() is not None:
+            prefetch(
+                loaders['get_diff'],
+                loaders['get_landing_repo'],
+                loaders['get_open_parents'],
+                loaders['get_reviewer_info'],
+            )
+
+        assessment = check_landing_conditions(
+            g.auth0_user, revision_id, diff_id, **loaders
+        )
+        cache_assessment(cache_key, assessment)
+
+    return assessment
+
+
 @auth.require_auth0(scopes=('lando', 'profile', 'email'), userinfo=True)
 @require_phabricator_api_key(optional=True)
 def dryrun(data):
     """API endpoint at /landings/dryrun.
 
-    Returns a LandingAssessment for the given Revision ID.
+    Returns a LandingAssessment for the given Revision ID, and for the
+    revisions of the stack landing with it if one is given.
     """
-    revision_id, diff_id = unmarshal_landing_request(data)
     phab = g.phabricator
 
-    get_revision = lazy_get_revision(phab, revision_id)
-    get_latest_diff = lazy_get_latest_diff(phab, get_revision)
-    get_diff = lazy_get_diff(phab, diff_id, get_latest_diff)
-    get_diff_author = lazy_get_diff_author(get_diff)
-    get_latest_landed = lazy(Landing.latest_landed)(revision_id)
-    get_repository = lazy_get_repository(phab, get_revision)
-    get_landing_repo = lazy_get_landing_repo(
-        get_repository, current_app.config.get('ENVIRONMENT')
-    )
-    get_open_parents = lazy_get_open_parents(phab, get_revision)
-    get_reviewers = lazy_get_reviewers(get_revision)
-    get_reviewer_info = lazy_reviewers_search(phab, get_reviewers)
-    get_reviewers_extra_state = lazy_get_reviewers_extra_state(
-        get_reviewers, get_diff
-    )
-    get_revision_status = lazy_get_revision_status(get_revision)
-    assessment = check_landing_conditions(
-        g.auth0_user,
-        revision_id,
-        diff_id,
-        get_revision,
-        get_latest_diff,
-        get_latest_landed,
-        get_repository,
-        get_landing_repo,
-        get_diff,
-        get_diff_author,
-        get_open_parents,
-        get_reviewers,
-        get_reviewer_info,
-        get_reviewers_extra_state,
-        get_revision_status,
-    )
+    assessed = []
+    assessments = []
+    landing_before = []
+    for revision_id, diff_id in unmarshal_stack_request(data):
+        loaders = _landing_loaders(phab, revision_id, diff_id, landing_before)
+        assessment = _assess_revision(
+            phab, revision_id, diff_id, loaders, landing_before=landing_before
+        )
+        assessed.append((revision_id, diff_id, loaders))
+        assessments.append((revision_id, assessment))
+        landing_before = landing_before + [revision_id]
+
+    assessment = merge_stack_assessments(assessments)
+    if not assessment.blockers:
+        # The landing usually follows, so start preparing its patches.
+        speculate_patches(
+            phab,
+            _patch_sources(assessed),
+            current_app.config['PATCH_BUCKET_NAME'],
+            aws_access_key=current_app.config['AWS_ACCESS_KEY'],
+            aws_secret_key=current_app.config['AWS_SECRET_KEY'],
+            max_workers=current_app.config.get(
+                'SPECULATIVE_PATCH_MAX_WORKERS', 0
+            ),
+        )
+
     return jsonify(assessment.to_dict())
 
 
+def _patch_sources(assessed):
+    """Return the PatchSources of assessed revisions.
+
+    Args:
+        assessed: A list of (revision_id, diff_id, loaders) tuples, where
+            loaders is the result of `_landing_loaders`.
+    """
+    return [
+        PatchSource(
+            revision_id,
+            diff_id,
+            loaders['get_revision'],
+            loaders['get_diff_author'],
+            loaders['get_reviewers'],
+            loaders['get_reviewer_info'],
+        ) for revision_id, diff_id, loaders in assessed
+    ]
+
+
 @auth.require_auth0(scopes=('lando', 'profile', 'email'), userinfo=True)
 @require_phabricator_api_key(optional=True)
+@idempotent
 def post(data):
-    """API endpoint at POST /landings to land revision."""
+    """API endpoint at POST /landings to land revision.
+
+    If a `stack` of revisions is given, they are landed before the
+    revision in a single Transplant request, with a Landing for every
+    revision sharing its request id.
+    """
     logger.info(
         'landing requested by user',
         extra={
@@ -106,45 +248,38 @@ def post(data):
         }
     )
 
-    revision_id, diff_id = unmarshal_landing_request(data)
+    entries = unmarshal_stack_request(data)
+    revision_id = entries[-1][0]
     confirmation_token = data.get('confirmation_token') or None
 
     phab = g.phabricator
 
-    get_revision = lazy_get_revision(phab, revision_id)
-    get_latest_diff = lazy_get_latest_diff(phab, get_revision)
-    get_diff = lazy_get_diff(phab, diff_id, get_latest_diff)
-    get_diff_author = lazy_get_diff_author(get_diff)
-    get_latest_landed = lazy(Landing.latest_landed)(revision_id)
-    get_repository = lazy_get_repository(phab, get_revision)
-    get_landing_repo = lazy_get_landing_repo(
-        get_repository, current_app.config.get('ENVIRONMENT')
-    )
-    get_open_parents = lazy_get_open_parents(phab, get_revision)
-    get_reviewers = lazy_get_reviewers(get_revision)
-    get_reviewer_info = lazy_reviewers_search(phab, get_reviewers)
-    get_reviewers_extra_state = lazy_get_reviewers_extra_state(
-        get_reviewers, get_diff
-    )
-    get_revision_status = lazy_get_revision_status(get_revision)
-    assessment = check_landing_conditions(
-        g.auth0_user,
-        revision_id,
-        diff_id,
-        get_revision,
-        get_latest_diff,
-        get_latest_landed,
-        get_repository,
-        get_landing_repo,
-        get_diff,
-        get_diff_author,
-        get_open_parents,
-        get_reviewers,
-        get_reviewer_info,
-        get_reviewers_extra_state,
-        get_revision_status,
-        short_circuit=True,
-    )
+    # Reuse the assessment from a recent dryrun of the same revision
+    # state if there is one. Whether the revisions are already submitted
+    # is checked again below while holding the lock.
+    assessed = []
+    assessments = []
+    landing_before = []
+    for entry_revision_id, entry_diff_id in entries:
+        loaders = _landing_loaders(
+            phab, entry_revision_id, entry_diff_id, landing_before
+        )
+        assessment = _assess_revision(
+            phab,
+            entry_revision_id,
+            entry_diff_id,
+            loaders,
+            landing_before=landing_before,
+            landing=True
+        )
+        assessed.append((entry_revision_id, entry_diff_id, loaders))
+        assessments.append((entry_revision_id, assessment))
+        if assessment.blockers:
+            break
+
+        landing_before = landing_before + [entry_revision_id]
+
+    assessment = merge_stack_assessments(assessments)
     assessment.raise_if_blocked_or_unacknowledged(confirmation_token)
     if assessment.warnings:
         # Log any warnings that were acknowledged, for auditing.
@@ -156,54 +291,42 @@ def post(data):
             }
         )
 
-    # These are guaranteed to return proper data since we're
-    # running after checking_landing_conditions().
-    revision = get_revision()
-    landing_repo = get_landing_repo()
-    diff, querydiffs_diff = get_diff()
-    latest_diff_id = get_latest_diff()['id']
-    author_name, author_email = get_diff_author()
-
-    # Collect the usernames of reviewers who have accepted.
-    reviewers = get_reviewers()
-    users, projects = get_reviewer_info()
-    accepted_reviewers = [
-        reviewer_identity(phid, users, projects).identifier
-        for phid, r in reviewers.items()
-        if r['status'] is ReviewerStatus.ACCEPTED
-    ]
-
-    # Seconds since Unix Epoch, UTC.
-    date_modified = phab.expect(revision, 'fields', 'dateModified')
-
-    title = phab.expect(revision, 'fields', 'title')
-    summary = phab.expect(revision, 'fields', 'summary')
-    bug_id = phab.expect(revision, 'fields').get('bugzilla.bug-id')
-    bug_id = int(bug_id) if bug_id and not isinstance(bug_id, int) else None
-    human_revision_id = 'D{}'.format(revision_id)
-    revision_url = urllib.parse.urljoin(
-        current_app.config['PHABRICATOR_URL'], human_revision_id
-    )
-    commit_message = format_commit_message(
-        title, bug_id, accepted_reviewers, summary, revision_url
-    )
-
-    # Construct the patch that will be sent to transplant.
-    raw_diff = phab.call_conduit('differential.getrawdiff', diffID=diff_id)
-    patch = build_patch_for_revision(
-        raw_diff, author_name, author_email, commit_message[1], date_modified
-    )
+    landing_repo = assessed[-1][2]['get_landing_repo']()
+    if any(
+        loaders['get_landing_repo']().tree != landing_repo.tree
+        for _, _, loaders in assessed
+    ):
+        return problem(
+            400,
+            'Bad Request',
+            'Every revision landing in the same request must land to the '
+            'same repository.',
+            type='https://developer.mozilla.org/en-US/docs/Web/HTTP/Status/400'
+        )
 
-    # Upload the patch to S3
-    patch_url = upload(
-        revision_id,
-        diff_id,
-        patch,
+    # Build and upload every patch, concurrently for a stack.
+    prepared = prepare_patches(
+        phab,
+        _patch_sources(assessed),
         current_app.config['PATCH_BUCKET_NAME'],
         aws_access_key=current_app.config['AWS_ACCESS_KEY'],
         aws_secret_key=current_app.config['AWS_SECRET_KEY'],
+        max_workers=current_app.config.get('PATCH_PREPARATION_MAX_WORKERS', 0),
     )
 
+    ldap_username = g.auth0_user.email
+    landings = [
+        Landing(
+            revision_id=patch.revision_id,
+            diff_id=patch.diff_id,
+            active_diff_id=loaders['get_latest_diff']()['id'],
+            requester_email=ldap_username,
+            tree=landing_repo.tree,
+            patch_hash=patch.hash,
+            status=LandingStatus.submitted
+        ) for patch, (_, _, loaders) in zip(prepared, assessed)
+    ]
+
     trans = TransplantClient(
         current_app.config['TRANSPLANT_URL'],
         current_app.config['TRANSPLANT_USERNAME'],
@@ -218,7 +341,6 @@ def post(data):
             )
         ]
     )
-    ldap_username = g.auth0_user.email
 
     try:
         # WARNING: Entering critical section, do not add additional
@@ -231,27 +353,24 @@ def post(data):
             db.session.execute(
                 'LOCK TABLE landings IN SHARE ROW EXCLUSIVE MODE;'
             )
-            if Landing.is_revision_submitted(revision_id):
-                submitted_assessment.raise_if_blocked_or_unacknowledged(None)
+            for landing in landings:
+                if Landing.is_revision_submitted(landing.revision_id):
+                    submitted_assessment.raise_if_blocked_or_unacknowledged(
+                        None
+                    )
 
             transplant_request_id = trans.land(
                 revision_id=revision_id,
                 ldap_username=ldap_username,
-                patch_urls=[patch_url],
+                patch_urls=[patch.url for patch in prepared],
                 tree=landing_repo.tree,
                 pingback=current_app.config['PINGBACK_URL'],
                 push_bookmark=landing_repo.push_bookmark
             )
-            landing = Landing(
-                request_id=transplant_request_id,
-                revision_id=revision_id,
-                diff_id=diff_id,
-                active_diff_id=latest_diff_id,
-                requester_email=ldap_username,
-                tree=landing_repo.tree,
-                status=LandingStatus.submitted
-            )
-            db.session.add(landing)
+            for landing in landings:
+                landing.request_id = transplant_request_id
+
+            db.session.add_all(landings)
     except TransplantError as exc:
         logger.info(
             'error creating landing',
@@ -268,15 +387,24 @@ def post(data):
 
     # Transaction succeeded, commit the session.
     db.session.commit()
+    LANDINGS.inc(len(landings), status=LandingStatus.submitted.value)
 
+    landing = landings[-1]
     logger.info(
         'landing created',
         extra={
             'revision_id': revision_id,
             'landing_id': landing.id,
+            'request_id': landing.request_id,
         }
     )
-    return {'id': landing.id}, 202
+    if len(landings) == 1:
+        return {'id': landing.id}, 202
+
+    return {
+        'id': landing.id,
+        'stack': [stacked.id for stacked in landings]
+    }, 202
 
 
 @require_phabricator_api_key(optional=True)
@@ -284,12 +412,9 @@ def get_list(revision_id):
     """API endpoint at GET /landings to return a list of Landing objects."""
     # Verify that the client is permitted to see the associated revision.
     revision_id = revision_id_to_int(revision_id)
-    revision = g.phabricator.call_conduit(
-        'differential.revision.search',
-        constraints={'ids': [revision_id]},
+    revision = g.phabricator.get_revision(
+        revision_id, profile=RevisionQueryProfile.PERMISSION
     )
-    revision = g.phabricator.expect(revision, 'data')
-    revision = g.phabricator.single(revision, none_when_empty=True)
     if not revision:
         return problem(
             404,
@@ -309,12 +434,9 @@ def get(landing_id):
 
     if landing:
         # Verify that the client has permission to see the associated revision.
-        revision = g.phabricator.call_conduit(
-            'differential.revision.search',
-            constraints={'ids': [landing.revision_id]},
+        revision = g.phabricator.get_revision(
+            landing.revision_id, profile=RevisionQueryProfile.PERMISSION
         )
-        revision = g.phabricator.expect(revision, 'data')
-        revision = g.phabricator.single(revision, none_when_empty=True)
         if revision:
             return landing.serialize(), 200
 
@@ -350,9 +472,9 @@ def update(data):
             revision (sha) of push if landed == true
             empty string if landed == false
     """
-    try:
-        landing = Landing.query.filter_by(request_id=data['request_id']).one()
-    except NoResultFound:
+    # Every revision of a stack landed together shares the request.
+    landings = Landing.query.filter_by(request_id=data['request_id']).all()
+    if not landings:
         return problem(
             404,
             'Landing not found',
@@ -360,10 +482,13 @@ def update(data):
             type='https://developer.mozilla.org/en-US/docs/Web/HTTP/Status/404'
         )
 
-    landing.update_from_transplant(
-        data['landed'],
-        error=data.get('error_msg', ''),
-        result=data.get('result', '')
-    )
+    for landing in landings:
+        landing.update_from_transplant(
+            data['landed'],
+            error=data.get('error_msg', ''),
+            result=data.get('result', '')
+        )
+    status = landings[0].status
     db.session.commit()
+    LANDINGS.inc(len(landings), status=status.value)
     return {}, 200
@@ -15,10 +15,13 @@ from flask import current_app, g
 from landoapi.commit_message import format_commit_message
 from landoapi.decorators import require_phabricator_api_key
 from landoapi.landings import (
+    lazy_get_latest_diff,
     lazy_get_reviewers,
-    lazy_project_search,
-    lazy_user_search,
+    lazy_get_revision,
+    lazy_identity_search,
+    search_diff,
 )
+from landoapi.mirror import allow_mirror_reads
 from landoapi.phabricator import (
     PhabricatorClient,
     ReviewerStatus,
@@ -30,9 +33,13 @@ logger = logging.getLogger(__name__)
 
 
 @require_phabricator_api_key(optional=True)
+@allow_mirror_reads
 def get(revision_id, diff_id=None):
     """Gets revision from Phabricator.
 
+    Revisions, diffs and identities are read from the Phabricator mirror
+    when it is enabled and fresh.
+
     Args:
         revision_id: (string) ID of the revision in 'D{number}' format
         diff_id: (integer) Id of the diff to return with the revision. By
@@ -41,15 +48,7 @@ def get(revision_id, diff_id=None):
     revision_id = revision_id_to_int(revision_id)
 
     phab = g.phabricator
-    revision = phab.call_conduit(
-        'differential.revision.search',
-        constraints={'ids': [revision_id]},
-        attachments={
-            'reviewers': True,
-            'reviewers-extra': True,
-        }
-    )
-    revision = phab.single(revision, 'data', none_when_empty=True)
+    revision = lazy_get_revision(phab, revision_id)()
     if revision is None:
         return problem(
             404,
@@ -58,23 +57,10 @@ def get(revision_id, diff_id=None):
             type='https://developer.mozilla.org/en-US/docs/Web/HTTP/Status/404'
         )
 
-    latest_diff = phab.single(
-        phab.call_conduit(
-            'differential.diff.search',
-            constraints={
-                'phids': [phab.expect(revision, 'fields', 'diffPHID')]
-            },
-        ), 'data'
-    )
+    latest_diff = lazy_get_latest_diff(phab, revision)()
     latest_diff_id = phab.expect(latest_diff, 'id')
     if diff_id is not None and diff_id != latest_diff_id:
-        diff = phab.single(
-            phab.call_conduit(
-                'differential.diff.search', constraints={'ids': [diff_id]}
-            ),
-            'data',
-            none_when_empty=True
-        )
+        diff = search_diff(phab, diff_id)
     else:
         diff = latest_diff
 
@@ -107,8 +93,9 @@ def get(revision_id, diff_id=None):
 
     # Immediately execute the lazy functions.
     reviewers = lazy_get_reviewers(revision)()
-    users = lazy_user_search(phab, list(reviewers.keys()) + [author_phid])()
-    projects = lazy_project_search(phab, list(reviewers.keys()))()
+    users, projects = lazy_identity_search(
+        phab, list(reviewers.keys()) + [author_phid]
+    )()
 
     accepted_reviewers = [
         reviewer_identity(phid, users, projects).identifier
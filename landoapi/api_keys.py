@@ -0,0 +1,117 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+Cache of verified Phabricator API keys.
+
+Verifying an API key requires a `user.whoami` call to Phabricator. Once a
+key has been verified, the PHID of its user is cached, both in process and
+in redis, so later requests using the same key skip that call. Keys are
+never stored, only an HMAC of the key salted with the unprivileged API
+key, which is a secret only known to Lando.
+"""
+import hashlib
+import hmac
+import threading
+import time
+
+from flask import current_app
+
+from landoapi.cache import cache
+from landoapi.phabricator import PhabricatorAPIException, PhabricatorClient
+
+# Seconds a verified key is cached in redis.
+VERIFIED_KEY_TIMEOUT = 60
+
+# Seconds a verified key is cached in process. This is kept short as a
+# key forgotten by another process is only forgotten in redis.
+LOCAL_VERIFIED_KEY_TIMEOUT = 10
+
+_local_keys = {}
+_local_keys_lock = threading.Lock()
+
+
+def api_key_hash(api_key):
+    salt = current_app.config['PHABRICATOR_UNPRIVILEGED_API_KEY']
+    return hmac.new(
+        salt.encode('utf-8'), api_key.encode('utf-8'), hashlib.sha256
+    ).hexdigest()
+
+
+def verified_key_cache_key(key_hash):
+    return 'phabricator_verified_key_{}'.format(key_hash)
+
+
+def get_verified_user(api_key):
+    """Return the user PHID of a cached verified key, or None."""
+    key_hash = api_key_hash(api_key)
+    with _local_keys_lock:
+        expires, user_phid = _local_keys.get(key_hash, (0, None))
+
+    if expires > time.monotonic():
+        return user_phid
+
+    user_phid = None
+    with cache.suppress_failure():
+        user_phid = cache.get(verified_key_cache_key(key_hash))
+
+    if user_phid is not None:
+        _remember_locally(key_hash, user_phid)
+
+    return user_phid
+
+
+def remember_verified_key(api_key, user_phid):
+    """Cache `api_key` as a verified key belonging to `user_phid`."""
+    key_hash = api_key_hash(api_key)
+    _remember_locally(key_hash, user_phid)
+    with cache.suppress_failure():
+        cache.set(
+            verified_key_cache_key(key_hash),
+            user_phid,
+            timeout=VERIFIED_KEY_TIMEOUT
+        )
+
+
+def forget_api_key(api_key):
+    """Remove `api_key` from the verified key cache."""
+    key_hash = api_key_hash(api_key)
+    with _local_keys_lock:
+        _local_keys.pop(key_hash, None)
+
+    with cache.suppress_failure():
+        cache.delete(verified_key_cache_key(key_hash))
+
+
+def _remember_locally(key_hash, user_phid):
+    with _local_keys_lock:
+        _local_keys[key_hash] = (
+            time.monotonic() + LOCAL_VERIFIED_KEY_TIMEOUT, user_phid
+        )
+
+
+def verify_api_key(phabricator):
+    """Return the user PHID of the api token of `phabricator`.
+
+    The token is verified with a `user.whoami` call unless it was
+    verified recently.
+
+    Args:
+        phabricator: A PhabricatorClient instance.
+
+    Returns:
+        The PHID of the user the token belongs to, or None if the token
+        is not valid.
+    """
+    user_phid = get_verified_user(phabricator.api_token)
+    if user_phid is not None:
+        return user_phid
+
+    try:
+        whoami = phabricator.call_conduit('user.whoami')
+        user_phid = PhabricatorClient.expect(whoami, 'phid')
+    except PhabricatorAPIException:
+        return None
+
+    remember_verified_key(phabricator.api_token, user_phid)
+    return user_phid
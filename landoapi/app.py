@@ -14,11 +14,15 @@ from connexion.resolver import RestyResolver
 
 import landoapi.models  # noqa, makes sure alembic knows about the models.
 from landoapi.cache import cache
+from landoapi.deadline import DEFAULT_REQUEST_DEADLINE, parse_deadlines
 from landoapi.dockerflow import dockerflow
 from landoapi.hooks import initialize_hooks
-from landoapi.logging import MozLogFormatter
+from landoapi.logging import MozLogFormatter, start_async_logging
+from landoapi.metrics import initialize_metrics
+from landoapi.resilience import PHABRICATOR, TRANSPLANT
 from landoapi.sentry import sentry
 from landoapi.storage import alembic, db
+from landoapi.tracing import initialize_tracing
 
 logger = logging.getLogger(__name__)
 
@@ -55,6 +59,8 @@ def create_app(version_path):
 
     initialize_caching(flask_app)
     initialize_hooks(flask_app)
+    initialize_tracing(flask_app)
+    initialize_metrics(flask_app)
 
     return app
 
@@ -81,6 +87,64 @@ def configure_app(flask_app, version_path):
         )
         sys.exit(1)
 
+    # Gzip compress conduit request bodies of at least this many bytes.
+    # Only enable this if Phabricator's web server decodes compressed
+    # request bodies.
+    compress_min_bytes = os.getenv('PHABRICATOR_COMPRESS_MIN_BYTES')
+    flask_app.config['PHABRICATOR_COMPRESS_MIN_BYTES'] = (
+        int(compress_min_bytes) if compress_min_bytes else None
+    )
+
+    # Hedge slow read-only conduit calls when 'y', and retry them this
+    # many times after connection errors.
+    flask_app.config['PHABRICATOR_HEDGE'] = (
+        os.environ.get('PHABRICATOR_HEDGE', 'n')
+    )
+    read_retries = int(os.environ.get('PHABRICATOR_READ_RETRIES', 0))
+    flask_app.config['PHABRICATOR_READ_RETRIES'] = read_retries
+
+    # Read revisions, diffs, users and projects from the local mirror
+    # when 'y', as long as it was synced within this many seconds.
+    flask_app.config['PHABRICATOR_MIRROR'] = (
+        os.environ.get('PHABRICATOR_MIRROR', 'n')
+    )
+    mirror_max_age = int(os.environ.get('PHABRICATOR_MIRROR_MAX_AGE', 60))
+    flask_app.config['PHABRICATOR_MIRROR_MAX_AGE'] = mirror_max_age
+
+    # Threads shared by all requests for fetching independent data
+    # concurrently, or 0 to fetch everything serially.
+    prefetch_workers = int(os.environ.get('PREFETCH_MAX_WORKERS', 4))
+    flask_app.config['PREFETCH_MAX_WORKERS'] = prefetch_workers
+
+    # Threads shared by all requests for preparing the patches of a
+    # stack concurrently, or 0 to prepare them serially.
+    preparation_workers = int(
+        os.environ.get('PATCH_PREPARATION_MAX_WORKERS', 4)
+    )
+    flask_app.config['PATCH_PREPARATION_MAX_WORKERS'] = preparation_workers
+
+    # Start preparing the patches of a dryrun without blockers in the
+    # background when 'y', for the landing which usually follows.
+    flask_app.config['SPECULATIVE_PATCH_PREPARATION'] = (
+        os.environ.get('SPECULATIVE_PATCH_PREPARATION', 'n')
+    )
+
+    # Threads of the separate pool speculative preparations run on. Work
+    # is dropped rather than queued while they are all busy.
+    speculation_workers = int(
+        os.environ.get('SPECULATIVE_PATCH_MAX_WORKERS', 2)
+    )
+    flask_app.config['SPECULATIVE_PATCH_MAX_WORKERS'] = speculation_workers
+
+    # Cap how many request threads of this process may wait on each
+    # dependency, so a slow one cannot starve every other request.
+    PHABRICATOR.configure(
+        max_concurrent=int(os.getenv('PHABRICATOR_MAX_CONCURRENCY', 6))
+    )
+    TRANSPLANT.configure(
+        max_concurrent=int(os.getenv('TRANSPLANT_MAX_CONCURRENCY', 2))
+    )
+
     # Sentry
     this_app_version = version_info['version']
     initialize_sentry(flask_app, this_app_version)
@@ -122,6 +186,21 @@ def configure_app(flask_app, version_path):
 
     flask_app.config['CSP_REPORTING_URL'] = os.getenv('CSP_REPORTING_URL')
 
+    # Directory shared by every process to merge their metrics in.
+    flask_app.config['METRICS_DIR'] = os.getenv('METRICS_DIR')
+
+    # Log every tracing span of each request when 'y'.
+    flask_app.config['TRACE_EXPORT'] = os.environ.get('TRACE_EXPORT', 'n')
+
+    # Seconds a request may spend before calls to backing services fail
+    # fast, overridden per operationId by a comma separated list of
+    # <operationId>=<seconds> in REQUEST_DEADLINES.
+    flask_app.config['REQUEST_DEADLINE'] = float(
+        os.environ.get('REQUEST_DEADLINE', DEFAULT_REQUEST_DEADLINE)
+    )
+    deadlines = parse_deadlines(os.environ.get('REQUEST_DEADLINES'))
+    flask_app.config['REQUEST_DEADLINES'] = deadlines
+
     # OIDC Configuration:
     # OIDC_IDENTIFIER should be the custom api identifier defined in auth0.
     flask_app.config['OIDC_IDENTIFIER'] = os.environ['OIDC_IDENTIFIER']
@@ -223,6 +302,10 @@ def initialize_logging():
                     'level': level,
                     'handlers': ['console'],
                 },
+                'request.trace': {
+                    'level': level,
+                    'handlers': ['console'],
+                },
                 'flask': {
                     'handlers': ['null'],
                 },
@@ -237,6 +320,17 @@ def initialize_logging():
             'disable_existing_loggers': True,
         }
     )
+
+    # Write log records from a separate thread, so request threads never
+    # block on a slow log stream.
+    if os.environ.get('LOG_ASYNC', 'n') == 'y':
+        names = ('landoapi', 'request.summary', 'request.trace', 'werkzeug')
+        start_async_logging(
+            logging.getLogger('landoapi').handlers[0],
+            [logging.getLogger(name) for name in names],
+            maxsize=int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+        )
+
     logger.info('logging configured', extra={'LOG_LEVEL': level})
 
 
@@ -16,6 +16,7 @@ from flask import current_app, g
 from jose import jwt
 
 from landoapi.cache import cache
+from landoapi.deadline import outbound_timeout, raise_if_expired
 from landoapi.mocks.auth import MockAuth0
 
 logger = logging.getLogger(__name__)
@@ -102,8 +103,11 @@ def get_jwks():
         return jwks
 
     try:
-        jwks_response = requests.get(jwks_url)
+        jwks_response = requests.get(
+            jwks_url, timeout=outbound_timeout('auth0')
+        )
     except requests.exceptions.Timeout:
+        raise_if_expired('auth0')
         raise ProblemException(
             500,
             'Auth0 Timeout',
@@ -165,7 +169,8 @@ def fetch_auth0_userinfo(access_token):
     """Return userinfo response from auth0 endpoint."""
     return requests.get(
         get_userinfo_url(),
-        headers={'Authorization': 'Bearer {}'.format(access_token)}
+        headers={'Authorization': 'Bearer {}'.format(access_token)},
+        timeout=outbound_timeout('auth0')
     )
 
 
@@ -183,6 +188,7 @@ def get_auth0_userinfo(access_token, user_sub):
     try:
         resp = fetch_auth0_userinfo(access_token)
     except requests.exceptions.Timeout:
+        raise_if_expired('auth0')
         raise ProblemException(
             500,
             'Auth0 Timeout',
@@ -513,67 +519,40 @@ def require_transplant_authentication(f):
     @functools.wraps(f)
     def wrapped(*args, **kwargs):
         if current_app.config['PINGBACK_ENABLED'] != 'y':
-            try:
-                # First try to log any arguments that were going to
-                # the endpoint (could fail json serialization).
-                logger.warning(
-                    'Attempt to access a disabled pingback',
-                    extra={
-                        'arguments': args,
-                        'kw_arguments': kwargs,
-                        'remote_addr': request.remote_addr,
-                    }
-                )
-            except TypeError:
-                # Reattempt logging without the arguments.
-                logger.warning(
-                    'Attempt to access a disabled pingback',
-                    extra={'remote_addr': request.remote_addr}
-                )
+            logger.warning(
+                'Attempt to access a disabled pingback',
+                extra={
+                    'arguments': args,
+                    'kw_arguments': kwargs,
+                    'remote_addr': request.remote_addr,
+                }
+            )
 
             raise _not_authorized_problem_exception()
 
         passed_key = request.headers.get('API-Key')
         if not passed_key:
-            try:
-                # First try to log any arguments that were going to
-                # the endpoint (could fail json serialization).
-                logger.critical(
-                    'Attempt to pingback without API-Key header',
-                    extra={
-                        'arguments': args,
-                        'kw_arguments': kwargs,
-                        'remote_addr': request.remote_addr,
-                    }
-                )
-            except TypeError:
-                # Reattempt logging without the arguments.
-                logger.critical(
-                    'Attempt to pingback without API-Key header',
-                    extra={'remote_addr': request.remote_addr}
-                )
+            logger.critical(
+                'Attempt to pingback without API-Key header',
+                extra={
+                    'arguments': args,
+                    'kw_arguments': kwargs,
+                    'remote_addr': request.remote_addr,
+                }
+            )
 
             raise _not_authorized_problem_exception()
 
         required_key = current_app.config['TRANSPLANT_API_KEY']
         if not hmac.compare_digest(passed_key, required_key):
-            try:
-                # First try to log any arguments that were going to
-                # the endpoint (could fail json serialization).
-                logger.critical(
-                    'Attempt to pingback with incorrect API-Key',
-                    extra={
-                        'arguments': args,
-                        'kw_arguments': kwargs,
-                        'remote_addr': request.remote_addr,
-                    }
-                )
-            except TypeError:
-                # Reattempt logging without the arguments.
-                logger.critical(
-                    'Attempt to pingback with incorrect API-Key',
-                    extra={'remote_addr': request.remote_addr}
-                )
+            logger.critical(
+                'Attempt to pingback with incorrect API-Key',
+                extra={
+                    'arguments': args,
+                    'kw_arguments': kwargs,
+                    'remote_addr': request.remote_addr,
+                }
+            )
             raise _not_authorized_problem_exception()
 
         return f(*args, **kwargs)
@@ -3,7 +3,49 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 from flask_caching import Cache
 
+from landoapi.metrics import CACHE_REQUESTS
 from landoapi.redis import SuppressRedisFailure
+from landoapi.tracing import span
 
-cache = Cache()
+
+class TracedCache(Cache):
+    """A Cache which records a 'cache' tracing span for each operation.
+
+    Reads are also counted as hits or misses in CACHE_REQUESTS.
+    """
+
+    def get(self, *args, **kwargs):
+        with span('cache'):
+            value = super().get(*args, **kwargs)
+
+        CACHE_REQUESTS.inc(result='miss' if value is None else 'hit')
+        return value
+
+    def get_many(self, *args, **kwargs):
+        with span('cache'):
+            values = list(super().get_many(*args, **kwargs))
+
+        hits = sum(1 for value in values if value is not None)
+        CACHE_REQUESTS.inc(hits, result='hit')
+        CACHE_REQUESTS.inc(len(values) - hits, result='miss')
+        return values
+
+    def set(self, *args, **kwargs):
+        with span('cache'):
+            return super().set(*args, **kwargs)
+
+    def set_many(self, *args, **kwargs):
+        with span('cache'):
+            return super().set_many(*args, **kwargs)
+
+    def add(self, *args, **kwargs):
+        with span('cache'):
+            return super().add(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        with span('cache'):
+            return super().delete(*args, **kwargs)
+
+
+cache = TracedCache()
 cache.suppress_failure = SuppressRedisFailure
@@ -1,11 +1,15 @@
 # This Source Code Form is subject to the terms of the Mozilla Public
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
+import logging
 import os
+import time
 
 import click
 from flask.cli import FlaskGroup
 
+logger = logging.getLogger(__name__)
+
 
 def create_lando_api_app(info):
     from landoapi.app import create_app
@@ -28,5 +32,38 @@ def init():
     alembic.stamp('head')
 
 
+@cli.command(name='sync-phabricator-mirror')
+@click.option('--once', is_flag=True, help='Sync once and exit.')
+@click.option(
+    '--interval', default=10, show_default=True, help='Seconds between syncs.'
+)
+def sync_phabricator_mirror(once, interval):
+    """Sync the local Phabricator mirror with the Phabricator feed."""
+    from flask import current_app
+    from landoapi.mirror import sync_mirror
+    from landoapi.phabricator import PhabricatorClient
+    from landoapi.storage import db
+    phab = PhabricatorClient(
+        current_app.config['PHABRICATOR_URL'],
+        current_app.config['PHABRICATOR_UNPRIVILEGED_API_KEY']
+    )
+    while True:
+        try:
+            sync_mirror(phab)
+        except Exception as exc:
+            if once:
+                raise
+
+            # The mirror goes stale and requests fall back to conduit
+            # until a sync succeeds again.
+            logger.warning('phabricator mirror sync failed', exc_info=exc)
+            db.session.rollback()
+
+        if once:
+            return
+
+        time.sleep(interval)
+
+
 if __name__ == '__main__':
     cli()
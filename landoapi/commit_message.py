@@ -2,6 +2,7 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 """Add revision data to commit message."""
+import functools
 import re
 
 REVISION_URL_TEMPLATE = 'Differential Revision: {url}'
@@ -37,6 +38,13 @@ R_SPECIFIER_RE = re.compile(R_SPECIFIER)
 
 LIST = r'[;,\/\\]\s*'
 
+# Marks reviewer specifiers to be removed after the first one has been
+# replaced, along with any list separator immediately preceding them.
+REVIEWERS_MARKER = '\0'
+REVIEWERS_MARKER_RE = re.compile(
+    LIST + REVIEWERS_MARKER + '|' + REVIEWERS_MARKER
+)
+
 # Note that we only allows a subset of legal IRC-nick characters.
 # Specifically we not allow [ \ ] ^ ` { | }
 IRC_NICK = r'[a-zA-Z0-9\-\_]+'
@@ -82,7 +90,36 @@ def format_commit_message(title, bug, reviewers, summary, revision_url):
         part will be added, or the title will be used unmodified if it is
         already valid.
     """
-    if bug and bug not in parse_bugs(title):
+    title = format_title(title, bug, tuple(reviewers))
+    summary = summary.strip()
+
+    # Construct the final message as a series of sections with
+    # a blank line between each. Blank sections are filtered out.
+    sections = filter(
+        None, [title, summary, REVISION_URL_TEMPLATE.format(url=revision_url)]
+    )
+    return title, '\n\n'.join(sections)
+
+
+@functools.lru_cache(maxsize=1024)
+def format_title(title, bug, reviewers):
+    """Return the first line of a commit message with bug and reviewers.
+
+    This produces the same result as prefixing the bug when
+    `parse_bugs` does not find it and then calling `replace_reviewers`,
+    but stops scanning for bugs at the first match and rewrites the
+    reviewer specifiers in a single pass over the title. Results are
+    memoized as the same revision is formatted on every request for it.
+
+    Args:
+        title: The first line of the original commit message.
+        bug: The bug number to use or None.
+        reviewers: A tuple of reviewer usernames.
+
+    Returns:
+        The formatted title with leading / trailing whitespace removed.
+    """
+    if bug and not _contains_bug(title, bug):
         # All we really care about is if a bug is known it should
         # appear in the first line of the commit message. If it
         # isn't already there we'll add it.
@@ -90,18 +127,55 @@ def format_commit_message(title, bug, reviewers, summary, revision_url):
 
     # Ensure that the actual reviewers are recorded in the
     # first line of the commit message.
-    title = replace_reviewers(title, reviewers)
+    return _replace_reviewers(title, reviewers).strip()
 
-    # Clear any leading / trailing whitespace.
-    title = title.strip()
-    summary = summary.strip()
 
-    # Construct the final message as a series of sections with
-    # a blank line between each. Blank sections are filtered out.
-    sections = filter(
-        None, [title, summary, REVISION_URL_TEMPLATE.format(url=revision_url)]
-    )
-    return title, '\n\n'.join(sections)
+def _contains_bug(s, bug):
+    """Return whether `bug` is one of the bugs `parse_bugs(s)` returns."""
+    if bug >= 100000000:
+        return False
+
+    return any(int(m.group(2)) == bug for m in BUG_RE.finditer(s))
+
+
+def _replace_reviewers(commit_description, reviewers):
+    """Single pass equivalent of `replace_reviewers`."""
+    reviewers_str = 'r=' + ','.join(reviewers) if reviewers else ''
+
+    if commit_description == '':
+        return reviewers_str
+
+    commit_summary, *commit_description = commit_description.splitlines()
+    commit_description = '\n'.join(commit_description)
+
+    if not R_SPECIFIER_RE.search(commit_summary):
+        commit_summary += ' ' + reviewers_str
+    else:
+        # Replace the first r? with the reviewer list, and mark all
+        # subsequent occurrences for removal along with their
+        # leading separators.
+        pieces = []
+        end = 0
+        replaced = False
+        for m in REVIEWERS_RE.finditer(commit_summary):
+            if not R_SPECIFIER_RE.match(m.group(2)):
+                continue
+
+            pieces.append(commit_summary[end:m.start()])
+            if replaced:
+                pieces.append(REVIEWERS_MARKER)
+            else:
+                pieces.append(m.group(1) + reviewers_str)
+                replaced = True
+            end = m.end()
+
+        pieces.append(commit_summary[end:])
+        commit_summary = REVIEWERS_MARKER_RE.sub('', ''.join(pieces))
+
+    if commit_description == "":
+        return commit_summary.strip()
+    else:
+        return commit_summary.strip() + "\n" + commit_description
 
 
 def parse_bugs(s):
@@ -0,0 +1,139 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+Per-request deadlines for calls to backing services.
+
+Each request is given a deadline when it starts, REQUEST_DEADLINE seconds
+from then or the number of seconds configured for its operationId in
+REQUEST_DEADLINES. Outbound calls use the time left as their timeout, and
+once none is left a DeadlineExceeded is raised instead of making the
+call, so a request whose client has given up stops holding a worker.
+"""
+import time
+
+import requests
+from connexion import ProblemException
+from flask import current_app, g, has_app_context, request
+
+DEFAULT_REQUEST_DEADLINE = 30
+
+
+class DeadlineExceeded(ProblemException):
+    """The current request ran out of time before calling a service."""
+
+    def __init__(self, service):
+        super().__init__(
+            504,
+            'Deadline Exceeded',
+            'The request took too long while waiting on {}, try again '
+            'later'.format(service.capitalize()),
+            type='https://developer.mozilla.org/en-US/docs/Web/HTTP/Status/504'
+        )  # yapf: disable
+        self.service = service
+
+
+def parse_deadlines(value):
+    """Return a dict of operationId to seconds from a configuration string.
+
+    Args:
+        value: A comma separated list of `<operationId>=<seconds>`,
+            for example 'landoapi.api.landings.post=60'.
+    """
+    deadlines = {}
+    for item in (value or '').split(','):
+        if not item.strip():
+            continue
+
+        operation_id, _, seconds = item.partition('=')
+        deadlines[operation_id.strip()] = float(seconds)
+
+    return deadlines
+
+
+def deadline_seconds(endpoint):
+    """Return the deadline in seconds of the operation served by `endpoint`.
+
+    Connexion names Flask endpoints after the operationId, with dots
+    replaced by underscores, prefixed by the name of the API blueprint.
+    """
+    deadlines = current_app.config.get('REQUEST_DEADLINES', {})
+    for operation_id, seconds in deadlines.items():
+        if (endpoint or '').endswith(operation_id.replace('.', '_')):
+            return seconds
+
+    return current_app.config.get('REQUEST_DEADLINE', DEFAULT_REQUEST_DEADLINE)
+
+
+def start_request_deadline():
+    g._deadline = time.monotonic() + deadline_seconds(request.endpoint)
+
+
+def time_remaining():
+    """Return the seconds left before the request's deadline, or None.
+
+    None is returned outside of a request, such as from the CLI, where
+    calls have no deadline.
+    """
+    if not has_app_context():
+        return None
+
+    deadline = g.get('_deadline', None)
+    if deadline is None:
+        return None
+
+    return deadline - time.monotonic()
+
+
+def outbound_timeout(service, default=None):
+    """Return the timeout to use for a call to `service`.
+
+    Args:
+        service: The name of the called service, used in errors.
+        default: The call's own timeout in seconds, if it has one.
+
+    Returns:
+        The smaller of `default` and the time left before the request's
+        deadline, or `default` if the request has no deadline.
+
+    Raises:
+        DeadlineExceeded: if the request has no time left.
+    """
+    remaining = time_remaining()
+    if remaining is None:
+        return default
+
+    if remaining <= 0:
+        raise DeadlineExceeded(service)
+
+    return remaining if default is None else min(default, remaining)
+
+
+def has_expired():
+    """Return True if the current request has a deadline and no time left."""
+    remaining = time_remaining()
+    return remaining is not None and remaining <= 0
+
+
+def raise_if_expired(service):
+    """Raise DeadlineExceeded if the request has no time left.
+
+    Call this when a call to `service` timed out, so a timeout caused by
+    the deadline is reported as such.
+    """
+    if has_expired():
+        raise DeadlineExceeded(service)
+
+
+def is_deadline_error(exc):
+    """Return True if `exc` was caused by the request's own deadline.
+
+    That is a DeadlineExceeded raised before a call, or a timeout of a
+    call whose timeout was cut short by the deadline. Neither says
+    anything about the health of the called service, so circuit
+    breakers should not count them as failures.
+    """
+    if isinstance(exc, DeadlineExceeded):
+        return True
+
+    return isinstance(exc, requests.Timeout) and has_expired()
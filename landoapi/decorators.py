@@ -2,6 +2,9 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 import functools
+import logging
+import threading
+from concurrent import futures
 
 from connexion import (
     problem,
@@ -9,8 +12,14 @@ from connexion import (
 )
 from flask import current_app, g
 
+from landoapi.api_keys import forget_api_key, verify_api_key
 from landoapi.phabricator import PhabricatorClient
 
+logger = logging.getLogger(__name__)
+
+_prefetch_executor = None
+_prefetch_executor_lock = threading.Lock()
+
 
 class require_phabricator_api_key:
     """Decorator which requires and verifies the phabricator API Key.
@@ -20,14 +29,17 @@ class require_phabricator_api_key:
     the header is not provided an HTTP 401 response will be sent.
 
     The provided API key will be verified to be valid, if it is not an
-    HTTP 403 response will be sent.
+    HTTP 403 response will be sent. Verified keys are cached for a short
+    time, and forgotten as soon as Phabricator rejects them.
 
     If the optional parameter is True and no API key is provided, a default key
     will be used. If an API key is provided it will still be verified.
 
     Decorated functions may assume X-Phabricator-API-Key header is present,
     contains a valid phabricator API key and flask.g.phabricator is a
-    PhabricatorClient using this API Key.
+    PhabricatorClient using this API Key. Identical read-only conduit
+    calls made through flask.g.phabricator during the request are only
+    sent to Phabricator once.
     """
 
     def __init__(self, optional=False):
@@ -47,11 +59,18 @@ class require_phabricator_api_key:
                     type='https://developer.mozilla.org/en-US/docs/Web/HTTP/Status/401'  # noqa: E501
                 )  # yapf: disable
 
+            config = current_app.config
+            compress_min_bytes = config.get('PHABRICATOR_COMPRESS_MIN_BYTES')
             g.phabricator = PhabricatorClient(
-                current_app.config['PHABRICATOR_URL'], api_key or
-                current_app.config['PHABRICATOR_UNPRIVILEGED_API_KEY']
+                config['PHABRICATOR_URL'],
+                api_key or config['PHABRICATOR_UNPRIVILEGED_API_KEY'],
+                memoize=True,
+                compress_min_bytes=compress_min_bytes,
+                on_auth_error=forget_api_key if api_key is not None else None,
+                hedge=config.get('PHABRICATOR_HEDGE') == 'y',
+                max_retries=config.get('PHABRICATOR_READ_RETRIES', 0)
             )
-            if api_key is not None and not g.phabricator.verify_api_token():
+            if api_key is not None and verify_api_key(g.phabricator) is None:
                 return problem(
                     403,
                     'X-Phabricator-API-Key Invalid',
@@ -71,19 +90,26 @@ class LazyValue:
         self._value = None
         self._cached = False
         self._f = f
+        self._lock = threading.Lock()
 
     def __call__(self):
-        if not self._cached:
-            args = [
-                (arg() if isinstance(arg, LazyValue) else arg)
-                for arg in self._args
-            ]
-            kwargs = {
-                k: (v() if isinstance(v, LazyValue) else v)
-                for k, v in self._kwargs.items()
-            }
-            self._value = self._f(*args, **kwargs)
-            self._cached = True
+        if self._cached:
+            return self._value
+
+        # A value shared by LazyValues evaluated in different threads by
+        # `prefetch` is only evaluated once.
+        with self._lock:
+            if not self._cached:
+                args = [
+                    (arg() if isinstance(arg, LazyValue) else arg)
+                    for arg in self._args
+                ]
+                kwargs = {
+                    k: (v() if isinstance(v, LazyValue) else v)
+                    for k, v in self._kwargs.items()
+                }
+                self._value = self._f(*args, **kwargs)
+                self._cached = True
 
         return self._value
 
@@ -122,3 +148,50 @@ class lazy:
 
     def __call__(self, *args, **kwargs):
         return functools.wraps(self._f)(LazyValue(self._f, args, kwargs))
+
+
+def get_prefetch_executor(max_workers):
+    global _prefetch_executor
+    with _prefetch_executor_lock:
+        if _prefetch_executor is None:
+            _prefetch_executor = futures.ThreadPoolExecutor(max_workers)
+
+        return _prefetch_executor
+
+
+def prefetch(*values):
+    """Evaluate independent LazyValues concurrently.
+
+    Each value is evaluated in a thread from a shared pool of
+    PREFETCH_MAX_WORKERS threads, in an app context sharing `flask.g`
+    with the current one, and this returns once every value has been
+    evaluated. Values which depend on the same LazyValue evaluate it
+    only once. The PhabricatorClient and the tracing spans on `flask.g`
+    are safe to use from several threads, values must not otherwise
+    modify `flask.g`. Sharing `flask.g` also shares the request's
+    dependency bulkhead slots, so prefetching does not take more.
+
+    Prefetching is an optimization only: a value which raised is left
+    unevaluated, so the exception is raised when the value is called.
+    Nothing is prefetched if PREFETCH_MAX_WORKERS is 0.
+
+    Only prefetch values which do not use the database, as each thread
+    would use its own database session.
+    """
+    max_workers = current_app.config.get('PREFETCH_MAX_WORKERS', 0)
+    if not max_workers or len(values) < 2:
+        return
+
+    app = current_app._get_current_object()
+    shared_g = g._get_current_object()
+
+    def evaluate(value):
+        with app.app_context() as app_context:
+            app_context.g = shared_g
+            try:
+                value()
+            except Exception as exc:
+                logger.debug('prefetch failed', exc_info=exc)
+
+    executor = get_prefetch_executor(max_workers)
+    futures.wait([executor.submit(evaluate, value) for value in values])
@@ -9,9 +9,10 @@ specification.  See https://github.com/mozilla-services/Dockerflow for details.
 import json
 import logging
 
-from flask import Blueprint, current_app, jsonify
+from flask import Blueprint, current_app, jsonify, Response
 
-from landoapi import health
+from landoapi import health, metrics
+from landoapi.storage import db
 
 logger = logging.getLogger(__name__)
 
@@ -60,3 +61,13 @@ def version():
     except (IOError, ValueError):
         # TODO log error
         return 'Unable to load version.json', 500
+
+
+@dockerflow.route('/__metrics__')
+def metrics_endpoint():
+    """Respond with the metrics of every process in the Prometheus format."""
+    metrics.update_db_pool_usage(db.engine)
+    snapshot = metrics.REGISTRY.collect(current_app.config.get('METRICS_DIR'))
+    return Response(
+        metrics.render(snapshot), mimetype='text/plain; version=0.0.4'
+    )
@@ -19,6 +19,7 @@ from landoapi.phabricator import (
     PhabricatorClient,
     PhabricatorAPIException,
 )
+from landoapi.resilience import DependencyUnavailable, TRANSPLANT
 from landoapi.storage import db
 from landoapi.transplant_client import TransplantClient
 
@@ -73,12 +74,20 @@ def check_phabricator():
         ).call_conduit('conduit.ping')
     except PhabricatorAPIException as exc:
         return ['PhabricatorAPIException: {!s}'.format(exc)]
+    except DependencyUnavailable as exc:
+        return ['DependencyUnavailable: {}'.format(exc.reason)]
 
     return []
 
 
 @health_check('transplant')
 def check_transplant():
+    # Transplant is still pinged while its circuit breaker is open, the
+    # ping is cheap and shows whether it has recovered.
+    errors = []
+    if TRANSPLANT.breaker.state != TRANSPLANT.breaker.CLOSED:
+        errors.append('Circuit breaker {}'.format(TRANSPLANT.breaker.state))
+
     tc = TransplantClient(
         current_app.config['TRANSPLANT_URL'],
         current_app.config['TRANSPLANT_USERNAME'],
@@ -87,12 +96,12 @@ def check_transplant():
     try:
         resp = tc.ping()
     except requests.RequestException as exc:
-        return ['RequestException: {!s}'.format(exc)]
+        return errors + ['RequestException: {!s}'.format(exc)]
 
     if resp.status_code != 200:
-        return ['Unexpected Status Code: {}'.format(resp.status_code)]
+        errors.append('Unexpected Status Code: {}'.format(resp.status_code))
 
-    return []
+    return errors
 
 
 @health_check('cache')
@@ -53,6 +53,43 @@ def build_patch_for_revision(
     )
 
 
+def build_patch_chunks_for_revision(
+    diff, author_name, author_email, commit_message, date_modified
+):
+    """Generate a 'hg export' patch as a sequence of bytes chunks.
+
+    The chunks joined together are byte-identical to the utf-8 encoding
+    of `build_patch_for_revision`, without building an intermediate
+    string holding the whole patch. They can be passed directly to the
+    `writelines` method of a binary file-like object.
+
+    Args:
+        diff: A string or bytes holding a Git-formatted patch. A bytes
+            diff is not copied.
+        author: A string with information about the patch's author.
+        commit_message: A string containing the full commit message.
+        date_modified: (int) A number of seconds since Unix Epoch representing
+            the date when revision was modified.
+
+    Returns:
+        A tuple of bytes-like chunks containing a patch in 'hg export'
+        format.
+    """
+    message_lines = commit_message.strip().splitlines()
+    header = _HG_EXPORT_HEADER.format(
+        author_name=_no_line_breaks(author_name),
+        author_email=_no_line_breaks(author_email),
+        patchdate=_no_line_breaks('%s +0000' % date_modified),
+        diff_start_line=len(message_lines) + _HG_EXPORT_HEADER_LENGTH + 1,
+    )
+
+    return (
+        header.encode('utf-8'), b'\n',
+        '\n'.join(message_lines).encode('utf-8'), b'\n\n', memoryview(diff)
+        if isinstance(diff, bytes) else diff.encode('utf-8'),
+    )
+
+
 def _no_line_breaks(s):
     """Return s with all line breaks removed."""
     return ''.join(s.strip().splitlines())
@@ -8,8 +8,21 @@ import time
 from connexion import FlaskApi, problem
 from flask import current_app, g, request
 
+from landoapi.deadline import start_request_deadline
+from landoapi.metrics import (
+    REGISTRY,
+    REQUEST_DURATION,
+    update_db_pool_usage,
+)
 from landoapi.phabricator import PhabricatorAPIException
+from landoapi.resilience import DependencyUnavailable
 from landoapi.sentry import sentry
+from landoapi.storage import db
+from landoapi.tracing import (
+    export_request_trace,
+    span_summary,
+    start_request_trace,
+)
 
 logger = logging.getLogger(__name__)
 request_logger = logging.getLogger('request.summary')
@@ -41,6 +54,8 @@ def set_app_wide_headers(response):
 
 def request_logging_before_request():
     g._request_start_timestamp = time.time()
+    start_request_trace()
+    start_request_deadline()
 
 
 def request_logging_after_request(response):
@@ -56,9 +71,32 @@ def request_logging_after_request(response):
     start = g.get('_request_start_timestamp', None)
     if start is not None:
         summary['t'] = int(1000 * (time.time() - start))
+        REQUEST_DURATION.observe(
+            time.time() - start,
+            operation=request.endpoint or 'unknown',
+            code=response.status_code
+        )
+
+    phab = g.get('phabricator', None)
+    if phab is not None:
+        summary['conduit_calls'] = phab.stats['calls']
+        summary['conduit_calls_saved'] = phab.stats['memoized_calls']
+        summary['conduit_calls_hedged'] = phab.stats['hedged_calls']
+        summary['conduit_calls_retried'] = phab.stats['retried_calls']
+        summary['conduit_transfer'] = phab.transfer_stats
+
+    summary['spans'] = span_summary()
 
     request_logger.info('request summary', extra=summary)
 
+    if start is not None:
+        export_request_trace(start)
+
+    metrics_dir = current_app.config.get('METRICS_DIR')
+    if metrics_dir:
+        update_db_pool_usage(db.engine)
+        REGISTRY.maybe_flush(metrics_dir)
+
     return response
 
 
@@ -82,6 +120,21 @@ def handle_phabricator_api_exception(exc):
     )
 
 
+def handle_dependency_unavailable(exc):
+    logger.warning(
+        'dependency unavailable',
+        extra={
+            'dependency': exc.name,
+            'reason': exc.reason,
+        }
+    )
+    response = FlaskApi.get_response(
+        problem(exc.status, exc.title, exc.detail, type=exc.type)
+    )
+    response.headers['Retry-After'] = str(exc.retry_after)
+    return response
+
+
 def initialize_hooks(flask_app):
     flask_app.after_request(set_app_wide_headers)
 
@@ -92,3 +145,7 @@ def initialize_hooks(flask_app):
         PhabricatorAPIException,
         handle_phabricator_api_exception,
     )
+    flask_app.register_error_handler(
+        DependencyUnavailable,
+        handle_dependency_unavailable,
+    )
@@ -0,0 +1,153 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+Idempotency keys for requests which are expensive to repeat.
+
+A client may send an `Idempotency-Key` header with a request it might
+retry. The first request with a key claims it in the cache while it is
+handled, and its successful response is stored for
+IDEMPOTENT_RESPONSE_TIMEOUT seconds. A retry with the same key gets the
+stored response back without being handled again, or waits for the
+response while the first request is still being handled, unless its
+body differs from the first request's.
+
+Only successful responses are stored, a retry after an error is handled
+again. Keys are scoped to the requesting user and api key, and reusing a
+key for a different request body is an error.
+"""
+import functools
+import hashlib
+import json
+import time
+
+from connexion import problem
+from flask import g, request
+
+from landoapi.cache import cache
+from landoapi.deadline import time_remaining
+
+# Seconds a successful response is returned for retries of its request.
+IDEMPOTENT_RESPONSE_TIMEOUT = 24 * 60 * 60
+
+# Seconds a key is claimed for while its first request is handled. This
+# bounds how long a key stays claimed by a process which died while
+# handling it.
+IDEMPOTENCY_CLAIM_TIMEOUT = 120
+
+# Seconds between checks for the response of an in-flight request.
+IDEMPOTENCY_POLL_INTERVAL = 0.1
+
+
+def idempotency_cache_key(auth0_user, api_token, key):
+    scope = hashlib.sha256(
+        '\n'.join((auth0_user.email or '', api_token, key)).encode('utf-8')
+    ).hexdigest()
+    return 'idempotency_{}'.format(scope)
+
+
+def request_fingerprint(data):
+    body = json.dumps(data, sort_keys=True)
+    return hashlib.sha256(body.encode('utf-8')).hexdigest()
+
+
+def idempotent(f):
+    """Decorator making a handler taking a `data` body idempotent.
+
+    Must be applied after the decorators setting `flask.g.auth0_user`
+    and `flask.g.phabricator`.
+    """
+
+    @functools.wraps(f)
+    def wrapped(data, *args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if not key:
+            return f(data, *args, **kwargs)
+
+        cache_key = idempotency_cache_key(
+            g.auth0_user, g.phabricator.api_token, key
+        )
+        claim_key = '{}_claim'.format(cache_key)
+        fingerprint = request_fingerprint(data)
+
+        # Wait for an in-flight request at most until this request's
+        # deadline, or as long as a key may be claimed without one.
+        wait = time_remaining()
+        if wait is None:
+            wait = IDEMPOTENCY_CLAIM_TIMEOUT
+
+        wait_until = time.monotonic() + wait
+        while True:
+            stored = None
+            with cache.suppress_failure():
+                stored = cache.get(cache_key)
+
+            if stored is not None:
+                return _replay(stored, fingerprint)
+
+            # Without a cache every request is handled.
+            claimed = True
+            with cache.suppress_failure():
+                claimed = cache.add(
+                    claim_key, fingerprint, timeout=IDEMPOTENCY_CLAIM_TIMEOUT
+                )
+
+            if claimed:
+                break
+
+            claimed_by = None
+            with cache.suppress_failure():
+                claimed_by = cache.get(claim_key)
+
+            if claimed_by is not None and claimed_by != fingerprint:
+                return _key_reused()
+
+            if time.monotonic() + IDEMPOTENCY_POLL_INTERVAL >= wait_until:
+                return problem(
+                    409,
+                    'Request In Progress',
+                    'A request with the same Idempotency-Key is still being '
+                    'processed, retry it later.',
+                    type='https://developer.mozilla.org/en-US/docs/Web/HTTP/Status/409'  # noqa
+                )  # yapf: disable
+
+            time.sleep(IDEMPOTENCY_POLL_INTERVAL)
+
+        try:
+            result = f(data, *args, **kwargs)
+            if (
+                isinstance(result, tuple) and len(result) == 2 and
+                200 <= result[1] < 300
+            ):
+                with cache.suppress_failure():
+                    cache.set(
+                        cache_key, {
+                            'fingerprint': fingerprint,
+                            'body': result[0],
+                            'status': result[1],
+                        },
+                        timeout=IDEMPOTENT_RESPONSE_TIMEOUT
+                    )
+
+            return result
+        finally:
+            with cache.suppress_failure():
+                cache.delete(claim_key)
+
+    return wrapped
+
+
+def _key_reused():
+    return problem(
+        422,
+        'Idempotency Key Reused',
+        'The Idempotency-Key was already used for a different request.',
+        type='https://developer.mozilla.org/en-US/docs/Web/HTTP/Status/422'
+    )
+
+
+def _replay(stored, fingerprint):
+    if stored['fingerprint'] != fingerprint:
+        return _key_reused()
+
+    return stored['body'], stored['status'], {'Idempotent-Replayed': 'true'}
@@ -6,17 +6,21 @@ import json
 
 from connexion import ProblemException
 
+from landoapi.cache import cache
 from landoapi.decorators import lazy
+from landoapi.mirror import get_mirrored, get_mirrored_many
 from landoapi.models.landing import Landing
 from landoapi.phabricator import (
     collate_reviewer_attachments,
     PhabricatorClient,
-    result_list_to_phid_dict,
+    phid_type,
     ReviewerStatus,
+    RevisionQueryProfile,
     RevisionStatus,
 )
-from landoapi.repos import get_repos_for_env
+from landoapi.repos import REPOSITORY_INDEX
 from landoapi.reviews import calculate_review_extra_state, reviewer_identity
+from landoapi.stacks import RevisionStack, search_stack_edges
 
 
 def tokens_are_equal(t1, t2):
@@ -54,6 +58,26 @@ class LandingAssessment:
             'blockers': blockers,
         }
 
+    @classmethod
+    def from_dict(cls, details):
+        """Return an assessment from the output of `to_dict()`.
+
+        Problems are rebuilt as instances of the LandingProblem
+        subclass with the matching id, so the result produces the
+        same dict and confirmation_token as the original assessment.
+        """
+        problem_types = {p.id: p for p in LandingProblem.__subclasses__()}
+        return cls(
+            warnings=[
+                problem_types[w['id']](w['message'])
+                for w in details['warnings']
+            ],
+            blockers=[
+                problem_types[b['id']](b['message'])
+                for b in details['blockers']
+            ],
+        )
+
     @staticmethod
     def hash_warning_list(warnings):
         """Return a hash of a serialized warning list.
@@ -518,6 +542,119 @@ def check_landing_conditions(
     return assessment
 
 
+ASSESSMENT_CACHE_TIMEOUT = 60
+ASSESSMENT_CACHE_VERSION = 1
+
+
+def assessment_cache_key(
+    phabricator, auth0_user, diff_id, revision, latest_landing
+):
+    """Return a cache key fingerprinting the state of a landing assessment.
+
+    The fingerprint covers the inputs of `check_landing_conditions`:
+    the revision's dateModified (which changes with its reviewers,
+    repository and active diff), the requested diff, the requesting
+    user's email and groups, the api key used to view the revision and
+    the version of the revision's most recently updated Landing. Any
+    pingback or new landing changes that version, so assessments cached
+    before it are never used again.
+
+    The state of parent revisions is not part of the fingerprint, it is
+    bounded by ASSESSMENT_CACHE_TIMEOUT instead.
+
+    Args:
+        phabricator: A PhabricatorClient instance.
+        auth0_user: A landoapi.auth.A0User for the requesting user.
+        diff_id: The integer id of the diff being assessed.
+        revision: A dict of the revision data just as it is returned
+            by Phabricator, or None if the revision does not exist.
+        latest_landing: The result of `Landing.latest` for the revision.
+
+    Returns:
+        A string cache key, or None if the revision does not exist.
+    """
+    if revision is None:
+        return None
+
+    fingerprint = {
+        'version': ASSESSMENT_CACHE_VERSION,
+        'api_token': hashlib.sha256(
+            phabricator.api_token.encode('utf-8')
+        ).hexdigest(),
+        'revision_phid': PhabricatorClient.expect(revision, 'phid'),
+        'date_modified': PhabricatorClient.expect(
+            revision, 'fields', 'dateModified'
+        ),
+        'diff_id': diff_id,
+        'email': auth0_user.email,
+        'groups': sorted(auth0_user.groups),
+        'landing': None if latest_landing is None else [
+            latest_landing.id,
+            latest_landing.status.value,
+            latest_landing.updated_at.isoformat(),
+        ],
+    }  # yapf: disable
+    return 'landing_assessment_{}'.format(
+        hashlib.sha256(
+            json.dumps(fingerprint, sort_keys=True).encode('utf-8')
+        ).hexdigest()
+    )
+
+
+def get_cached_assessment(cache_key):
+    """Return the LandingAssessment cached under `cache_key`, or None."""
+    if cache_key is None:
+        return None
+
+    details = None
+    with cache.suppress_failure():
+        details = cache.get(cache_key)
+
+    return None if details is None else LandingAssessment.from_dict(details)
+
+
+def cache_assessment(cache_key, assessment):
+    """Cache a LandingAssessment under `cache_key`."""
+    if cache_key is None:
+        return
+
+    with cache.suppress_failure():
+        cache.set(
+            cache_key, assessment.to_dict(), timeout=ASSESSMENT_CACHE_TIMEOUT
+        )
+
+
+def merge_stack_assessments(assessments):
+    """Return a single LandingAssessment for the revisions of a stack.
+
+    Each problem's message is prefixed with the revision it was found
+    on. As for a single revision, warnings are dropped if any revision
+    is blocked.
+
+    Args:
+        assessments: A list of (revision id, LandingAssessment) tuples in
+            the order the revisions land.
+    """
+    if len(assessments) == 1:
+        return assessments[0][1]
+
+    merged = LandingAssessment()
+    for revision_id, assessment in assessments:
+        merged.blockers.extend(
+            type(b)('D{}: {}'.format(revision_id, b.message))
+            for b in assessment.blockers
+        )
+        merged.warnings.extend(
+            type(w)('D{}: {}'.format(revision_id, w.message))
+            for w in assessment.warnings
+        )
+
+    if merged.blockers:
+        merged.warnings = []
+
+    return merged
+
+
 @lazy
 def lazy_get_latest_diff(phabricator, revision):
     """Return the latest diff as define by the Phabricator API.
@@ -527,12 +664,15 @@ def lazy_get_latest_diff(phabricator, revision):
         revision: A dict of the revision data just as it is returned
             by Phabricator.
     """
+    diff_phid = phabricator.expect(revision, 'fields', 'diffPHID')
+    diff = get_mirrored('DIFF', phid=diff_phid)
+    if diff is not None:
+        return diff
+
     return phabricator.single(
         phabricator.call_conduit(
             'differential.diff.search',
-            constraints={
-                'phids': [phabricator.expect(revision, 'fields', 'diffPHID')]
-            },
+            constraints={'phids': [diff_phid]},
         ), 'data'
     )
 
@@ -549,17 +689,13 @@ def lazy_get_revision(phabricator, revision_id):
         The revision data from the Phabricator API for the provided
         `revision_id`. If the revision is not found None is returned.
     """
-    revision = phabricator.call_conduit(
-        'differential.revision.search',
-        constraints={'ids': [revision_id]},
-        attachments={
-            'reviewers': True,
-            'reviewers-extra': True,
-        }
+    revision = get_mirrored('DREV', object_id=revision_id)
+    if revision is not None:
+        return revision
+
+    return phabricator.get_revision(
+        revision_id, profile=RevisionQueryProfile.FULL
     )
-    revision = phabricator.expect(revision, 'data')
-    revision = phabricator.single(revision, none_when_empty=True)
-    return revision
 
 
 @lazy
@@ -575,6 +711,27 @@ def lazy_get_revision_status(revision):
     )
 
 
+def search_diff(phabricator, diff_id):
+    """Return the differential.diff.search data of a diff, or None.
+
+    Args:
+        phabricator: A PhabricatorClient instance.
+        diff_id: The integer id of the diff.
+    """
+    diff = get_mirrored('DIFF', object_id=diff_id)
+    if diff is not None:
+        return diff
+
+    return phabricator.single(
+        phabricator.call_conduit(
+            'differential.diff.search',
+            constraints={'ids': [diff_id]},
+        ),
+        'data',
+        none_when_empty=True
+    )
+
+
 @lazy
 def lazy_get_diff(phabricator, diff_id, latest_diff):
     """Return diff objects as defined by the Phabricator API.
@@ -591,14 +748,7 @@ def lazy_get_diff(phabricator, diff_id, latest_diff):
     """
     latest_diff_id = phabricator.expect(latest_diff, 'id')
     if diff_id is not None and diff_id != latest_diff_id:
-        diff = phabricator.single(
-            phabricator.call_conduit(
-                'differential.diff.search',
-                constraints={'ids': [diff_id]},
-            ),
-            'data',
-            none_when_empty=True
-        )
+        diff = search_diff(phabricator, diff_id)
     else:
         diff = latest_diff
 
@@ -657,113 +807,178 @@ def lazy_get_repository(phabricator, revision):
 
 
 @lazy
-def lazy_get_landing_repo(repository, env):
-    """Return a landoapi.repos.Repo for the provided repository.
+def lazy_get_landing_repo(phabricator, revision, env):
+    """Return a landoapi.repos.Repo for the provided revision.
+
+    The repository is resolved with the process wide repository index,
+    so conduit is only called for repositories missing from it.
 
     Args:
-        repository: A dict of the repository data just as it is returned
+        phabricator: A PhabricatorClient instance.
+        revision: A dict of the revision data just as it is returned
             by Phabricator.
         env: The environment Lando API is running in.
 
     Returns:
-        A landoapi.repos.Repo corresponding to the provided Phabricator
-        repository data or None if the repository is not configured.
+        A landoapi.repos.Repo corresponding to the revision's repository
+        or None if the revision has no repository or the repository is
+        not configured.
 
     Raises:
         landoapi.phabricator.PhabricatorCommunicationException:
-            If the provided repository data does not adhere to the format
-            expected from Phabricator. This should almost never happen
-            when passing a repository response from phabricator unless
-            something has gone seriously wrong.
+            If the revision is associated with a repository but the PHID
+            cannot be found when searching. This should almost never
+            happen unless something has gone seriously wrong.
     """
-    if not repository:
+    repo_phid = phabricator.expect(revision, 'fields', 'repositoryPHID')
+    if not repo_phid:
         return None
 
-    shortname = PhabricatorClient.expect(repository, 'fields', 'shortName')
-    return get_repos_for_env(env).get(shortname)
+    return REPOSITORY_INDEX.get(phabricator, env, repo_phid)
+
+
+STACK_CACHE_TIMEOUT = 600
+
+
+def stack_cache_key(api_token, revision_phid, date_modified):
+    return 'revision_stack_{phid}_{modified}_{token_hash}'.format(
+        phid=revision_phid,
+        modified=date_modified,
+        token_hash=hashlib.sha256(api_token.encode('utf-8')).hexdigest()
+    )
 
 
 @lazy
-def lazy_get_open_parents(phabricator, revision):
-    """Return a list of open parents for a revision.
+def lazy_get_stack(phabricator, revision):
+    """Return the RevisionStack the revision is part of.
+
+    The stack's edges are cached per revision `dateModified`, which
+    changes whenever the revision's parents or children change. The
+    status of every revision in the stack is always fetched fresh.
 
     Args:
         phabricator: A PhabricatorClient instance.
         revision: A dict of the revision data just as it is returned
             by Phabricator.
     """
-    phids = phabricator.call_conduit(
-        'edge.search',
-        sourcePHIDs=[phabricator.expect(revision, 'phid')],
-        types=['revision.parent']
+    phid = phabricator.expect(revision, 'phid')
+    key = stack_cache_key(
+        phabricator.api_token, phid,
+        phabricator.expect(revision, 'fields', 'dateModified')
     )
-    phids = phabricator.expect(phids, 'data')
-    phids = [phabricator.expect(p, 'destinationPHID') for p in phids]
-
-    if not phids:
-        return []
 
-    open_parents = phabricator.call_conduit(
-        'differential.revision.search',
-        constraints={
-            'statuses': ['open()'],
-            'phids': phids,
-        }
+    cached = None
+    with cache.suppress_failure():
+        cached = cache.get(key)
+
+    if cached is None:
+        edges, truncated = search_stack_edges(phabricator, phid)
+        cached = {'edges': edges, 'truncated': truncated}
+        with cache.suppress_failure():
+            cache.set(key, cached, timeout=STACK_CACHE_TIMEOUT)
+
+    phids = {p for edge in cached['edges'] for p in edge} - {phid}
+    revisions = phabricator.resolve_phids(phids) if phids else {}
+    revisions[phid] = revision
+    return RevisionStack(
+        cached['edges'], revisions, truncated=cached['truncated']
     )
-    open_parents = phabricator.expect(open_parents, 'data')
-    return open_parents
 
 
 @lazy
-def lazy_user_search(phabricator, user_phids):
-    """Return a dictionary mapping phid to user information from a user.search.
+def lazy_get_open_parents(phabricator, stack, revision, landing_before=()):
+    """Return a list of open parents for a revision.
 
     Args:
         phabricator: A PhabricatorClient instance.
-        user_phids: A list of user phids to search.
+        stack: The RevisionStack the revision is part of.
+        revision: A dict of the revision data just as it is returned
+            by Phabricator.
+        landing_before: Integer ids of the revisions landing before this
+            one in the same request, which are not open dependencies.
     """
-    if not user_phids:
-        return {}
+    return [
+        parent
+        for parent in stack.open_parents(phabricator.expect(revision, 'phid'))
+        if phabricator.expect(parent, 'id') not in landing_before
+    ]
+
 
-    users = phabricator.call_conduit(
-        'user.search', constraints={'phids': user_phids}
+IDENTITY_CACHE_TIMEOUT = 300
+
+# The PHID types which may appear as a revision's author or reviewers and
+# can be rendered by `landoapi.reviews.reviewer_identity`.
+IDENTITY_PHID_TYPES = ('USER', 'PROJ')
+
+
+def identity_cache_key(api_token, phid):
+    return 'phabricator_identity_{phid}_{token_hash}'.format(
+        phid=phid,
+        token_hash=hashlib.sha256(api_token.encode('utf-8')).hexdigest()
     )
-    return result_list_to_phid_dict(phabricator.expect(users, 'data'))
 
 
 @lazy
-def lazy_project_search(phabricator, project_phids):
-    """Return a dictionary mapping phid to project data from a project.search.
+def lazy_identity_search(phabricator, phids):
+    """Return a tuple of dicts mapping phid to user and project data.
+
+    Only user and project PHIDs are resolved, each type with a single
+    search. In endpoints allowed to read the Phabricator mirror, results
+    are read from it if it has them. Other results are cached across
+    requests per PHID, keyed by the api token, so data the token cannot
+    see is never shared.
 
     Args:
         phabricator: A PhabricatorClient instance.
-        project_phids: A list of project phids to search.
-    """
-    if not project_phids:
-        return {}
+        phids: A list of user and project phids to search.
 
-    projects = phabricator.call_conduit(
-        'project.search', constraints={'phids': project_phids}
+    Returns:
+        A 2-tuple of (users, projects) where each is a dictionary
+        mapping phid to data from user.search and project.search.
+    """
+    phids = sorted({p for p in phids if phid_type(p) in IDENTITY_PHID_TYPES})
+    found = get_mirrored_many(phids)
+    phids = [p for p in phids if p not in found]
+    keys = [identity_cache_key(phabricator.api_token, p) for p in phids]
+
+    cached = []
+    if keys:
+        with cache.suppress_failure():
+            cached = cache.get_many(*keys)
+
+    found.update(
+        {p: data
+         for p, data in zip(phids, cached) if data is not None}
     )
-    return result_list_to_phid_dict(phabricator.expect(projects, 'data'))
+    missing = [p for p in phids if p not in found]
+    if missing:
+        resolved = phabricator.resolve_phids(missing)
+        found.update(resolved)
+        with cache.suppress_failure():
+            cache.set_many(
+                {
+                    identity_cache_key(phabricator.api_token, p): data
+                    for p, data in resolved.items()
+                },
+                timeout=IDENTITY_CACHE_TIMEOUT
+            )
+
+    users = {p: d for p, d in found.items() if phid_type(p) == 'USER'}
+    projects = {p: d for p, d in found.items() if phid_type(p) == 'PROJ'}
+    return users, projects
 
 
 @lazy
 def lazy_reviewers_search(phabricator, reviewers):
-    """Return a dictionary mapping phid to user information for reviewers.
+    """Return a tuple of dicts mapping phid to user and project reviewers.
 
     Args:
         phabricator: A PhabricatorClient instance.
         reviewers: A dict of reviewer attachment data as returned by
             `landoapi.phabricator.collate_reviewer_attachments`.
     """
-    phids = list(reviewers.keys())
-
-    # Immediately execute the lazy functions.
-    return (
-        lazy_user_search(phabricator, phids)(),
-        lazy_project_search(phabricator, phids)()
-    )
+    # Immediately execute the lazy function.
+    return lazy_identity_search(phabricator, list(reviewers.keys()))()
 
 
 @lazy
@@ -1,8 +1,35 @@
+import atexit
+import copy
 import json
 import logging
+import logging.handlers
+import queue
 import socket
+import threading
 import traceback
 
+try:
+    import rapidjson
+except ImportError:
+    rapidjson = None
+
+# Extra fields which cannot be serialized are logged as their repr()
+# instead of failing the log call.
+_encoder = json.JSONEncoder(default=repr)
+
+
+def dumps(obj):
+    """Serialize `obj` to JSON, using rapidjson when it is installed."""
+    if rapidjson is not None:
+        try:
+            return rapidjson.dumps(obj, default=repr)
+        except (TypeError, ValueError, OverflowError):
+            # rapidjson is stricter than json, e.g. about non-string
+            # keys, so fall back for the rare records it rejects.
+            pass
+
+    return _encoder.encode(obj)
+
 
 class MozLogFormatter(logging.Formatter):
     """A mozlog logging formatter.
@@ -31,7 +58,7 @@ class MozLogFormatter(logging.Formatter):
         "CRITICAL": SL_CRIT,
     }
 
-    BUILTIN_LOGRECORD_ATTRIBUTES = set(
+    BUILTIN_LOGRECORD_ATTRIBUTES = frozenset(
         (
             'args', 'asctime', 'created', 'exc_info', 'exc_text', 'filename',
             'funcName', 'levelname', 'levelno', 'lineno', 'module', 'msecs',
@@ -77,7 +104,7 @@ class MozLogFormatter(logging.Formatter):
 
     def serialize(self, mozlog_record):
         """Serialize a mozlog record."""
-        return json.dumps(mozlog_record, sort_keys=True)
+        return dumps(mozlog_record)
 
 
 class PrettyMozLogFormatter(MozLogFormatter):
@@ -85,4 +112,102 @@ class PrettyMozLogFormatter(MozLogFormatter):
 
     def serialize(self, mozlog_record):
         """Serialize a mozlog record."""
-        return json.dumps(mozlog_record, sort_keys=True, indent=2)
+        return json.dumps(
+            mozlog_record, sort_keys=True, indent=2, default=repr
+        )
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """A QueueHandler which drops records instead of blocking when full.
+
+    Records are formatted before being queued, so the listener thread
+    only writes strings and never sees extras mutated after logging.
+    Dropped records are counted, and the count is logged as a warning
+    once the queue has room again.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.dropped = 0
+        self._unreported = 0
+        self._lock = threading.Lock()
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = self.format(record)
+        record.args = None
+        record.exc_info = None
+        record.exc_text = None
+        record.stack_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+                self._unreported += 1
+            return
+
+        if self._unreported:
+            with self._lock:
+                unreported, self._unreported = self._unreported, 0
+            self.handle(
+                logging.makeLogRecord(
+                    {
+                        'name': __name__,
+                        'levelno': logging.WARNING,
+                        'levelname': 'WARNING',
+                        'msg': 'dropped log records',
+                        'dropped': unreported,
+                    }
+                )
+            )
+
+
+class BlockingStopQueueListener(logging.handlers.QueueListener):
+    """A QueueListener which waits for room in a full queue to stop."""
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+
+_listener = None
+
+
+def start_async_logging(handler, loggers, *, maxsize):
+    """Write the records of `loggers` to `handler` from a separate thread.
+
+    The loggers' handlers are replaced by a DroppingQueueHandler, which
+    formats records using `handler`'s formatter and puts them on a queue
+    of at most `maxsize` records. A listener thread writes the queued
+    records to `handler`, so logging never blocks on a slow stream. The
+    queue is drained when the process exits.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+
+    log_queue = queue.Queue(maxsize)
+    queue_handler = DroppingQueueHandler(log_queue)
+    queue_handler.setFormatter(handler.formatter)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+
+    for logger in loggers:
+        logger.handlers = [
+            queue_handler if h is handler else h for h in logger.handlers
+        ]
+
+    _listener = BlockingStopQueueListener(log_queue, handler)
+    _listener.start()
+    return queue_handler
+
+
+@atexit.register
+def stop_async_logging():
+    """Stop the listener started by `start_async_logging`, if any."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -0,0 +1,439 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+In-process metrics, exposed in the Prometheus text format.
+
+Each process records into its own registry. When METRICS_DIR is set,
+processes periodically write a snapshot of their registry to a file in
+that directory, and the metrics endpoint merges the snapshots of every
+process, so any uWSGI worker can serve the metrics of all of them. The
+counters and histograms of processes which have exited are folded into
+a single snapshot, so restarted workers do not leave files behind.
+"""
+import atexit
+import collections
+import contextlib
+import fcntl
+import json
+import logging
+import math
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Seconds between writes of this process' snapshot to METRICS_DIR.
+FLUSH_INTERVAL = 5
+
+# Snapshots are named by pid and a random instance id, so a process
+# reusing the pid of an exited one never replaces its snapshot.
+SNAPSHOT_FILENAME_FORMAT = 'metrics-{pid}-{instance}.json'
+SNAPSHOT_FILENAME_RE = re.compile(r'^metrics-(\d+)-([0-9a-f]+)\.json$')
+
+# The counters and histograms of every process which has exited.
+DEAD_SNAPSHOT_FILENAME = 'metrics-dead.json'
+
+LOCK_FILENAME = 'metrics.lock'
+
+
+class Registry:
+    """A collection of metrics, keyed by name."""
+
+    def __init__(self):
+        self._metrics = collections.OrderedDict()
+        self._last_flush = 0
+        self._instance = None
+        self._instance_pid = None
+
+    def register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError('Duplicate metric {}'.format(metric.name))
+
+        self._metrics[metric.name] = metric
+
+    def snapshot(self):
+        """Return a JSON serializable snapshot of every metric."""
+        return {
+            name: metric.snapshot()
+            for name, metric in self._metrics.items()
+        }
+
+    def snapshot_filename(self):
+        """Return the name of this process' snapshot file."""
+        pid = os.getpid()
+        if self._instance_pid != pid:
+            # A forked worker must not write to its parent's snapshot.
+            self._instance = uuid.uuid4().hex
+            self._instance_pid = pid
+
+        return SNAPSHOT_FILENAME_FORMAT.format(
+            pid=pid, instance=self._instance
+        )
+
+    def flush(self, directory):
+        """Atomically write this process' snapshot to `directory`."""
+        _write_snapshot(
+            os.path.join(directory, self.snapshot_filename()), self.snapshot()
+        )
+        self._last_flush = time.monotonic()
+
+    def maybe_flush(self, directory, *, force=False):
+        """Flush to `directory` if FLUSH_INTERVAL has passed."""
+        if (
+            not force and
+            time.monotonic() - self._last_flush < FLUSH_INTERVAL
+        ):
+            return
+
+        try:
+            self.flush(directory)
+        except OSError as exc:
+            logger.warning(
+                'could not flush metrics',
+                extra={'directory': directory},
+                exc_info=exc
+            )
+
+    def collect(self, directory=None):
+        """Return the merged snapshots of every process.
+
+        Without a `directory` only this process' metrics are returned.
+        Gauges from processes which are no longer running are dropped,
+        while their counters and histograms are kept.
+        """
+        if not directory:
+            return self.snapshot()
+
+        self.maybe_flush(directory, force=True)
+        try:
+            with _locked(directory):
+                prune_snapshots(directory)
+        except OSError as exc:
+            logger.warning(
+                'could not prune metrics',
+                extra={'directory': directory},
+                exc_info=exc
+            )
+
+        merged = {}
+        for filename in sorted(os.listdir(directory)):
+            match = SNAPSHOT_FILENAME_RE.match(filename)
+            if match is None and filename != DEAD_SNAPSHOT_FILENAME:
+                continue
+
+            snapshot = _read_snapshot(os.path.join(directory, filename))
+            if snapshot is None:
+                continue
+
+            alive = match is not None and _is_alive(int(match.group(1)))
+            merge_snapshot(merged, snapshot, alive=alive)
+
+        return merged
+
+
+def prune_snapshots(directory):
+    """Fold the snapshots of exited processes into the dead snapshot.
+
+    A snapshot belongs to an exited process if its pid is not running,
+    or if a newer snapshot has the same pid, which was then reused. The
+    counters and histograms of these snapshots are added to
+    DEAD_SNAPSHOT_FILENAME and the snapshots are deleted. Must be
+    called with the directory locked.
+    """
+    by_pid = {}
+    for filename in os.listdir(directory):
+        match = SNAPSHOT_FILENAME_RE.match(filename)
+        if match is None:
+            continue
+
+        try:
+            mtime = os.stat(os.path.join(directory, filename)).st_mtime
+        except FileNotFoundError:
+            continue
+
+        by_pid.setdefault(int(match.group(1)), []).append((mtime, filename))
+
+    dead = []
+    for pid, snapshots in by_pid.items():
+        snapshots.sort()
+        dead.extend(snapshots if not _is_alive(pid) else snapshots[:-1])
+
+    if not dead:
+        return
+
+    dead_path = os.path.join(directory, DEAD_SNAPSHOT_FILENAME)
+    totals = _read_snapshot(dead_path) or {}
+    for _, filename in dead:
+        snapshot = _read_snapshot(os.path.join(directory, filename))
+        if snapshot is not None:
+            merge_snapshot(totals, snapshot, alive=False)
+
+    _write_snapshot(dead_path, totals)
+    for _, filename in dead:
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(os.path.join(directory, filename))
+
+
+@contextlib.contextmanager
+def _locked(directory):
+    with open(os.path.join(directory, LOCK_FILENAME), 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _read_snapshot(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_snapshot(path, snapshot):
+    with tempfile.NamedTemporaryFile(
+        'w', dir=os.path.dirname(path), delete=False
+    ) as f:
+        json.dump(snapshot, f)
+
+    os.replace(f.name, path)
+
+
+def _is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+
+    return True
+
+
+def merge_snapshot(merged, snapshot, *, alive=True):
+    """Add the samples of `snapshot` into `merged`."""
+    for name, metric in snapshot.items():
+        if metric['type'] == 'gauge' and not alive:
+            continue
+
+        target = merged.setdefault(name, dict(metric, samples=[]))
+        samples = {tuple(labels): value for labels, value in target['samples']}
+        for labels, value in metric['samples']:
+            key = tuple(labels)
+            if key not in samples:
+                samples[key] = value
+            elif isinstance(value, list):
+                samples[key] = [a + b for a, b in zip(samples[key], value)]
+            else:
+                samples[key] += value
+
+        target['samples'] = [[list(k), v] for k, v in samples.items()]
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=(), *, registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        (registry or REGISTRY).register(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(
+                'Expected labels {}, got {}'.
+                format(sorted(self.labelnames), sorted(labels))
+            )
+
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def snapshot(self):
+        with self._lock:
+            samples = [
+                [list(k), list(v) if isinstance(v, list) else v]
+                for k, v in self._values.items()
+            ]
+
+        return {
+            'type': self.type,
+            'help': self.documentation,
+            'labelnames': list(self.labelnames),
+            'samples': samples,
+        }
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(Metric):
+    """A histogram of observed values.
+
+    Each sample is a list of the count of observations in each bucket,
+    followed by the sum and count of all observations.
+    """
+    type = 'histogram'
+
+    def __init__(self, *args, buckets=DEFAULT_BUCKETS, **kwargs):
+        self.buckets = tuple(buckets)
+        super().__init__(*args, **kwargs)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            sample = self._values.get(key)
+            if sample is None:
+                sample = self._values[key] = [0] * (len(self.buckets) + 3)
+
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    sample[i] += 1
+                    break
+            else:
+                sample[len(self.buckets)] += 1
+
+            sample[-2] += value
+            sample[-1] += 1
+
+    def snapshot(self):
+        snapshot = super().snapshot()
+        snapshot['buckets'] = list(self.buckets)
+        return snapshot
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+
+    return '{' + ','.join(
+        '{}="{}"'.format(
+            k,
+            str(v).replace('\\', '\\\\').replace('\n', '\\n')
+            .replace('"', '\\"')
+        ) for k, v in pairs
+    ) + '}'  # yapf: disable
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render(snapshot):
+    """Return a snapshot in the Prometheus text exposition format."""
+    lines = []
+    for name, metric in sorted(snapshot.items()):
+        lines.append('# HELP {} {}'.format(name, metric['help']))
+        lines.append('# TYPE {} {}'.format(name, metric['type']))
+        names = metric['labelnames']
+        for values, value in sorted(metric['samples']):
+            if metric['type'] != 'histogram':
+                lines.append(
+                    '{}{} {}'.format(
+                        name,
+                        _format_labels(names, values), _format_value(value)
+                    )
+                )
+                continue
+
+            cumulative = 0
+            bounds = metric['buckets'] + [math.inf]
+            for bound, count in zip(bounds, value):
+                cumulative += count
+                lines.append(
+                    '{}_bucket{} {}'.format(
+                        name,
+                        _format_labels(
+                            names, values, [('le', _format_value(bound))]
+                        ), cumulative
+                    )
+                )
+            labels = _format_labels(names, values)
+            lines.append(
+                '{}_sum{} {}'.format(name, labels, _format_value(value[-2]))
+            )
+            lines.append('{}_count{} {}'.format(name, labels, value[-1]))
+
+    return '\n'.join(lines) + '\n'
+
+
+def update_db_pool_usage(engine):
+    """Set the DB_POOL_CONNECTIONS gauge from `engine`'s pool."""
+    pool = engine.pool
+    for state, attr in (('checked_out', 'checkedout'), ('idle', 'checkedin')):
+        if hasattr(pool, attr):
+            DB_POOL_CONNECTIONS.set(getattr(pool, attr)(), state=state)
+
+
+def initialize_metrics(flask_app):
+    directory = flask_app.config.get('METRICS_DIR')
+    if directory:
+        atexit.register(REGISTRY.maybe_flush, directory, force=True)
+
+
+REGISTRY = Registry()
+
+REQUEST_DURATION = Histogram(
+    'lando_request_duration_seconds',
+    'Request latency by operation and status code.',
+    ('operation', 'code'),
+)
+CONDUIT_DURATION = Histogram(
+    'lando_conduit_duration_seconds',
+    'Conduit call latency by method.',
+    ('method', ),
+)
+CACHE_REQUESTS = Counter(
+    'lando_cache_requests_total',
+    'Cache reads by result, either hit or miss.',
+    ('result', ),
+)
+PATCH_PREPARATION_DURATION = Histogram(
+    'lando_patch_preparation_seconds',
+    'Time spent preparing a patch for landing, by stage.',
+    ('stage', ),
+)
+MIRROR_READS = Counter(
+    'lando_phabricator_mirror_reads_total',
+    'Phabricator mirror reads by result, either hit or miss.',
+    ('result', ),
+)
+LANDINGS = Counter(
+    'lando_landings_total',
+    'Landings by the status they were created or updated with.',
+    ('status', ),
+)
+DB_POOL_CONNECTIONS = Gauge(
+    'lando_db_pool_connections',
+    'Database pool connections by state.',
+    ('state', ),
+)
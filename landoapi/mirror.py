@@ -0,0 +1,287 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+Local mirror of Phabricator revisions, diffs, users and projects.
+
+When PHABRICATOR_MIRROR is 'y', a sync worker (`lando-cli
+sync-phabricator-mirror`) follows the conduit feed with the unprivileged
+api key. For every revision, user or project a story was published about,
+the worker fetches the object again and stores its search data in the
+local database. A revision's active diff, author, and reviewers are
+fetched too. Objects the unprivileged key can no longer see are removed.
+
+In endpoints decorated with `allow_mirror_reads`, the `lazy_get_*`
+loaders read from the mirror instead of conduit, but only while the last
+complete sync started less than PHABRICATOR_MIRROR_MAX_AGE seconds ago.
+Anything missing from the mirror, such as private objects or objects
+unchanged since the worker first started, is fetched from conduit as
+before. The mirror may lag behind Phabricator by that age plus the delay
+before a story is published, so it is only meant for read-only views;
+landings always check live data.
+"""
+import functools
+import logging
+from datetime import datetime, timedelta, timezone
+
+from flask import current_app, g
+
+from landoapi.metrics import MIRROR_READS
+from landoapi.models.phabricator_mirror import MirroredObject, MirrorState
+from landoapi.phabricator import (
+    PhabricatorClient,
+    phid_type,
+    RevisionQueryProfile,
+)
+from landoapi.storage import db
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MIRROR_MAX_AGE = 60
+
+# Stories read from the feed, and objects synced, per transaction.
+FEED_PAGE_SIZE = 100
+
+MIRROR_STATE_ID = 1
+
+# Types of the objects stories are followed for.
+MIRRORED_STORY_TYPES = ('DREV', 'USER', 'PROJ')
+
+
+def allow_mirror_reads(f):
+    """Decorator letting a read-only endpoint's loaders use the mirror.
+
+    Only decorate endpoints which display data, never ones which act on
+    it, as the mirror may be out of date.
+    """
+
+    @functools.wraps(f)
+    def wrapped(*args, **kwargs):
+        g._phabricator_mirror_allowed = True
+        return f(*args, **kwargs)
+
+    return wrapped
+
+
+def mirror_is_fresh():
+    """Return True if the mirror may be read and was recently synced.
+
+    The mirror may only be read if it is enabled and the current
+    endpoint is decorated with `allow_mirror_reads`. The answer is
+    remembered for the rest of the request.
+    """
+    if current_app.config.get('PHABRICATOR_MIRROR') != 'y':
+        return False
+
+    if not g.get('_phabricator_mirror_allowed', False):
+        return False
+
+    if '_phabricator_mirror_fresh' not in g:
+        state = MirrorState.query.get(MIRROR_STATE_ID)
+        max_age = timedelta(
+            seconds=current_app.config.get(
+                'PHABRICATOR_MIRROR_MAX_AGE', DEFAULT_MIRROR_MAX_AGE
+            )
+        )
+        g._phabricator_mirror_fresh = (
+            state is not None and state.synced_at is not None and
+            datetime.now(timezone.utc) - state.synced_at <= max_age
+        )
+
+    return g._phabricator_mirror_fresh
+
+
+def get_mirrored(object_type, *, phid=None, object_id=None):
+    """Return the mirrored data of an object, or None.
+
+    None is returned if the mirror is not fresh or does not have the
+    object, in which case it should be fetched from conduit.
+
+    Args:
+        object_type: The type portion of the object's PHID, e.g. 'DREV'.
+        phid: The PHID of the object.
+        object_id: The integer id of the object, used if no `phid` is
+            given.
+    """
+    if not mirror_is_fresh():
+        return None
+
+    query = MirroredObject.query.filter_by(object_type=object_type)
+    if phid is not None:
+        query = query.filter_by(phid=phid)
+    else:
+        query = query.filter_by(object_id=object_id)
+
+    mirrored = query.one_or_none()
+    MIRROR_READS.inc(result='miss' if mirrored is None else 'hit')
+    return None if mirrored is None else mirrored.data
+
+
+def get_mirrored_many(phids):
+    """Return a dict mapping phid to the mirrored data of `phids`.
+
+    PHIDs the mirror does not have are missing from the result, which is
+    empty if the mirror is not fresh.
+    """
+    if not phids or not mirror_is_fresh():
+        return {}
+
+    found = {
+        mirrored.phid: mirrored.data
+        for mirrored in
+        MirroredObject.query.filter(MirroredObject.phid.in_(list(phids)))
+    }
+    MIRROR_READS.inc(len(found), result='hit')
+    MIRROR_READS.inc(len(set(phids)) - len(found), result='miss')
+    return found
+
+
+def sync_mirror(phabricator, *, page_size=FEED_PAGE_SIZE):
+    """Sync the mirror with the stories published since the last sync.
+
+    On the first sync the feed is followed from its newest story, objects
+    are then mirrored once they change.
+
+    Args:
+        phabricator: A PhabricatorClient using the unprivileged api key.
+        page_size: The number of stories read per conduit call.
+
+    Returns:
+        The number of objects which were synced.
+    """
+    started = datetime.now(timezone.utc)
+    state = MirrorState.query.get(MIRROR_STATE_ID)
+    if state is None:
+        state = MirrorState(id=MIRROR_STATE_ID)
+        db.session.add(state)
+
+    if state.feed_cursor is None:
+        newest = _read_feed(phabricator, limit=1)
+        state.feed_cursor = newest[-1]['chronologicalKey'] if newest else '0'
+
+    synced = 0
+    while True:
+        stories = _read_feed(
+            phabricator, before=state.feed_cursor, limit=page_size
+        )
+        if stories:
+            synced += _sync_objects(
+                phabricator, {
+                    s['objectPHID']
+                    for s in stories
+                    if phid_type(s['objectPHID']) in MIRRORED_STORY_TYPES
+                }
+            )
+            state.feed_cursor = stories[-1]['chronologicalKey']
+            db.session.commit()
+
+        if len(stories) < page_size:
+            break
+
+    state.synced_at = started
+    db.session.commit()
+    logger.info(
+        'phabricator mirror synced',
+        extra={
+            'synced': synced,
+            'feed_cursor': state.feed_cursor,
+        }
+    )
+    return synced
+
+
+def _read_feed(phabricator, *, before=None, limit):
+    """Return feed stories oldest first.
+
+    With `before`, the `limit` stories published right after that
+    chronologicalKey are returned, otherwise the newest `limit` stories.
+    Conduit's feed pager lists the newest stories first, so `before` a
+    cursor means newer than it, while `after` would page back in time.
+    """
+    params = {'limit': limit, 'view': 'data'}
+    if before is not None:
+        params['before'] = before
+
+    # Conduit encodes an empty result as a list.
+    stories = phabricator.call_conduit('feed.query', **params) or {}
+    return sorted(
+        stories.values() if isinstance(stories, dict) else [],
+        key=lambda s: int(s['chronologicalKey'])
+    )
+
+
+def _sync_objects(phabricator, phids):
+    """Fetch and store `phids`, with the diffs and identities of revisions.
+
+    Returns:
+        The number of objects which were stored or removed.
+    """
+    revision_phids = sorted(p for p in phids if phid_type(p) == 'DREV')
+    revisions = {}
+    if revision_phids:
+        revisions = _search(
+            phabricator,
+            'differential.revision.search',
+            revision_phids,
+            attachments=RevisionQueryProfile.FULL.attachments
+        )
+
+    diff_phids = sorted(
+        {
+            PhabricatorClient.expect(r, 'fields', 'diffPHID')
+            for r in revisions.values()
+        }
+    )
+    diffs = {}
+    if diff_phids:
+        diffs = _search(phabricator, 'differential.diff.search', diff_phids)
+
+    identity_phids = {p for p in phids if phid_type(p) in ('USER', 'PROJ')}
+    for revision in revisions.values():
+        identity_phids.add(
+            PhabricatorClient.expect(revision, 'fields', 'authorPHID')
+        )
+        identity_phids.update(
+            r['reviewerPHID']
+            for r in PhabricatorClient.
+            expect(revision, 'attachments', 'reviewers', 'reviewers')
+        )
+    identities = {}
+    if identity_phids:
+        identities = phabricator.resolve_phids(sorted(identity_phids))
+
+    now = datetime.now(timezone.utc)
+    found = {}
+    found.update(revisions)
+    found.update(diffs)
+    found.update(identities)
+    for phid, data in found.items():
+        db.session.merge(
+            MirroredObject(
+                phid=phid,
+                object_type=phid_type(phid),
+                object_id=data.get('id'),
+                data=data,
+                synced_at=now
+            )
+        )
+
+    # Objects a story was published about which can no longer be found
+    # were deleted or made private.
+    gone = sorted(set(phids) - set(found))
+    if gone:
+        MirroredObject.query.filter(MirroredObject.phid.in_(gone)).delete(
+            synchronize_session=False
+        )
+
+    return len(found) + len(gone)
+
+
+def _search(phabricator, method, phids, **params):
+    result = phabricator.call_conduit(
+        method, constraints={'phids': phids}, limit=len(phids), **params
+    )
+    return {
+        PhabricatorClient.expect(item, 'phid'): item
+        for item in PhabricatorClient.expect(result, 'data')
+    }
@@ -1,5 +1,8 @@
 from landoapi.models.landing import Landing
+from landoapi.models.phabricator_mirror import MirroredObject, MirrorState
 
 __all__ = [
     'Landing',
+    'MirroredObject',
+    'MirrorState',
 ]
@@ -35,7 +35,8 @@ class Landing(db.Model):
 
     Attributes:
         id: Primary Key
-        request_id: Id of the request in Autoland
+        request_id: Id of the request in Autoland, shared by the Landings
+            of a stack landed together
         revision_id: Phabricator id of the revision to be landed
         diff_id: Phabricator id of the diff to be landed
         active_diff_id: Phabricator id of the diff active at the moment of
@@ -45,13 +46,14 @@ class Landing(db.Model):
         result: Revision (sha) of push
         requester_email: The email address of the requester of the landing.
         tree: The treestatus tree name the revision is to land to.
+        patch_hash: The sha256 content hash of the uploaded patch.
         created_at: DateTime of the creation
         updated_at: DateTime of the last save
     """
     __tablename__ = "landings"
 
     id = db.Column(db.Integer, primary_key=True)
-    request_id = db.Column(db.Integer, unique=True)
+    request_id = db.Column(db.Integer, index=True)
     revision_id = db.Column(db.Integer)
     diff_id = db.Column(db.Integer)
     active_diff_id = db.Column(db.Integer)
@@ -62,6 +64,7 @@ class Landing(db.Model):
     result = db.Column(db.Text(), default='')
     requester_email = db.Column(db.String(254))
     tree = db.Column(db.String(128))
+    patch_hash = db.Column(db.String(64))
     created_at = db.Column(
         db.DateTime(timezone=True), nullable=False, default=db.func.now()
     )
@@ -106,6 +109,21 @@ class Landing(db.Model):
             revision_id=revision_id, status=LandingStatus.landed
         ).order_by(cls.updated_at.desc()).first()
 
+    @classmethod
+    def latest(cls, revision_id):
+        """Return the most recently updated Landing of any status, or None.
+
+        Args:
+            revision_id: The integer id of the revision.
+
+        Returns:
+            The Landing for the revision which was created or updated
+            most recently, or None if none exist.
+        """
+        return cls.query.filter_by(revision_id=revision_id).order_by(
+            cls.updated_at.desc(), cls.id.desc()
+        ).first()
+
     def __repr__(self):
         return '<Landing: %s>' % self.id
 
@@ -0,0 +1,51 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+from landoapi.storage import db
+
+
+class MirroredObject(db.Model):
+    """A Phabricator object copied into the local mirror.
+
+    Attributes:
+        phid: The PHID of the object.
+        object_type: The type portion of the PHID, e.g. 'DREV'.
+        object_id: The integer id of the object, if it has one.
+        data: The object's data just as it is returned by its conduit
+            search method, as seen by the unprivileged api key.
+        synced_at: DateTime the data was fetched from Phabricator.
+    """
+    __tablename__ = 'phabricator_mirror_objects'
+    __table_args__ = (
+        db.Index(
+            'ix_phabricator_mirror_objects_type_id', 'object_type', 'object_id'
+        ),
+    )
+
+    phid = db.Column(db.String(64), primary_key=True)
+    object_type = db.Column(db.String(8), nullable=False)
+    object_id = db.Column(db.Integer)
+    data = db.Column(db.JSON, nullable=False)
+    synced_at = db.Column(db.DateTime(timezone=True), nullable=False)
+
+    def __repr__(self):
+        return '<MirroredObject: %s>' % self.phid
+
+
+class MirrorState(db.Model):
+    """The progress of the mirror through the Phabricator feed.
+
+    Attributes:
+        id: Primary Key, there is a single row.
+        feed_cursor: The chronologicalKey of the last story synced.
+        synced_at: DateTime the last sync which read the feed to its end
+            started. Every change made before then is in the mirror.
+    """
+    __tablename__ = 'phabricator_mirror_state'
+
+    id = db.Column(db.Integer, primary_key=True)
+    feed_cursor = db.Column(db.String(64))
+    synced_at = db.Column(db.DateTime(timezone=True))
+
+    def __repr__(self):
+        return '<MirrorState: %s>' % self.feed_cursor
@@ -0,0 +1,477 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+Preparation of the patches of a landing.
+
+Preparing a patch fetches the revision's raw diff, formats its commit
+message and builds the patch, then uploads it to S3. The patches of a
+stack are prepared concurrently, each in a thread from a shared pool of
+PATCH_PREPARATION_MAX_WORKERS threads, so preparing a stack takes about
+as long as its slowest patch.
+
+With SPECULATIVE_PATCH_PREPARATION enabled, a dryrun without blockers
+starts preparing the patches in the background, on a separate pool of
+SPECULATIVE_PATCH_MAX_WORKERS threads, and the landing which follows
+reuses them if they were built from the same inputs and are still in S3.
+Speculative patches are stored under content addressed names, so one
+built from stale inputs never replaces the patch a landing submitted.
+"""
+import hashlib
+import json
+import logging
+import threading
+import time
+import urllib.parse
+from collections import namedtuple
+from concurrent import futures
+
+from flask import current_app, g
+
+from landoapi.cache import cache
+from landoapi.commit_message import format_commit_message
+from landoapi.hgexportbuilder import build_patch_chunks_for_revision
+from landoapi.metrics import PATCH_PREPARATION_DURATION
+from landoapi.patches import content_hash, delete, is_uploaded, upload
+from landoapi.phabricator import PhabricatorClient, ReviewerStatus
+from landoapi.reviews import reviewer_identity
+
+logger = logging.getLogger(__name__)
+
+PATCH_PREPARATION_STAGES = ('getrawdiff', 'build', 'upload')
+
+# Seconds a patch prepared after a dryrun is kept for the landing.
+SPECULATIVE_PATCH_TIMEOUT = 600
+
+_executor = None
+_executor_lock = threading.Lock()
+
+_speculation_executor = None
+_speculation_slots = None
+
+# Cache keys of the speculative preparations running in this process.
+_speculating = set()
+_speculating_lock = threading.Lock()
+
+PatchSource = namedtuple(
+    'PatchSource', (
+        'revision_id', 'diff_id', 'get_revision', 'get_diff_author',
+        'get_reviewers', 'get_reviewer_info',
+    )
+)
+PatchSource.__doc__ = """The revision a patch is prepared from.
+
+The getters are the LazyValues of the revision's landing assessment.
+"""
+
+PreparedPatch = namedtuple(
+    'PreparedPatch', ('revision_id', 'diff_id', 'url', 'hash', 'timings')
+)
+PreparedPatch.__doc__ = """An uploaded patch.
+
+`timings` maps each of PATCH_PREPARATION_STAGES to the seconds it took.
+"""
+
+
+def get_preparation_executor(max_workers):
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = futures.ThreadPoolExecutor(max_workers)
+
+        return _executor
+
+
+def get_speculation_executor(max_workers):
+    """Return the pool speculative preparations run on, and its free slots.
+
+    The slots are a semaphore of `max_workers`, which must be acquired
+    without blocking before submitting work, so work is never queued.
+    """
+    global _speculation_executor, _speculation_slots
+    with _executor_lock:
+        if _speculation_executor is None:
+            _speculation_executor = futures.ThreadPoolExecutor(max_workers)
+            _speculation_slots = threading.BoundedSemaphore(max_workers)
+
+        return _speculation_executor, _speculation_slots
+
+
+def landing_commit_message(source):
+    """Return the commit message a revision lands with.
+
+    Args:
+        source: The PatchSource of the revision.
+    """
+    fields = PhabricatorClient.expect(source.get_revision(), 'fields')
+
+    # Collect the usernames of reviewers who have accepted.
+    users, projects = source.get_reviewer_info()
+    accepted_reviewers = [
+        reviewer_identity(phid, users, projects).identifier
+        for phid, r in source.get_reviewers().items()
+        if r['status'] is ReviewerStatus.ACCEPTED
+    ]
+
+    title = PhabricatorClient.expect(fields, 'title')
+    summary = PhabricatorClient.expect(fields, 'summary')
+    bug_id = fields.get('bugzilla.bug-id')
+    bug_id = int(bug_id) if bug_id and not isinstance(bug_id, int) else None
+    revision_url = urllib.parse.urljoin(
+        current_app.config['PHABRICATOR_URL'],
+        'D{}'.format(source.revision_id)
+    )
+    return format_commit_message(
+        title, bug_id, accepted_reviewers, summary, revision_url
+    )[1]
+
+
+def patch_inputs(source, s3_bucket):
+    """Return everything except the raw diff the patch is built from.
+
+    A diff never changes once created, so two patches of the same diff
+    built from equal inputs are identical.
+    """
+    author_name, author_email = source.get_diff_author()
+    return {
+        'revision_id':
+        source.revision_id,
+        'diff_id':
+        source.diff_id,
+        'author_name':
+        author_name,
+        'author_email':
+        author_email,
+        'commit_message':
+        landing_commit_message(source),
+        # Seconds since Unix Epoch, UTC.
+        'date_modified':
+        PhabricatorClient.expect(
+            source.get_revision(), 'fields', 'dateModified'
+        ),
+        's3_bucket':
+        s3_bucket,
+    }
+
+
+def speculative_patch_cache_key(inputs):
+    return 'speculative_patch_{}'.format(
+        hashlib.sha256(json.dumps(inputs, sort_keys=True).encode('utf-8'))
+        .hexdigest()
+    )
+
+
+def speculation_enabled():
+    return current_app.config.get('SPECULATIVE_PATCH_PREPARATION') == 'y'
+
+
+def prepare_patch(
+    phabricator,
+    source,
+    s3_bucket,
+    *,
+    aws_access_key,
+    aws_secret_key,
+    on_uploaded=None,
+    content_addressed=False
+):
+    """Build and upload the patch of a revision.
+
+    If speculative preparation is enabled and a patch built from the
+    same inputs was uploaded after a recent dryrun, and is still in S3,
+    that patch is returned instead.
+
+    Args:
+        phabricator: A PhabricatorClient instance.
+        source: The PatchSource of the revision.
+        s3_bucket: Name of the S3 bucket.
+        aws_access_key: AWS access key.
+        aws_secret_key: AWS secret key.
+        on_uploaded: Passed to `landoapi.patches.upload`.
+        content_addressed: Passed to `landoapi.patches.upload`.
+
+    Returns:
+        A PreparedPatch, whose timings only include the stages that ran.
+    """
+    timings = {}
+    start = time.monotonic()
+    inputs = patch_inputs(source, s3_bucket)
+    timings['build'] = time.monotonic() - start
+
+    if speculation_enabled():
+        speculative = None
+        with cache.suppress_failure():
+            speculative = cache.get(speculative_patch_cache_key(inputs))
+
+        # The patch may have been removed from the bucket since.
+        if speculative is not None and is_uploaded(
+            speculative['url'],
+            speculative['hash'],
+            aws_access_key=aws_access_key,
+            aws_secret_key=aws_secret_key
+        ):
+            logger.info(
+                'speculative patch reused',
+                extra={
+                    'revision_id': source.revision_id,
+                    'diff_id': source.diff_id,
+                    'patch_url': speculative['url'],
+                }
+            )
+            return PreparedPatch(
+                source.revision_id, source.diff_id, speculative['url'],
+                speculative['hash'], timings
+            )
+
+    start = time.monotonic()
+    raw_diff = phabricator.call_conduit(
+        'differential.getrawdiff', diffID=source.diff_id
+    )
+    timings['getrawdiff'] = time.monotonic() - start
+
+    start = time.monotonic()
+    patch = build_patch_chunks_for_revision(
+        raw_diff,
+        inputs['author_name'],
+        inputs['author_email'],
+        inputs['commit_message'],
+        inputs['date_modified'],
+    )
+    patch_hash = content_hash(patch)
+    timings['build'] += time.monotonic() - start
+
+    # Upload the patch to S3, unless an earlier attempt already has.
+    start = time.monotonic()
+    patch_url = upload(
+        source.revision_id,
+        source.diff_id,
+        patch,
+        s3_bucket,
+        aws_access_key=aws_access_key,
+        aws_secret_key=aws_secret_key,
+        patch_hash=patch_hash,
+        on_uploaded=on_uploaded,
+        content_addressed=content_addressed,
+    )
+    timings['upload'] = time.monotonic() - start
+
+    for stage, seconds in timings.items():
+        PATCH_PREPARATION_DURATION.observe(seconds, stage=stage)
+
+    return PreparedPatch(
+        source.revision_id, source.diff_id, patch_url, patch_hash, timings
+    )
+
+
+def speculate_patches(
+    phabricator,
+    sources,
+    s3_bucket,
+    *,
+    aws_access_key,
+    aws_secret_key,
+    max_workers=0
+):
+    """Start preparing the patches of a landing which is likely to come.
+
+    Called after a dryrun found no blockers, so that the landing which
+    usually follows can reuse the uploaded patches rather than building
+    them while the user waits. Each patch is prepared in the background,
+    in a new app context, uploaded under a name including its content
+    hash, and recorded in the cache for SPECULATIVE_PATCH_TIMEOUT
+    seconds under a key derived from its inputs. Failures are only
+    logged.
+
+    Patches already recorded, or being prepared, are skipped. The
+    preparations run on their own pool, so they never delay landings,
+    and a patch is skipped rather than queued while every thread of
+    that pool is busy.
+
+    Nothing is done unless SPECULATIVE_PATCH_PREPARATION is 'y' and
+    `max_workers` is not 0.
+
+    Args:
+        phabricator: A PhabricatorClient instance.
+        sources: A list of PatchSource.
+        s3_bucket: Name of the S3 bucket.
+        aws_access_key: AWS access key.
+        aws_secret_key: AWS secret key.
+        max_workers: The size of the speculation pool.
+
+    Returns:
+        A list of the futures of the submitted preparations.
+    """
+    if not speculation_enabled() or not max_workers:
+        return []
+
+    app = current_app._get_current_object()
+    executor, slots = get_speculation_executor(max_workers)
+
+    def speculate(source, key):
+        # The preparation may outlive the dryrun, so it runs without the
+        # dryrun's deadline.
+        with app.app_context():
+            g.phabricator = phabricator
+            try:
+                prepared = prepare_patch(
+                    phabricator,
+                    source,
+                    s3_bucket,
+                    aws_access_key=aws_access_key,
+                    aws_secret_key=aws_secret_key,
+                    content_addressed=True
+                )
+                with cache.suppress_failure():
+                    cache.set(
+                        key, {
+                            'url': prepared.url,
+                            'hash': prepared.hash,
+                        },
+                        timeout=SPECULATIVE_PATCH_TIMEOUT
+                    )
+            except Exception as exc:
+                logger.info(
+                    'speculative patch preparation failed',
+                    extra={
+                        'revision_id': source.revision_id,
+                        'diff_id': source.diff_id,
+                    },
+                    exc_info=exc
+                )
+            finally:
+                with _speculating_lock:
+                    _speculating.discard(key)
+
+                slots.release()
+
+    submitted = []
+    for source in sources:
+        key = speculative_patch_cache_key(patch_inputs(source, s3_bucket))
+        cached = None
+        with cache.suppress_failure():
+            cached = cache.get(key)
+
+        with _speculating_lock:
+            if cached is not None or key in _speculating:
+                continue
+
+            if not slots.acquire(blocking=False):
+                logger.info(
+                    'speculative patch preparation skipped, pool is busy',
+                    extra={
+                        'revision_id': source.revision_id,
+                        'diff_id': source.diff_id,
+                    }
+                )
+                continue
+
+            _speculating.add(key)
+
+        submitted.append(executor.submit(speculate, source, key))
+
+    return submitted
+
+
+def prepare_patches(
+    phabricator,
+    sources,
+    s3_bucket,
+    *,
+    aws_access_key,
+    aws_secret_key,
+    max_workers=0
+):
+    """Build and upload the patches of a landing concurrently.
+
+    Each patch is prepared in a thread from the shared pool, in an app
+    context sharing `flask.g` with the current one, so the threads share
+    the request's deadline, tracing spans and thread safe
+    PhabricatorClient, while each uploads with its own boto3 session.
+    With `max_workers` of 0, or a single patch, patches are prepared in
+    the current thread.
+
+    If preparing any patch fails, the patches this call transferred to
+    S3 are deleted again and the exception of the first failing source
+    is raised.
+
+    Args:
+        phabricator: A PhabricatorClient instance.
+        sources: A list of PatchSource, in landing order.
+        s3_bucket: Name of the S3 bucket.
+        aws_access_key: AWS access key.
+        aws_secret_key: AWS secret key.
+        max_workers: The size of the shared pool of threads.
+
+    Returns:
+        A list of PreparedPatch in the order of `sources`.
+    """
+    uploaded = []
+    uploaded_lock = threading.Lock()
+
+    def on_uploaded(patch_url):
+        with uploaded_lock:
+            uploaded.append(patch_url)
+
+    def prepare(source):
+        return prepare_patch(
+            phabricator,
+            source,
+            s3_bucket,
+            aws_access_key=aws_access_key,
+            aws_secret_key=aws_secret_key,
+            on_uploaded=on_uploaded
+        )
+
+    start = time.monotonic()
+    try:
+        if not max_workers or len(sources) < 2:
+            prepared = [prepare(source) for source in sources]
+        else:
+            prepared = _prepare_concurrently(
+                prepare, sources, get_preparation_executor(max_workers)
+            )
+    except Exception:
+        for patch_url in uploaded:
+            delete(
+                patch_url,
+                aws_access_key=aws_access_key,
+                aws_secret_key=aws_secret_key
+            )
+        raise
+
+    logger.info(
+        'patches prepared',
+        extra={
+            'revision_ids': [p.revision_id for p in prepared],
+            'timings': [p.timings for p in prepared],
+            'duration': time.monotonic() - start,
+        }
+    )
+    return prepared
+
+
+def _prepare_concurrently(prepare, sources, executor):
+    app = current_app._get_current_object()
+    shared_g = g._get_current_object()
+
+    def run(source):
+        with app.app_context() as app_context:
+            app_context.g = shared_g
+            return prepare(source)
+
+    pending = [executor.submit(run, source) for source in sources]
+    done, not_done = futures.wait(pending, return_when=futures.FIRST_EXCEPTION)
+    if not_done:
+        # A patch failed, there is no need to start the ones still
+        # queued, but the ones already running have to finish before
+        # their uploads can be cleaned up.
+        for future in not_done:
+            future.cancel()
+
+        futures.wait(not_done)
+
+    for future in pending:
+        if not future.cancelled() and future.exception() is not None:
+            raise future.exception()
+
+    return [future.result() for future in pending]
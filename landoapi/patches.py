@@ -2,16 +2,34 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 import boto3
+import botocore
+import botocore.config
+import hashlib
 import logging
 import tempfile
 
+from landoapi.deadline import outbound_timeout
+from landoapi.tracing import span
+
 logger = logging.getLogger(__name__)
 
 PATCH_URL_FORMAT = 's3://{bucket}/{patch_name}'
 PATCH_NAME_FORMAT = 'V1_D{revision_id}_{diff_id}.patch'
+HASHED_PATCH_NAME_FORMAT = 'V1_D{revision_id}_{diff_id}_{patch_hash}.patch'
+PATCH_HASH_METADATA_KEY = 'sha256'
+
+
+def name(revision_id, diff_id, patch_hash=None):
+    """Return the S3 key of a patch.
 
+    With a `patch_hash` the key is content addressed, so the object
+    stored under it is never replaced by a different patch.
+    """
+    if patch_hash is not None:
+        return HASHED_PATCH_NAME_FORMAT.format(
+            revision_id=revision_id, diff_id=diff_id, patch_hash=patch_hash
+        )
 
-def name(revision_id, diff_id):
     return PATCH_NAME_FORMAT.format(revision_id=revision_id, diff_id=diff_id)
 
 
@@ -19,38 +37,206 @@ def url(bucket, name):
     return PATCH_URL_FORMAT.format(bucket=bucket, patch_name=name)
 
 
+def content_hash(patch):
+    """Return the hex sha256 digest of a patch.
+
+    Args:
+        patch: Raw patch string, the utf-8 encoded patch as a bytes-like
+            object, or a sequence of bytes-like chunks of it.
+    """
+    h = hashlib.sha256()
+    if isinstance(patch, str):
+        h.update(patch.encode('utf-8'))
+    elif isinstance(patch, (bytes, bytearray, memoryview)):
+        h.update(patch)
+    else:
+        for chunk in patch:
+            h.update(chunk)
+
+    return h.hexdigest()
+
+
 def upload(
-    revision_id, diff_id, patch, s3_bucket, *, aws_access_key, aws_secret_key
+    revision_id,
+    diff_id,
+    patch,
+    s3_bucket,
+    *,
+    aws_access_key,
+    aws_secret_key,
+    patch_hash=None,
+    on_uploaded=None,
+    content_addressed=False
 ):
     """Upload a patch to S3 Bucket.
 
-    Build the patch contents and upload to S3.
+    Build the patch contents and upload to S3. The content hash of the
+    patch is stored in the object's metadata, and if an object with the
+    same name and hash already exists, from an earlier attempt to land
+    the same diff, the upload is skipped and its url is reused.
 
     Args:
         revision_id: Integer ID of the Phabricator revision for
             the provided patch.
         diff_id: Integer ID of the Phabricator diff for
             the provided patch
-        patch: Raw patch string to be uploaded.
+        patch: Raw patch string to be uploaded, or a sequence of
+            bytes-like chunks of the utf-8 encoded patch, such as the
+            result of `build_patch_chunks_for_revision`.
         s3_bucket: Name of the S3 bucket.
         aws_access_key: AWS access key.
         aws_secret_key: AWS secret key.
+        patch_hash: The `content_hash` of the patch, computed if not
+            provided.
+        on_uploaded: An optional callable, called with the url of the
+            patch if it was transferred rather than reused.
+        content_addressed: If True the patch is stored under a name
+            which includes its hash, rather than the name landings
+            are submitted with.
 
     Returns:
         The s3:// url of the uploaded patch.
+
+    Raises:
+        landoapi.deadline.DeadlineExceeded: if the current request has
+            no time left to upload.
     """
-    s3 = boto3.resource(
-        's3',
-        aws_access_key_id=aws_access_key,
-        aws_secret_access_key=aws_secret_key
+    with span('s3'):
+        return _upload(
+            revision_id,
+            diff_id,
+            patch,
+            s3_bucket,
+            aws_access_key=aws_access_key,
+            aws_secret_key=aws_secret_key,
+            patch_hash=patch_hash,
+            on_uploaded=on_uploaded,
+            content_addressed=content_addressed
+        )
+
+
+def _s3_resource(aws_access_key, aws_secret_key):
+    """Return an S3 resource from a new boto3 session.
+
+    boto3's default session is not thread safe, and patches of a stack
+    are uploaded from several threads at once.
+    """
+    config = None
+    timeout = outbound_timeout('s3')
+    if timeout is not None:
+        config = botocore.config.Config(
+            connect_timeout=timeout, read_timeout=timeout
+        )
+
+    session = boto3.session.Session(
+        aws_access_key_id=aws_access_key, aws_secret_access_key=aws_secret_key
+    )
+    return session.resource('s3', config=config)
+
+
+def _upload(
+    revision_id, diff_id, patch, s3_bucket, *, aws_access_key, aws_secret_key,
+    patch_hash, on_uploaded, content_addressed
+):
+    s3 = _s3_resource(aws_access_key, aws_secret_key)
+    patch_hash = patch_hash or content_hash(patch)
+    patch_name = name(
+        revision_id, diff_id, patch_hash if content_addressed else None
     )
-    patch_name = name(revision_id, diff_id)
     patch_url = url(s3_bucket, patch_name)
 
+    if _uploaded_hash(s3, s3_bucket, patch_name) == patch_hash:
+        logger.info(
+            'patch already uploaded',
+            extra={
+                'patch_url': patch_url,
+                'patch_hash': patch_hash,
+            }
+        )
+        return patch_url
+
     with tempfile.TemporaryFile() as f:
-        f.write(patch.encode('utf-8'))
+        if isinstance(patch, str):
+            f.write(patch.encode('utf-8'))
+        else:
+            f.writelines(patch)
         f.seek(0)
-        s3.meta.client.upload_fileobj(f, s3_bucket, patch_name)
+        s3.meta.client.upload_fileobj(
+            f,
+            s3_bucket,
+            patch_name,
+            ExtraArgs={'Metadata': {
+                PATCH_HASH_METADATA_KEY: patch_hash
+            }}
+        )
+
+    logger.info(
+        'patch uploaded',
+        extra={
+            'patch_url': patch_url,
+            'patch_hash': patch_hash,
+        }
+    )
+    if on_uploaded is not None:
+        on_uploaded(patch_url)
 
-    logger.info('patch uploaded', extra={'patch_url': patch_url})
     return patch_url
+
+
+def delete(patch_url, *, aws_access_key, aws_secret_key):
+    """Delete an uploaded patch from S3, logging any failure.
+
+    Used to clean up patches uploaded for a landing which was abandoned
+    before being submitted.
+
+    Args:
+        patch_url: The s3:// url of the patch, as returned by `upload`.
+        aws_access_key: AWS access key.
+        aws_secret_key: AWS secret key.
+    """
+    s3_bucket, _, patch_name = patch_url[len('s3://'):].partition('/')
+    try:
+        with span('s3'):
+            s3 = _s3_resource(aws_access_key, aws_secret_key)
+            s3.meta.client.delete_object(Bucket=s3_bucket, Key=patch_name)
+    except Exception as exc:
+        logger.warning(
+            'could not delete patch',
+            extra={'patch_url': patch_url},
+            exc_info=exc
+        )
+
+
+def is_uploaded(patch_url, patch_hash, *, aws_access_key, aws_secret_key):
+    """Return True if the patch at `patch_url` exists with `patch_hash`.
+
+    Args:
+        patch_url: The s3:// url of the patch, as returned by `upload`.
+        patch_hash: The `content_hash` the patch was uploaded with.
+        aws_access_key: AWS access key.
+        aws_secret_key: AWS secret key.
+    """
+    s3_bucket, _, patch_name = patch_url[len('s3://'):].partition('/')
+    with span('s3'):
+        s3 = _s3_resource(aws_access_key, aws_secret_key)
+        return _uploaded_hash(s3, s3_bucket, patch_name) == patch_hash
+
+
+def _uploaded_hash(s3, s3_bucket, patch_name):
+    """Return the content hash of an uploaded patch or None if missing."""
+    try:
+        head = s3.meta.client.head_object(Bucket=s3_bucket, Key=patch_name)
+    except botocore.exceptions.ClientError as exc:
+        error_code = exc.response.get('Error', {}).get('Code')
+        if error_code not in ('404', 'NoSuchKey'):
+            # Not being able to check is not fatal, the patch will
+            # just be uploaded again.
+            logger.warning(
+                'could not check for uploaded patch',
+                extra={'patch_name': patch_name},
+                exc_info=exc
+            )
+
+        return None
+
+    return head.get('Metadata', {}).get(PATCH_HASH_METADATA_KEY)
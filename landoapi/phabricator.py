@@ -1,15 +1,150 @@
 # This Source Code Form is subject to the terms of the Mozilla Public
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
+import gzip
 import json
 import logging
-from json.decoder import JSONDecodeError
+import random
+import threading
+import time
+import urllib.parse
+from concurrent import futures
 
 import requests
 from enum import Enum, unique
 
+from landoapi.deadline import (
+    is_deadline_error,
+    outbound_timeout,
+    raise_if_expired,
+    time_remaining,
+)
+from landoapi.metrics import CONDUIT_DURATION
+from landoapi.resilience import LatencyTracker, PHABRICATOR
+from landoapi.tracing import span
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
 logger = logging.getLogger(__name__)
 
+# Conduit methods which only read data. Calling one of these again with
+# the same parameters while handling a request returns the same result.
+IDEMPOTENT_METHODS = frozenset(
+    (
+        'differential.diff.search', 'differential.getrawdiff',
+        'differential.query', 'differential.querydiffs',
+        'differential.revision.search', 'diffusion.repository.search',
+        'edge.search', 'phid.lookup', 'phid.query', 'project.search',
+        'user.query', 'user.search', 'user.whoami',
+    )
+)
+
+# Conduit error codes returned when the api token is not valid.
+AUTH_ERROR_CODES = frozenset(('ERR-INVALID-AUTH', 'ERR-INVALID-SESSION'))
+
+# A hedged read sends a second request once the first has taken longer
+# than this percentile of recent calls to the same method.
+HEDGE_PERCENTILE = 95
+HEDGE_MAX_WORKERS = 8
+
+# Base seconds of the jittered exponential backoff between retries.
+RETRY_BACKOFF = 0.1
+
+CONDUIT_LATENCY = LatencyTracker()
+
+_hedge_executor = None
+_hedge_executor_lock = threading.Lock()
+
+
+def get_hedge_executor():
+    """Return the thread pool hedged reads are sent from."""
+    global _hedge_executor
+    with _hedge_executor_lock:
+        if _hedge_executor is None:
+            _hedge_executor = futures.ThreadPoolExecutor(HEDGE_MAX_WORKERS)
+
+        return _hedge_executor
+
+
+def decode_conduit_response(content):
+    """Return the decoded JSON body of a conduit response.
+
+    Conduit always responds with UTF-8 encoded JSON, so the body is
+    decoded directly instead of through requests' charset detection,
+    which is slow for large responses such as `differential.getrawdiff`.
+    ujson is used for decoding when it is installed.
+
+    Args:
+        content: The response body bytes.
+
+    Raises:
+        ValueError: If the body is not valid UTF-8 encoded JSON.
+    """
+    text = content.decode('utf-8')
+    if ujson is not None:
+        return ujson.loads(text)
+
+    return json.loads(text)
+
+
+def is_phabricator_failure(exc):
+    """Return True if `exc` indicates Phabricator itself is failing.
+
+    Running out of the request's deadline is not counted, so slow
+    requests cannot open the breaker while Phabricator is healthy.
+    """
+    return not is_deadline_error(exc)
+
+
+def response_wire_bytes(response):
+    """Return the size of a response body as it was sent over the wire.
+
+    This is the size before any gzip content encoding is decoded, taken
+    from the Content-Length header or, for chunked responses, from the
+    number of bytes urllib3 read.
+
+    Args:
+        response: A requests.Response whose content was read.
+    """
+    length = response.headers.get('Content-Length', '')
+    if length.isdigit():
+        return int(length)
+
+    try:
+        return response.raw.tell()
+    except AttributeError:
+        return len(response.content)
+
+
+# Search methods used to resolve PHIDs of a given type, keyed by the type
+# portion of the PHID (e.g. 'USER' for 'PHID-USER-abc'). PHIDs of any other
+# type are resolved with `phid.query`.
+PHID_TYPE_SEARCH_METHODS = {
+    'DIFF': 'differential.diff.search',
+    'DREV': 'differential.revision.search',
+    'PROJ': 'project.search',
+    'REPO': 'diffusion.repository.search',
+    'USER': 'user.search',
+}
+
+# The largest page of results a conduit search method will return.
+SEARCH_PAGE_SIZE = 100
+
+
+def phid_type(phid):
+    """Return the type portion of a PHID, e.g. 'USER' for 'PHID-USER-abc'.
+
+    Returns None if `phid` is not a well formed PHID.
+    """
+    parts = phid.split('-', 2) if isinstance(phid, str) else []
+    if len(parts) != 3 or parts[0] != 'PHID' or not parts[1]:
+        return None
+
+    return parts[1]
+
 
 @unique
 class RevisionStatus(Enum):
@@ -112,6 +247,37 @@ class RevisionStatus(Enum):
         return self.meta().get(self, {}).get('color.ansi')
 
 
+@unique
+class RevisionQueryProfile(Enum):
+    """Enumeration of how much revision data a lookup should fetch.
+
+    PERMISSION only checks that the revision exists and is visible,
+    fetching a small object handle with `phid.lookup`. FULL fetches the
+    revision's fields and its reviewer attachments.
+    """
+    PERMISSION = 'permission'
+    FULL = 'full'
+
+    @classmethod
+    def meta(cls):
+        return {
+            cls.PERMISSION: {
+                'attachments': None,
+            },
+            cls.FULL: {
+                'attachments': {
+                    'reviewers': True,
+                    'reviewers-extra': True,
+                },
+            },
+        }
+
+    @property
+    def attachments(self):
+        attachments = self.meta().get(self, {}).get('attachments')
+        return dict(attachments) if attachments is not None else None
+
+
 @unique
 class ReviewerStatus(Enum):
     """Enumeration of statuses a reviewer may have.
@@ -181,16 +347,73 @@ class PhabricatorClient:
     the request to the server or decoding the JSON response, this class will
     bubble up the exception, as a PhabricatorAPIException caused by the
     underlying exception.
+
+    A client may be shared by the threads working on a single request:
+    unless a session is given, each thread sends its calls through its
+    own requests.Session, and the memoized results and stats are updated
+    under a lock.
     """
 
-    def __init__(self, url, api_token, *, session=None):
+    def __init__(
+        self,
+        url,
+        api_token,
+        *,
+        session=None,
+        memoize=False,
+        decoder=decode_conduit_response,
+        compress_min_bytes=None,
+        on_auth_error=None,
+        hedge=False,
+        max_retries=0
+    ):
         self.api_url = url + 'api/' if url[-1] == '/' else url + '/api/'
         self.api_token = api_token
-        self.session = session or self.create_session()
+        self._session = session
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.decoder = decoder
+        self.compress_min_bytes = compress_min_bytes
+        self.on_auth_error = on_auth_error
+        self.hedge = hedge
+        self.max_retries = max_retries
+        self._memo = {} if memoize else None
+        self.stats = {
+            'calls': 0,
+            'memoized_calls': 0,
+            'hedged_calls': 0,
+            'retried_calls': 0,
+        }
+        self.transfer_stats = {}
 
     def call_conduit(self, method, **kwargs):
         """Return the result of an RPC call to a conduit method.
 
+        If the client was created with `memoize=True`, the result of a
+        method in IDEMPOTENT_METHODS is remembered and returned again,
+        without a request, for any later call with the same parameters.
+        Such a client should only live as long as a single request and
+        memoized results must not be mutated.
+
+        Calls are sent as form encoded POST requests accepting a gzip
+        encoded response. If the client was created with a
+        `compress_min_bytes` the request body is gzip compressed when it
+        is at least that large, which requires the Phabricator web
+        server to decode compressed request bodies. The size of each
+        request and response body, as sent over the wire, is added to
+        `transfer_stats`, keyed by method.
+
+        If the client was created with an `on_auth_error` callable, it
+        is called with the api token whenever conduit rejects the token.
+
+        Calls to methods in IDEMPOTENT_METHODS are retried up to
+        `max_retries` times after a connection error, with a jittered
+        backoff. If the client was created with `hedge=True`, a second
+        request is sent from the hedge pool when the first has taken
+        longer than HEDGE_PERCENTILE of recent calls to the method.
+        Retries and hedged requests are limited by the Phabricator retry
+        budget, and use the bulkhead slot of the call they repeat.
+
         Args:
             **kwargs: Every method parameter is passed as a keyword argument.
 
@@ -204,30 +427,239 @@ class PhabricatorClient:
             requests.exceptions.RequestException:
                 if there is a request exception while communicating
                 with the conduit API.
+            landoapi.resilience.DependencyUnavailable:
+                if the Phabricator circuit breaker is open or too many
+                threads are already waiting on Phabricator.
+            landoapi.deadline.DeadlineExceeded:
+                if the current request ran out of time before or while
+                calling conduit.
         """
+        memo_key = None
+        if self._memo is not None and method in IDEMPOTENT_METHODS:
+            memo_key = (method, json.dumps(kwargs, sort_keys=True))
+            with self._lock:
+                memoized = memo_key in self._memo
+                result = self._memo.get(memo_key)
+
+            if memoized:
+                self._count('memoized_calls')
+                logger.debug('memoized conduit call', extra={'method': method})
+                return result
+
         if '__conduit__' not in kwargs:
             kwargs['__conduit__'] = {'token': self.api_token}
 
-        data = {
-            'output': 'json',
-            'params': json.dumps(kwargs),
+        body = urllib.parse.urlencode(
+            {
+                'output': 'json',
+                'params': json.dumps(kwargs),
+            }
+        ).encode('ascii')
+        headers = {
+            'Accept-Encoding': 'gzip',
+            'Content-Type': 'application/x-www-form-urlencoded',
         }
-
+        if (
+            self.compress_min_bytes is not None and
+            len(body) >= self.compress_min_bytes
+        ):
+            body = gzip.compress(body)
+            headers['Content-Encoding'] = 'gzip'
+
+        self._count('calls')
+        guard = PHABRICATOR.guard(is_failure=is_phabricator_failure)
         try:
-            response = self.session.get(
-                self.api_url + method, data=data
-            ).json()
+            with guard, span('conduit'):
+                start = time.time()
+                response = self._send(method, body, headers)
+                CONDUIT_DURATION.observe(time.time() - start, method=method)
+                self._record_transfer(
+                    method, len(body), response_wire_bytes(response)
+                )
+                response = self.decoder(response.content)
         except requests.RequestException as exc:
+            raise_if_expired('phabricator')
             raise PhabricatorCommunicationException(
                 "An error occurred when communicating with Phabricator"
             ) from exc
-        except JSONDecodeError as exc:
+        except ValueError as exc:
             raise PhabricatorCommunicationException(
                 "Phabricator response could not be decoded as JSON"
             ) from exc
 
+        if (
+            self.on_auth_error is not None and
+            response.get('error_code') in AUTH_ERROR_CODES
+        ):
+            self.on_auth_error(self.api_token)
+
         PhabricatorAPIException.raise_if_error(response)
-        return response.get('result')
+        result = response.get('result')
+        if memo_key is not None:
+            with self._lock:
+                self._memo[memo_key] = result
+
+        return result
+
+    def _send(self, method, body, headers):
+        """Send a conduit request, retrying and hedging reads."""
+
+        def post(timeout):
+            start = time.monotonic()
+            response = self.session.post(
+                self.api_url + method,
+                data=body,
+                headers=headers,
+                timeout=timeout
+            )
+            CONDUIT_LATENCY.record(method, time.monotonic() - start)
+            return response
+
+        if method not in IDEMPOTENT_METHODS:
+            return post(outbound_timeout('phabricator'))
+
+        budget = PHABRICATOR.retry_budget
+        budget.deposit()
+        attempt = 0
+        while True:
+            timeout = outbound_timeout('phabricator')
+            try:
+                if self.hedge:
+                    return self._hedged_post(method, post, timeout)
+
+                return post(timeout)
+            except requests.ConnectionError:
+                if attempt >= self.max_retries or not budget.withdraw():
+                    raise
+
+                attempt += 1
+                backoff = random.uniform(0, RETRY_BACKOFF * 2**attempt)
+                remaining = time_remaining()
+                if remaining is not None and remaining <= backoff:
+                    raise
+
+                logger.info(
+                    'retrying conduit call',
+                    extra={
+                        'method': method,
+                        'attempt': attempt,
+                    }
+                )
+                self._count('retried_calls')
+                time.sleep(backoff)
+
+    def _hedged_post(self, method, post, timeout):
+        """Send a request with `post`, hedged by a second one if it is slow.
+
+        The first request is sent from the calling thread, so it never
+        waits for a thread of the hedge pool. Once it has taken longer
+        than HEDGE_PERCENTILE of recent calls to `method`, a second
+        request is sent from the hedge pool, unless the retry budget is
+        spent. It runs within the first request's bulkhead slot, as the
+        calling thread is waiting on both.
+
+        The calling thread cannot abandon its own request, so the second
+        response is used if it arrived first or if the first request
+        failed. A second request which loses is left to finish in the
+        pool.
+        """
+        delay = CONDUIT_LATENCY.percentile(method, HEDGE_PERCENTILE)
+        if delay is None:
+            return post(timeout)
+
+        now = time.monotonic()
+        expires = None if timeout is None else now + timeout
+        first_done = threading.Event()
+        hedge = get_hedge_executor().submit(
+            self._send_hedge, method, post, now + delay, expires, first_done
+        )
+        try:
+            response = post(timeout)
+        except requests.RequestException:
+            first_done.set()
+            if hedge.cancel():
+                raise
+
+            try:
+                hedged = hedge.result()
+            except requests.RequestException:
+                hedged = None
+
+            if hedged is None:
+                raise
+
+            return hedged
+
+        first_done.set()
+        if hedge.cancel() or not hedge.done() or hedge.exception():
+            return response
+
+        hedged = hedge.result()
+        return response if hedged is None else hedged
+
+    def _send_hedge(self, method, post, hedge_at, expires, first_done):
+        """Send a second request if the first is still running at `hedge_at`.
+
+        Args:
+            method: The conduit method called.
+            post: A callable sending the request, given its timeout.
+            hedge_at: The time.monotonic() to send the second request at.
+            expires: The time.monotonic() the first request times out
+                at, or None if it has no timeout.
+            first_done: A threading.Event set once the first request
+                has finished.
+
+        Returns:
+            The response, or None if no second request was sent.
+        """
+        if first_done.wait(max(0, hedge_at - time.monotonic())):
+            return None
+
+        timeout = None
+        if expires is not None:
+            timeout = expires - time.monotonic()
+            if timeout <= 0:
+                return None
+
+        if not PHABRICATOR.retry_budget.withdraw():
+            return None
+
+        logger.debug('hedging conduit call', extra={'method': method})
+        self._count('hedged_calls')
+        return post(timeout)
+
+    def _count(self, stat):
+        with self._lock:
+            self.stats[stat] += 1
+
+    def _record_transfer(self, method, request_bytes, response_bytes):
+        with self._lock:
+            stats = self.transfer_stats.setdefault(
+                method, {
+                    'calls': 0,
+                    'request_bytes': 0,
+                    'response_bytes': 0,
+                }
+            )
+            stats['calls'] += 1
+            stats['request_bytes'] += request_bytes
+            stats['response_bytes'] += response_bytes
+
+    @property
+    def session(self):
+        """The requests.Session calls from the current thread are sent with.
+
+        requests.Session is not thread safe, so unless a session was
+        given when the client was created, each thread has its own.
+        """
+        if self._session is not None:
+            return self._session
+
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = self.create_session()
+
+        return session
 
     @staticmethod
     def create_session():
@@ -291,6 +723,75 @@ class PhabricatorClient:
 
         return result
 
+    def get_revision(self, revision_id, *, profile=RevisionQueryProfile.FULL):
+        """Return data for the revision with `revision_id`, or None.
+
+        Args:
+            revision_id: The integer id of the revision.
+            profile: A RevisionQueryProfile selecting how much data to
+                fetch. With RevisionQueryProfile.PERMISSION the
+                `phid.lookup` handle of the revision is returned,
+                otherwise the revision as returned by
+                `differential.revision.search`.
+
+        Returns:
+            The revision data, or None if the revision does not exist or
+            the api token lacks permission to see it.
+        """
+        if profile is RevisionQueryProfile.PERMISSION:
+            name = 'D{}'.format(revision_id)
+
+            # Conduit encodes an empty result as a list.
+            handles = self.call_conduit('phid.lookup', names=[name]) or {}
+            return handles.get(name) if isinstance(handles, dict) else None
+
+        params = {'constraints': {'ids': [revision_id]}}
+        if profile.attachments:
+            params['attachments'] = profile.attachments
+
+        revision = self.call_conduit('differential.revision.search', **params)
+        return self.single(revision, 'data', none_when_empty=True)
+
+    def resolve_phids(self, phids):
+        """Return a dictionary mapping phid to object data for `phids`.
+
+        The PHIDs are grouped by type and each type is resolved with a
+        single call to its search method from PHID_TYPE_SEARCH_METHODS
+        (or one call per SEARCH_PAGE_SIZE PHIDs for very large groups).
+        PHIDs of any other type are resolved together with a single
+        `phid.query` call, which returns handle data rather than search
+        results. PHIDs which do not exist, or which the api token cannot
+        see, are missing from the returned dictionary.
+
+        Args:
+            phids: An iterable of PHID strings, possibly of mixed types.
+        """
+        by_method = {}
+        for phid in set(phids):
+            method = PHID_TYPE_SEARCH_METHODS.get(
+                phid_type(phid), 'phid.query'
+            )
+            by_method.setdefault(method, []).append(phid)
+
+        resolved = {}
+        for method, method_phids in sorted(by_method.items()):
+            method_phids.sort()
+            if method == 'phid.query':
+                result = self.call_conduit(method, phids=method_phids)
+                resolved.update(result or {})
+                continue
+
+            for i in range(0, len(method_phids), SEARCH_PAGE_SIZE):
+                page = method_phids[i:i + SEARCH_PAGE_SIZE]
+                result = self.call_conduit(
+                    method, constraints={'phids': page}, limit=len(page)
+                )
+                resolved.update(
+                    result_list_to_phid_dict(self.expect(result, 'data'))
+                )
+
+        return resolved
+
     def verify_api_token(self):
         """ Verifies that the api token is valid.
 
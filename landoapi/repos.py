@@ -3,10 +3,20 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 import logging
+import threading
+import time
 from collections import namedtuple
 
+from landoapi.phabricator import PhabricatorAPIException, PhabricatorClient
+
 logger = logging.getLogger(__name__)
 
+# Seconds between rebuilds of the repository index.
+REPO_INDEX_REFRESH_INTERVAL = 600
+
+# Seconds a repository which is not landable is remembered as such.
+REPO_INDEX_NEGATIVE_TTL = 60
+
 AccessGroup = namedtuple(
     'AccessGroup',
     (
@@ -82,3 +92,123 @@ def get_repos_for_env(env):
         env = 'default'
 
     return REPO_CONFIG.get(env, {})
+
+
+class RepositoryIndex:
+    """Map Phabricator repository PHIDs to the Repo they land to.
+
+    The index is built with a single `diffusion.repository.search` for
+    every repository configured for the environment, and rebuilt every
+    `refresh_interval` seconds. A PHID missing from the index is looked
+    up with conduit, and if its repository is not landable that is
+    remembered for `negative_ttl` seconds.
+    """
+
+    def __init__(
+        self,
+        *,
+        refresh_interval=REPO_INDEX_REFRESH_INTERVAL,
+        negative_ttl=REPO_INDEX_NEGATIVE_TTL,
+        clock=time.monotonic
+    ):
+        self.refresh_interval = refresh_interval
+        self.negative_ttl = negative_ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._env = None
+            self._repos = {}
+            self._not_landable = {}
+            self._next_refresh = 0
+
+    def refresh(self, phabricator, env):
+        """Rebuild the index for `env`."""
+        configured = get_repos_for_env(env)
+        repos = {}
+        if configured:
+            result = phabricator.call_conduit(
+                'diffusion.repository.search',
+                constraints={'shortNames': sorted(configured)}
+            )
+            for repository in PhabricatorClient.expect(result, 'data'):
+                shortname = PhabricatorClient.expect(
+                    repository, 'fields', 'shortName'
+                )
+                if shortname in configured:
+                    phid = PhabricatorClient.expect(repository, 'phid')
+                    repos[phid] = configured[shortname]
+
+        with self._lock:
+            self._env = env
+            self._repos = repos
+            self._not_landable = {}
+            self._next_refresh = self._clock() + self.refresh_interval
+
+        logger.info(
+            'repository index refreshed',
+            extra={
+                'env': env,
+                'repositories': len(repos),
+            }
+        )
+
+    def get(self, phabricator, env, repo_phid):
+        """Return the Repo for the repository `repo_phid` in `env`.
+
+        Args:
+            phabricator: A PhabricatorClient instance, used to refresh
+                the index and to look up PHIDs missing from it.
+            env: The environment Lando API is running in.
+            repo_phid: The PHID of a Phabricator repository.
+
+        Returns:
+            A landoapi.repos.Repo or None if the repository is not
+            configured.
+
+        Raises:
+            landoapi.phabricator.PhabricatorCommunicationException:
+                If the repository cannot be found when searching.
+        """
+        with self._lock:
+            stale = env != self._env or self._clock() >= self._next_refresh
+
+        if stale:
+            try:
+                self.refresh(phabricator, env)
+            except PhabricatorAPIException as exc:
+                logger.warning(
+                    'could not refresh repository index', exc_info=exc
+                )
+                with self._lock:
+                    self._next_refresh = self._clock() + self.negative_ttl
+
+        with self._lock:
+            if repo_phid in self._repos:
+                return self._repos[repo_phid]
+
+            if self._not_landable.get(repo_phid, 0) > self._clock():
+                return None
+
+        repository = PhabricatorClient.expect(
+            phabricator.call_conduit(
+                'diffusion.repository.search',
+                constraints={'phids': [repo_phid]}
+            ), 'data', 0
+        )
+        shortname = PhabricatorClient.expect(repository, 'fields', 'shortName')
+        repo = get_repos_for_env(env).get(shortname)
+        with self._lock:
+            if repo is not None:
+                self._repos[repo_phid] = repo
+            else:
+                self._not_landable[repo_phid] = (
+                    self._clock() + self.negative_ttl
+                )
+
+        return repo
+
+
+REPOSITORY_INDEX = RepositoryIndex()
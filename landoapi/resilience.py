@@ -0,0 +1,334 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+Circuit breakers and bulkheads for the services Lando API depends on.
+
+Each Dependency combines a CircuitBreaker, which fails calls fast while
+a service is failing, and a Bulkhead, which caps how many requests of a
+process may be waiting on a service at once. Together they keep a single
+slow or failing service from tying up every thread. Threads sharing a
+request's `flask.g`, such as prefetch threads, share its bulkhead slot.
+
+Each Dependency also has a RetryBudget, which limits extra attempts such
+as retries and hedged requests to a proportion of calls, so they cannot
+multiply the load on a service which is already struggling.
+"""
+import collections
+import contextlib
+import logging
+import threading
+import time
+
+from connexion import ProblemException
+from flask import g, has_app_context
+
+logger = logging.getLogger(__name__)
+
+DEPENDENCIES = {}
+
+
+class DependencyUnavailable(ProblemException):
+    """A dependency call was refused by its circuit breaker or bulkhead."""
+
+    def __init__(self, name, reason, *, retry_after):
+        super().__init__(
+            503,
+            'Service Unavailable',
+            '{} is currently unavailable, try again later'.format(
+                name.capitalize()
+            ),
+            type='https://developer.mozilla.org/en-US/docs/Web/HTTP/Status/503'
+        )  # yapf: disable
+        self.name = name
+        self.reason = reason
+        self.retry_after = int(retry_after)
+
+
+class CircuitBreaker:
+    """Stop calling a failing dependency until it has had time to recover.
+
+    The breaker is closed while calls succeed. Once at least `min_calls`
+    calls finished in the last `window` seconds and the proportion of
+    them that failed reaches `failure_threshold`, the breaker opens and
+    calls are refused for `reset_timeout` seconds. The breaker is then
+    half-open: a single probe call is allowed, closing the breaker if it
+    succeeds or opening it again if it fails.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(
+        self,
+        name,
+        *,
+        failure_threshold=0.5,
+        min_calls=10,
+        window=30,
+        reset_timeout=30,
+        clock=time.monotonic
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.min_calls = min_calls
+        self.window = window
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._results = collections.deque()
+        self._opened_at = None
+        self._probing = False
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self._opened_at is None:
+            return self.CLOSED
+
+        if self._clock() - self._opened_at < self.reset_timeout:
+            return self.OPEN
+
+        return self.HALF_OPEN
+
+    def retry_after(self):
+        """Return the seconds until the breaker will allow a probe."""
+        with self._lock:
+            if self._opened_at is None:
+                return 0
+
+            remaining = self._opened_at + self.reset_timeout - self._clock()
+            return max(remaining, 1)
+
+    def allow(self):
+        """Return True if a call may be made now.
+
+        Every allowed call must be followed by a call to `record`.
+        """
+        with self._lock:
+            state = self._state()
+            if state == self.CLOSED:
+                return True
+
+            if state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+
+            return False
+
+    def record(self, success):
+        """Record the outcome of a call allowed by `allow`."""
+        with self._lock:
+            now = self._clock()
+            if self._probing:
+                self._probing = False
+                self._results.clear()
+                self._opened_at = None if success else now
+                if success:
+                    logger.info(
+                        'circuit breaker closed',
+                        extra={'dependency': self.name}
+                    )
+                return
+
+            self._results.append((now, success))
+            while self._results and self._results[0][0] < now - self.window:
+                self._results.popleft()
+
+            failures = sum(1 for _, ok in self._results if not ok)
+            if (
+                len(self._results) >= self.min_calls and
+                failures / len(self._results) >= self.failure_threshold
+            ):
+                self._opened_at = now
+                self._results.clear()
+                logger.warning(
+                    'circuit breaker opened',
+                    extra={
+                        'dependency': self.name,
+                        'failures': failures,
+                    }
+                )
+
+
+class Bulkhead:
+    """Cap the number of callers concurrently calling a dependency.
+
+    A caller which cannot get one of the `max_concurrent` slots within
+    `wait` seconds is refused. Threads acquiring with the same `holder`
+    share a single slot, which is released once the last of them
+    releases it.
+    """
+
+    def __init__(self, max_concurrent, *, wait=1):
+        self.max_concurrent = max_concurrent
+        self.wait = wait
+        self._semaphore = threading.BoundedSemaphore(max_concurrent)
+        self._lock = threading.Lock()
+        self._holders = {}
+
+    def acquire(self, holder=None):
+        """Return True once a slot was taken, or False after `wait`.
+
+        Args:
+            holder: An optional hashable the slot is shared by. Without
+                one the slot belongs to the calling thread alone.
+        """
+        if holder is not None:
+            with self._lock:
+                if holder in self._holders:
+                    self._holders[holder] += 1
+                    return True
+
+        if not self._semaphore.acquire(timeout=self.wait):
+            return False
+
+        if holder is not None:
+            with self._lock:
+                if holder in self._holders:
+                    # Another thread of the holder took a slot meanwhile.
+                    self._semaphore.release()
+
+                self._holders[holder] = self._holders.get(holder, 0) + 1
+
+        return True
+
+    def release(self, holder=None):
+        if holder is not None:
+            with self._lock:
+                self._holders[holder] -= 1
+                if self._holders[holder]:
+                    return
+
+                del self._holders[holder]
+
+        self._semaphore.release()
+
+
+class RetryBudget:
+    """Limit extra attempts to a proportion of the calls made.
+
+    Each call deposits `ratio` of a token, up to `max_tokens`, and each
+    retry or hedged request must withdraw a whole token. The budget
+    starts full, so a few retries are always possible after a quiet
+    period.
+    """
+
+    def __init__(self, *, ratio=0.1, max_tokens=10):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self._tokens = max_tokens
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self._tokens = min(self._tokens + self.ratio, self.max_tokens)
+
+    def withdraw(self):
+        """Return True if an extra attempt may be made."""
+        with self._lock:
+            if self._tokens < 1:
+                return False
+
+            self._tokens -= 1
+            return True
+
+
+class LatencyTracker:
+    """Recent call durations, kept in a sliding window per key."""
+
+    def __init__(self, *, size=100, min_samples=20):
+        self.size = size
+        self.min_samples = min_samples
+        self._durations = {}
+        self._lock = threading.Lock()
+
+    def record(self, key, seconds):
+        with self._lock:
+            durations = self._durations.get(key)
+            if durations is None:
+                durations = self._durations[key] = collections.deque(
+                    maxlen=self.size
+                )
+            durations.append(seconds)
+
+    def percentile(self, key, percent):
+        """Return the `percent` percentile duration of calls for `key`.
+
+        None is returned until at least `min_samples` calls have been
+        recorded.
+        """
+        with self._lock:
+            durations = sorted(self._durations.get(key, ()))
+
+        if len(durations) < self.min_samples:
+            return None
+
+        index = min(len(durations) - 1, int(len(durations) * percent / 100))
+        return durations[index]
+
+
+class Dependency:
+    """A service Lando API calls, guarded by a breaker and a bulkhead."""
+
+    def __init__(self, name, *, max_concurrent, **breaker_options):
+        self.name = name
+        self.configure(max_concurrent=max_concurrent, **breaker_options)
+        DEPENDENCIES[name] = self
+
+    def configure(self, *, max_concurrent, **breaker_options):
+        """Replace the breaker, bulkhead and retry budget."""
+        self.breaker = CircuitBreaker(self.name, **breaker_options)
+        self.bulkhead = Bulkhead(max_concurrent)
+        self.retry_budget = RetryBudget()
+
+    @contextlib.contextmanager
+    def guard(self, is_failure=lambda exc: True):
+        """Context manager to wrap a single call to the dependency.
+
+        Args:
+            is_failure: A callable which is passed an exception raised
+                from the wrapped block and returns True if it indicates
+                the dependency is failing, as opposed to, for example,
+                rejecting the request.
+
+        Raises:
+            DependencyUnavailable: If the circuit breaker is open or
+                every bulkhead slot stayed busy.
+        """
+        holder = g._get_current_object() if has_app_context() else None
+        if not self.bulkhead.acquire(holder=holder):
+            logger.warning(
+                'dependency bulkhead full', extra={'dependency': self.name}
+            )
+            raise DependencyUnavailable(
+                self.name, 'bulkhead full', retry_after=1
+            )
+
+        try:
+            if not self.breaker.allow():
+                raise DependencyUnavailable(
+                    self.name,
+                    'circuit open',
+                    retry_after=self.breaker.retry_after()
+                )
+
+            try:
+                yield
+            except Exception as exc:
+                self.breaker.record(not is_failure(exc))
+                raise
+            except BaseException:
+                self.breaker.record(True)
+                raise
+            else:
+                self.breaker.record(True)
+        finally:
+            self.bulkhead.release(holder)
+
+
+PHABRICATOR = Dependency('phabricator', max_concurrent=6)
+TRANSPLANT = Dependency('transplant', max_concurrent=2)
@@ -0,0 +1,152 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+Resolution of the graph of revisions a revision is stacked with.
+
+The graph is found by walking `revision.parent` and `revision.child`
+edges breadth first, with a single `edge.search` for every PHID of a
+level, so a stack resolves in as many calls as it is deep rather than
+one per revision.
+"""
+import logging
+
+from landoapi.phabricator import PhabricatorClient
+
+logger = logging.getLogger(__name__)
+
+# Levels of parents and children followed from the starting revision.
+STACK_MAX_DEPTH = 50
+
+STACK_EDGE_TYPES = ('revision.parent', 'revision.child')
+
+
+def search_stack_edges(phabricator, revision_phid, *, max_depth=None):
+    """Return the parent edges of the stack containing `revision_phid`.
+
+    Args:
+        phabricator: A PhabricatorClient instance.
+        revision_phid: The PHID of the revision to start from.
+        max_depth: The number of levels to follow, STACK_MAX_DEPTH by
+            default.
+
+    Returns:
+        A 2-tuple of a sorted list of (child phid, parent phid) edges
+        and True if the depth limit stopped the walk before the whole
+        stack was found.
+    """
+    max_depth = STACK_MAX_DEPTH if max_depth is None else max_depth
+    edges = set()
+    seen = {revision_phid}
+    level = [revision_phid]
+    depth = 0
+    while level:
+        if depth >= max_depth:
+            logger.warning(
+                'stack depth limit reached',
+                extra={
+                    'revision_phid': revision_phid,
+                    'max_depth': max_depth,
+                }
+            )
+            return sorted(edges), True
+
+        next_level = []
+        for edge in _search_edges(phabricator, level):
+            source = PhabricatorClient.expect(edge, 'sourcePHID')
+            destination = PhabricatorClient.expect(edge, 'destinationPHID')
+            if PhabricatorClient.expect(edge, 'edgeType') == 'revision.parent':
+                edges.add((source, destination))
+            else:
+                edges.add((destination, source))
+
+            # Revisions already seen are not searched again, which also
+            # stops the walk if the edges contain a cycle.
+            if destination not in seen:
+                seen.add(destination)
+                next_level.append(destination)
+
+        level = sorted(next_level)
+        depth += 1
+
+    return sorted(edges), False
+
+
+def _search_edges(phabricator, phids):
+    cursor = {}
+    while True:
+        result = phabricator.call_conduit(
+            'edge.search',
+            sourcePHIDs=phids,
+            types=list(STACK_EDGE_TYPES),
+            **cursor
+        )
+        yield from PhabricatorClient.expect(result, 'data')
+
+        after = (result.get('cursor') or {}).get('after')
+        if after is None:
+            return
+
+        cursor = {'after': after}
+
+
+class RevisionStack:
+    """A graph of stacked revisions and their parent edges.
+
+    Attributes:
+        revisions: A dict mapping the PHID of every revision in the
+            stack to its data as returned by differential.revision.search.
+            Revisions the api token cannot see are missing.
+        truncated: True if the stack is deeper than the depth it was
+            resolved to.
+    """
+
+    def __init__(self, edges, revisions, *, truncated=False):
+        self.edges = [tuple(edge) for edge in edges]
+        self.revisions = revisions
+        self.truncated = truncated
+        self._parents = {}
+        self._children = {}
+        for child, parent in self.edges:
+            self._parents.setdefault(child, []).append(parent)
+            self._children.setdefault(parent, []).append(child)
+
+    def parents(self, phid):
+        return list(self._parents.get(phid, []))
+
+    def children(self, phid):
+        return list(self._children.get(phid, []))
+
+    def ancestors(self, phid):
+        """Return the PHIDs of every ancestor of `phid`, nearest first."""
+        ancestors = []
+        seen = {phid}
+        level = [phid]
+        while level:
+            next_level = []
+            for p in level:
+                for parent in self._parents.get(p, []):
+                    if parent not in seen:
+                        seen.add(parent)
+                        next_level.append(parent)
+
+            ancestors.extend(next_level)
+            level = next_level
+
+        return ancestors
+
+    def is_open(self, phid):
+        """Return True if the revision `phid` is visible and not closed."""
+        revision = self.revisions.get(phid)
+        if revision is None:
+            return False
+
+        return not PhabricatorClient.expect(
+            revision, 'fields', 'status', 'closed'
+        )
+
+    def open_parents(self, phid):
+        """Return the data of the open parents of the revision `phid`."""
+        return [
+            self.revisions[p] for p in self.parents(phid) if self.is_open(p)
+        ]
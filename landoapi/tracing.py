@@ -0,0 +1,126 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+Lightweight per-request tracing of calls to backing services.
+
+Time spent in Phabricator, the database, the cache, S3 and Transplant is
+recorded as named spans on `flask.g`. The per-name totals are added to
+the request summary log and, if TRACE_EXPORT is enabled, every span is
+logged in the Chrome Trace Event format to the 'request.trace' logger.
+"""
+import contextlib
+import logging
+import os
+import threading
+import time
+
+from flask import current_app, g, has_app_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+trace_logger = logging.getLogger('request.trace')
+
+# Threads working on the same request, such as prefetches, share `g`.
+_record_lock = threading.Lock()
+
+
+def record_span(name, start, end):
+    """Record a span which ran from `start` to `end` (from time.time())."""
+    if not has_app_context():
+        return
+
+    with _record_lock:
+        totals = g.get('_trace_totals', None)
+        if totals is None:
+            totals = g._trace_totals = {}
+
+        total = totals.get(name)
+        if total is None:
+            total = totals[name] = {'count': 0, 'ms': 0.0}
+        total['count'] += 1
+        total['ms'] += 1000 * (end - start)
+
+        events = g.get('_trace_events', None)
+        if events is not None:
+            events.append((name, start, end, threading.get_ident()))
+
+
+@contextlib.contextmanager
+def span(name):
+    """Context manager recording the time spent in its block as a span."""
+    start = time.time()
+    try:
+        yield
+    finally:
+        record_span(name, start, time.time())
+
+
+def start_request_trace():
+    """Begin collecting individual spans if TRACE_EXPORT is enabled."""
+    if current_app.config.get('TRACE_EXPORT') == 'y':
+        g._trace_events = []
+
+
+def span_summary():
+    """Return the span totals for the current request, in milliseconds."""
+    totals = g.get('_trace_totals', None) or {}
+    return {
+        name: {
+            'count': total['count'],
+            'ms': int(total['ms']),
+        }
+        for name, total in totals.items()
+    }
+
+
+def export_request_trace(start):
+    """Log the current request's spans in the Chrome Trace Event format.
+
+    Args:
+        start: The time.time() the request started at, which the span
+            timestamps are made relative to.
+    """
+    events = g.get('_trace_events', None)
+    if not events:
+        return
+
+    pid = os.getpid()
+    trace_logger.info(
+        'request trace',
+        extra={
+            'traceEvents': [
+                {
+                    'name': name,
+                    'ph': 'X',
+                    'ts': int(1000000 * (span_start - start)),
+                    'dur': int(1000000 * (span_end - span_start)),
+                    'pid': pid,
+                    'tid': tid,
+                } for name, span_start, span_end, tid in events
+            ],
+        }
+    )
+
+
+def _before_cursor_execute(
+    conn, cursor, statement, parameters, context, executemany
+):
+    context._trace_start = time.time()
+
+
+def _after_cursor_execute(
+    conn, cursor, statement, parameters, context, executemany
+):
+    start = getattr(context, '_trace_start', None)
+    if start is not None:
+        record_span('db', start, time.time())
+
+
+def initialize_tracing(flask_app):
+    for name, listener in (
+        ('before_cursor_execute', _before_cursor_execute),
+        ('after_cursor_execute', _after_cursor_execute),
+    ):
+        if not event.contains(Engine, name, listener):
+            event.listen(Engine, name, listener)
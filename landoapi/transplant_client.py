@@ -8,11 +8,25 @@ from random import randint
 
 import requests
 
+from landoapi.deadline import is_deadline_error, outbound_timeout
+from landoapi.resilience import TRANSPLANT
 from landoapi.sentry import sentry
+from landoapi.tracing import span
 
 logger = logging.getLogger(__name__)
 
 
+def is_transplant_failure(exc):
+    """Return True if `exc` indicates Transplant itself is failing."""
+    if is_deadline_error(exc):
+        return False
+
+    if isinstance(exc, requests.HTTPError):
+        return exc.response is None or exc.response.status_code >= 500
+
+    return isinstance(exc, requests.RequestException)
+
+
 class TransplantClient:
     """A class to interface with Transplant's API."""
 
@@ -33,10 +47,11 @@ class TransplantClient:
         """Sends a POST request to Transplant API to land a patch
 
         Args:
-            revision_id: integer id of the revision being landed
+            revision_id: integer id of the revision being landed, the top
+                of the stack when several patches are landed
             ldap_username: user landing the patch
-            patch_urls: list of patch URLs in S3, currently restricted to 1
-                entry. (ex. ['s3://{bucket_name}/L15_D123_1.patch'])
+            patch_urls: list of patch URLs in S3, in the order they are to
+                be applied. (ex. ['s3://{bucket_name}/L15_D123_1.patch'])
             tree: tree name as per https://treestatus.mozilla-releng.net/trees
             pingback: The URL of the endpoint to POST landing updates
 
@@ -50,46 +65,42 @@ class TransplantClient:
             elif transplant_mock_option == 'fail':
                 return None
 
-        # TODO: Although transplant accepts multiple patch urls to land
-        # our use of a single revision in 'rev' would open up a number
-        # of broken edge cases. Make sure we're not landing more than
-        # one patch before this has been fixed.
-        assert len(patch_urls) == 1
-
         try:
             # API structure from VCT/testing/autoland_mach_commands.py
-            response = self._submit_landing_request(
-                ldap_username=ldap_username,
-                tree=tree,
-                # This must be unique but consistent for the
-                # landing. This is important as 'rev' is the
-                # field used to prevent requesting the same
-                # thing land when it is already queued. After
-                # the landing is processed and has succeeded or
-                # failed 'rev' may be reused for a new landing
-                # request.
-                rev='D{}'.format(revision_id),
-                patch_urls=patch_urls,
-                # TODO: The main purpose of destination is to
-                # support landing on try as well as the main
-                # repository. Until we add try support we can
-                # get away with just sending 'upstream' for
-                # all requests. This is actually different
-                # than mozreview which sends things like
-                # 'gecko' or 'version-control-tools' here
-                # but it should work since the 'upstream'
-                # path is present in all of transplants
-                # repositories ('upstream' is hardcoded as
-                # the path that is pulled from).
-                destination='upstream',
-                pingback_url=pingback,
-                # push_bookmark should be sent to transplant as an empty
-                # string '' to indicate the repository does not use a
-                # push_bookmark. Sending null (None) will result in
-                # incorrect behaviour. Protect against this by
-                # making sure any falsey value is converted to ''.
-                push_bookmark=push_bookmark or ''
-            )
+            with TRANSPLANT.guard(is_failure=is_transplant_failure):
+                response = self._submit_landing_request(
+                    ldap_username=ldap_username,
+                    tree=tree,
+                    # This must be unique but consistent for the
+                    # landing. This is important as 'rev' is the
+                    # field used to prevent requesting the same
+                    # thing land when it is already queued. A stack is
+                    # identified by its top revision. After
+                    # the landing is processed and has succeeded or
+                    # failed 'rev' may be reused for a new landing
+                    # request.
+                    rev='D{}'.format(revision_id),
+                    patch_urls=patch_urls,
+                    # TODO: The main purpose of destination is to
+                    # support landing on try as well as the main
+                    # repository. Until we add try support we can
+                    # get away with just sending 'upstream' for
+                    # all requests. This is actually different
+                    # than mozreview which sends things like
+                    # 'gecko' or 'version-control-tools' here
+                    # but it should work since the 'upstream'
+                    # path is present in all of transplants
+                    # repositories ('upstream' is hardcoded as
+                    # the path that is pulled from).
+                    destination='upstream',
+                    pingback_url=pingback,
+                    # push_bookmark should be sent to transplant as an
+                    # empty string '' to indicate the repository does not
+                    # use a push_bookmark. Sending null (None) will result
+                    # in incorrect behaviour. Protect against this by
+                    # making sure any falsey value is converted to ''.
+                    push_bookmark=push_bookmark or ''
+                )
             return response.json()['request_id']
         except requests.HTTPError as e:
             sentry.captureException()
@@ -139,20 +150,21 @@ class TransplantClient:
         )
 
         submit_url = self.transplant_url + '/autoland'
-        response = requests.post(
-            url=submit_url,
-            json={
-                'ldap_username': ldap_username,
-                'tree': tree,
-                'rev': rev,
-                'patch_urls': patch_urls,
-                'destination': destination,
-                'push_bookmark': push_bookmark,
-                'pingback_url': pingback_url,
-            },
-            auth=(self.username, self.password),
-            timeout=10
-        )
+        with span('transplant'):
+            response = requests.post(
+                url=submit_url,
+                json={
+                    'ldap_username': ldap_username,
+                    'tree': tree,
+                    'rev': rev,
+                    'patch_urls': patch_urls,
+                    'destination': destination,
+                    'push_bookmark': push_bookmark,
+                    'pingback_url': pingback_url,
+                },
+                auth=(self.username, self.password),
+                timeout=outbound_timeout('transplant', 10)
+            )
         response.raise_for_status()
 
         logger.info(
@@ -0,0 +1,30 @@
+"""Allow landings to share a request id
+
+Revision ID: 54d61c1a5399
+Revises: 96a65d3e93f7
+Create Date: 2026-10-18 09:27:05.918233
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '54d61c1a5399'
+down_revision = '96a65d3e93f7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.drop_constraint('landings_request_id_key', 'landings', type_='unique')
+    op.create_index(
+        op.f('ix_landings_request_id'),
+        'landings', ['request_id'],
+        unique=False
+    )
+
+
+def downgrade():
+    op.drop_index(op.f('ix_landings_request_id'), table_name='landings')
+    op.create_unique_constraint(
+        'landings_request_id_key', 'landings', ['request_id']
+    )
@@ -0,0 +1,48 @@
+"""Add phabricator mirror
+
+Revision ID: 87528868718e
+Revises: 54d61c1a5399
+Create Date: 2026-10-18 11:46:19.552107
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '87528868718e'
+down_revision = '54d61c1a5399'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'phabricator_mirror_objects',
+        sa.Column('phid', sa.String(length=64), nullable=False),
+        sa.Column('object_type', sa.String(length=8), nullable=False),
+        sa.Column('object_id', sa.Integer(), nullable=True),
+        sa.Column('data', sa.JSON(), nullable=False),
+        sa.Column('synced_at', sa.DateTime(timezone=True), nullable=False),
+        sa.PrimaryKeyConstraint('phid'),
+    )
+    op.create_index(
+        'ix_phabricator_mirror_objects_type_id',
+        'phabricator_mirror_objects', ['object_type', 'object_id'],
+        unique=False
+    )
+    op.create_table(
+        'phabricator_mirror_state',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('feed_cursor', sa.String(length=64), nullable=True),
+        sa.Column('synced_at', sa.DateTime(timezone=True), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+
+
+def downgrade():
+    op.drop_table('phabricator_mirror_state')
+    op.drop_index(
+        'ix_phabricator_mirror_objects_type_id',
+        table_name='phabricator_mirror_objects'
+    )
+    op.drop_table('phabricator_mirror_objects')
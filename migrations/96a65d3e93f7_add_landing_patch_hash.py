@@ -0,0 +1,26 @@
+"""Add landing patch hash
+
+Revision ID: 96a65d3e93f7
+Revises:
+Create Date: 2026-10-18 09:12:41.304512
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '96a65d3e93f7'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        'landings',
+        sa.Column('patch_hash', sa.String(length=64), nullable=True)
+    )
+
+
+def downgrade():
+    op.drop_column('landings', 'patch_hash')
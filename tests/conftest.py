@@ -17,7 +17,8 @@ from landoapi.cache import cache
 from landoapi.landings import tokens_are_equal
 from landoapi.mocks.auth import MockAuth0, TEST_JWKS
 from landoapi.phabricator import PhabricatorClient
-from landoapi.repos import Repo, SCM_LEVEL_3
+from landoapi.repos import Repo, REPOSITORY_INDEX, SCM_LEVEL_3
+from landoapi.resilience import DEPENDENCIES
 from landoapi.storage import db as _db
 
 from tests.factories import TransResponseFactory
@@ -75,6 +76,50 @@ def docker_env_vars(monkeypatch):
     monkeypatch.delenv('CSP_REPORTING_URL', raising=False)
 
 
+class FakeClock:
+    """A monotonic clock which only moves when `now` is changed."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture(autouse=True)
+def restore_dependencies():
+    """Isolate each test from the process wide dependency state.
+
+    Every registered dependency, such as PHABRICATOR and TRANSPLANT, is
+    given a fresh breaker, bulkhead and retry budget for the test. The
+    original ones, and the registry itself, are restored afterwards so
+    dependencies registered, configured, or tripped by a test do not
+    leak into the next.
+    """
+    registered = dict(DEPENDENCIES)
+    saved = {}
+    for name, dependency in registered.items():
+        saved[name] = (
+            dependency.breaker, dependency.bulkhead, dependency.retry_budget
+        )
+        dependency.configure(max_concurrent=dependency.bulkhead.max_concurrent)
+
+    yield
+
+    DEPENDENCIES.clear()
+    DEPENDENCIES.update(registered)
+    for name, dependency in registered.items():
+        state = saved[name]
+        dependency.breaker = state[0]
+        dependency.bulkhead = state[1]
+        dependency.retry_budget = state[2]
+
+
 @pytest.fixture
 def request_mocker():
     """Yield a requests Mocker for response factories."""
@@ -88,6 +133,19 @@ def phabdouble(monkeypatch):
     yield PhabricatorDouble(monkeypatch)
 
 
+@pytest.fixture
+def conduit_calls(monkeypatch, phabdouble):
+    """Record the method of every conduit call made to the phabdouble."""
+    calls = []
+
+    def call_conduit(self, method, **kwargs):
+        calls.append(method)
+        return phabdouble.call_conduit(method, **kwargs)
+
+    monkeypatch.setattr(PhabricatorClient, 'call_conduit', call_conduit)
+    return calls
+
+
 @pytest.fixture
 def transfactory(request_mocker):
     """Mock Transplant service."""
@@ -186,6 +244,7 @@ def auth0_mock(jwks, monkeypatch):
 def mock_repo_config(monkeypatch):
     def set_repo_config(config):
         monkeypatch.setattr('landoapi.repos.REPO_CONFIG', config)
+        REPOSITORY_INDEX.clear()
 
     return set_repo_config
 
@@ -49,6 +49,7 @@ class PhabricatorDouble:
         self._phids = []
         self._phid_counters = {}
         self._edges = []
+        self._feed = []
         self._handlers = self._build_handlers()
 
         monkeypatch.setattr(
@@ -407,10 +408,53 @@ class PhabricatorDouble:
 
         return project
 
+    def feed_story(self, obj):
+        """Publish a feed story about `obj`, a dict with a 'phid'."""
+        story = {
+            'phid': self._new_phid('STRY-'),
+            'class': 'PhabricatorApplicationTransactionFeedStory',
+            'epoch': 1524000000 + len(self._feed),
+            'authorPHID': None,
+            'chronologicalKey': str(6540000000000000000 + len(self._feed)),
+            'objectPHID': obj['phid'],
+            'data': {},
+        }
+        self._feed.append(story)
+        return story
+
     @conduit_method('conduit.ping')
     def conduit_ping(self):
         return 'ip-123-123-123-123.us-west-2.compute.internal'
 
+    @conduit_method('feed.query')
+    def feed_query(
+        self,
+        *,
+        filterPHIDs=None,
+        limit=100,
+        after=None,
+        before=None,
+        format=None,
+        view=None
+    ):
+        # Like conduit's cursor pager, `after` pages to older stories and
+        # `before` to newer ones, the stories nearest the cursor first.
+        stories = sorted(self._feed, key=lambda s: int(s['chronologicalKey']))
+        if before is not None:
+            stories = [
+                s for s in stories if int(s['chronologicalKey']) > int(before)
+            ][:limit]
+        else:
+            if after is not None:
+                stories = [
+                    s for s in stories
+                    if int(s['chronologicalKey']) < int(after)
+                ]
+            stories = stories[-limit:]
+
+        # Newest first, and conduit encodes an empty result as a list.
+        return {s['phid']: deepcopy(s) for s in reversed(stories)} or []
+
     @conduit_method('project.search')
     def project_search(
         self,
@@ -1096,6 +1140,16 @@ class PhabricatorDouble:
             for i in self._phids if i['phid'] in phids
         }
 
+    @conduit_method('phid.lookup')
+    def phid_lookup(self, *, names=None):
+        handles = {
+            i['name']: deepcopy(i)
+            for i in self._phids if i['name'] in (names or [])
+        }
+
+        # Conduit encodes an empty result as a list.
+        return handles or []
+
     def _new_phid(self, prefix):
         suffix = self._phid_counters.get(prefix, '')
         self._phid_counters[prefix] = self._phid_counters.get(prefix, 0) + 1
@@ -0,0 +1,80 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+import pytest
+
+from landoapi import api_keys
+from landoapi.api_keys import (
+    api_key_hash,
+    forget_api_key,
+    verify_api_key,
+    verified_key_cache_key,
+)
+from landoapi.phabricator import PhabricatorAPIException
+
+
+class WhoamiClient:
+    def __init__(self, api_token, error_code=None):
+        self.api_token = api_token
+        self.error_code = error_code
+        self.calls = 0
+
+    def call_conduit(self, method, **kwargs):
+        assert method == 'user.whoami'
+        self.calls += 1
+        if self.error_code:
+            raise PhabricatorAPIException(error_code=self.error_code)
+
+        return {'phid': 'PHID-USER-1', 'userName': 'test'}
+
+
+@pytest.fixture
+def local_keys(monkeypatch):
+    keys = {}
+    monkeypatch.setattr(api_keys, '_local_keys', keys)
+    return keys
+
+
+def test_verified_key_is_cached(app, redis_cache, local_keys):
+    phab = WhoamiClient('api-key')
+    with app.app_context():
+        assert verify_api_key(phab) == 'PHID-USER-1'
+        assert verify_api_key(phab) == 'PHID-USER-1'
+        assert phab.calls == 1
+
+        # Other processes find the key in redis.
+        local_keys.clear()
+        assert verify_api_key(phab) == 'PHID-USER-1'
+        assert phab.calls == 1
+
+        key_hash = api_key_hash('api-key')
+        assert 'api-key' not in key_hash
+        assert redis_cache.get(verified_key_cache_key(key_hash))
+
+
+def test_invalid_key_is_not_cached(app, redis_cache, local_keys):
+    phab = WhoamiClient('api-key', error_code='ERR-INVALID-AUTH')
+    with app.app_context():
+        assert verify_api_key(phab) is None
+        assert verify_api_key(phab) is None
+        assert phab.calls == 2
+
+
+def test_forgotten_key_is_verified_again(app, redis_cache, local_keys):
+    phab = WhoamiClient('api-key')
+    with app.app_context():
+        verify_api_key(phab)
+        forget_api_key('api-key')
+        assert not local_keys
+
+        phab.error_code = 'ERR-INVALID-AUTH'
+        assert verify_api_key(phab) is None
+        assert phab.calls == 2
+
+
+def test_verification_works_without_redis(app, local_keys):
+    phab = WhoamiClient('api-key')
+    with app.app_context():
+        assert verify_api_key(phab) == 'PHID-USER-1'
+        assert verify_api_key(phab) == 'PHID-USER-1'
+        assert phab.calls == 1
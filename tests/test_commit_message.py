@@ -1,7 +1,16 @@
 # This Source Code Form is subject to the terms of the Mozilla Public
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
-from landoapi.commit_message import format_commit_message
+import random
+
+import pytest
+
+from landoapi.commit_message import (
+    format_commit_message,
+    format_title,
+    parse_bugs,
+    replace_reviewers,
+)
 
 COMMIT_MESSAGE = """
 Bug 1 - A title. r=reviewer_one,reviewer_two
@@ -39,3 +48,70 @@ def test_commit_message_blank_summary():
     # A blank summary should result in only a single blank line between
     # the title and other fields, not several.
     assert len(message.splitlines()) == 3
+
+
+# Fragments commonly found in mozilla-central commit titles, chosen to
+# exercise the bug and reviewer specifier parsing.
+TITLE_FRAGMENTS = (
+    'Bug', 'bug', 'b=', '#', '1', '12', '12345', '1234567', '123456789', 'r=',
+    'r?', 'sr=', 'rs=', 'a=', 'ui-r=', 'R=', 'r=foo', 'r?bar', 'baz',
+    'foo-bar', 'a_b', ' ', '  ', ',', ', ', ';', '/', '\\', '.', '(', ')', '[',
+    ']', '-', ' - ', '\n', '\r\n', '\t', '\0', 'DONTBUILD',
+)
+REVIEWER_CHOICES = ([], ['one'], ['one', 'two'], ['a-b', 'c_d', 'e'])
+BUG_CHOICES = (None, 0, 1, 12, 12345, 1234567, 123456789)
+
+
+def reference_format_title(title, bug, reviewers):
+    """The original, unoptimized, title formatting."""
+    if bug and bug not in parse_bugs(title):
+        title = 'Bug {} - {}'.format(bug, title)
+
+    return replace_reviewers(title, reviewers).strip()
+
+
+@pytest.mark.parametrize(
+    'title', [
+        '',
+        'A title.',
+        'Bug 1 - A title.',
+        'bug 1: A title r?foo',
+        'A title. r=foo, r=bar',
+        'A title (r=foo,bar; r?baz)',
+        'A title. sr=foo r=bar a=release',
+        'A title. r=foo\nSecond line r=bar',
+        '12345 - A title r=foo,r=bar/r?baz',
+        'r=foo at the start',
+        'Bug 123456789 - A title. r=foo',
+    ]
+)
+@pytest.mark.parametrize('bug', BUG_CHOICES)
+@pytest.mark.parametrize('reviewers', REVIEWER_CHOICES)
+def test_format_title_matches_reference(title, bug, reviewers):
+    expected = reference_format_title(title, bug, reviewers)
+    assert format_title(title, bug, tuple(reviewers)) == expected
+
+
+def test_format_title_fuzz_matches_reference():
+    rng = random.Random(1234)
+    for _ in range(5000):
+        title = ''.join(
+            rng.choice(TITLE_FRAGMENTS) for _ in range(rng.randint(0, 12))
+        )
+        bug = rng.choice(BUG_CHOICES)
+        reviewers = rng.choice(REVIEWER_CHOICES)
+
+        expected = reference_format_title(title, bug, reviewers)
+        assert format_title(title, bug, tuple(reviewers)) == expected, (
+            'Mismatch for {!r}, {!r}, {!r}'.format(title, bug, reviewers)
+        )
+
+
+def test_format_title_is_memoized():
+    format_title.cache_clear()
+    format_commit_message('A title.', 1, ['one'], '', 'http://test/D1')
+    format_commit_message('A title.', 1, ['one'], '', 'http://test/D1')
+
+    info = format_title.cache_info()
+    assert info.misses == 1
+    assert info.hits == 1
@@ -0,0 +1,85 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+import time
+
+import flask
+import pytest
+import requests
+import requests_mock
+
+from landoapi.deadline import (
+    DeadlineExceeded,
+    deadline_seconds,
+    is_deadline_error,
+    outbound_timeout,
+    parse_deadlines,
+)
+from landoapi.resilience import CircuitBreaker, PHABRICATOR
+
+from tests.utils import phab_url
+
+
+def test_parse_deadlines():
+    assert parse_deadlines(None) == {}
+    assert parse_deadlines(
+        'landoapi.api.landings.post=60, landoapi.api.revisions.get=5.5'
+    ) == {
+        'landoapi.api.landings.post': 60,
+        'landoapi.api.revisions.get': 5.5,
+    }
+
+
+def test_deadline_seconds_by_operation(app, config):
+    config['REQUEST_DEADLINE'] = 30
+    config['REQUEST_DEADLINES'] = {'landoapi.api.landings.post': 60}
+    with app.app_context():
+        assert deadline_seconds('/.landoapi_api_landings_post') == 60
+        assert deadline_seconds('/.landoapi_api_landings_get') == 30
+        assert deadline_seconds(None) == 30
+
+
+def test_outbound_timeout_without_deadline():
+    assert outbound_timeout('test') is None
+    assert outbound_timeout('test', 10) == 10
+
+
+def test_outbound_timeout_uses_time_remaining(app):
+    with app.app_context():
+        flask.g._deadline = time.monotonic() + 5
+        assert 4 < outbound_timeout('test') <= 5
+        assert outbound_timeout('test', 1) == 1
+
+        flask.g._deadline = time.monotonic()
+        with pytest.raises(DeadlineExceeded) as exc_info:
+            outbound_timeout('test')
+
+    assert exc_info.value.status == 504
+
+
+def test_is_deadline_error(app):
+    assert not is_deadline_error(requests.Timeout())
+    with app.app_context():
+        flask.g._deadline = time.monotonic() + 5
+        assert not is_deadline_error(requests.Timeout())
+        assert not is_deadline_error(ValueError())
+
+        flask.g._deadline = time.monotonic()
+        assert is_deadline_error(requests.Timeout())
+        assert not is_deadline_error(requests.ConnectionError())
+        assert is_deadline_error(DeadlineExceeded('test'))
+
+
+def test_expired_request_fails_fast(client, config):
+    config['REQUEST_DEADLINE'] = 0
+    PHABRICATOR.configure(max_concurrent=1, min_calls=1)
+    with requests_mock.mock() as m:
+        m.post(phab_url('differential.revision.search'), json={})
+        response = client.get('/revisions/D1')
+        assert not m.called
+
+    assert response.status_code == 504
+    assert response.json['title'] == 'Deadline Exceeded'
+
+    # Running out of time is not a Phabricator failure.
+    assert PHABRICATOR.breaker.state == CircuitBreaker.CLOSED
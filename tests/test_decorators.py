@@ -1,12 +1,14 @@
 # This Source Code Form is subject to the terms of the Mozilla Public
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
+import threading
+
 import flask
 import pytest
 
 from connexion.lifecycle import ConnexionResponse
 
-from landoapi.decorators import require_phabricator_api_key, lazy
+from landoapi.decorators import lazy, prefetch, require_phabricator_api_key
 from landoapi.phabricator import PhabricatorClient
 
 
@@ -31,8 +33,8 @@ def test_require_phabricator_api_key(
     if valid_key is not None:
         headers.append(('X-Phabricator-API-Key', 'custom-key'))
         monkeypatch.setattr(
-            'landoapi.decorators.PhabricatorClient.verify_api_token',
-            lambda *args, **kwargs: valid_key
+            'landoapi.decorators.verify_api_key',
+            lambda *args, **kwargs: 'PHID-USER-1' if valid_key else None
         )
 
     with app.test_request_context('/', headers=headers):
@@ -109,3 +111,55 @@ def test_lazy_recursive_calls():
     assert counter_a(
         "HELLO", "FROM", another_we_need="BASIC"
     )() == ("HELLO", "FROM", "BASIC")
+
+
+def test_prefetch_evaluates_values_concurrently(app, config):
+    config['PREFETCH_MAX_WORKERS'] = 2
+    threads = []
+    barrier = threading.Barrier(2, timeout=5)
+
+    @lazy
+    def shared():
+        threads.append(threading.get_ident())
+        return 'shared'
+
+    @lazy
+    def dependent(value):
+        # Both values must be evaluated at the same time to pass.
+        barrier.wait()
+        flask.g.evaluated.append(value)
+        return value
+
+    @lazy
+    def failing():
+        raise ValueError('oops')
+
+    with app.app_context():
+        flask.g.evaluated = []
+        shared_value = shared()
+        first, second = dependent(shared_value), dependent(shared_value)
+        prefetch(first, second)
+
+        assert flask.g.evaluated == ['shared', 'shared']
+        assert len(threads) == 1
+        assert threads[0] != threading.get_ident()
+        assert first() == second() == 'shared'
+
+        value = failing()
+        prefetch(value, first)
+        with pytest.raises(ValueError):
+            value()
+
+
+def test_prefetch_disabled(app, config):
+    config['PREFETCH_MAX_WORKERS'] = 0
+    evaluated = []
+
+    @lazy
+    def counter():
+        evaluated.append(1)
+
+    with app.app_context():
+        prefetch(counter(), counter())
+
+    assert not evaluated
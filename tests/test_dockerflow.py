@@ -43,7 +43,7 @@ def test_heartbeat_returns_http_502_if_phabricator_ping_returns_error(
     request_mocker.get(
         trans_url(''), status_code=200, text='Welcome to Autoland'
     )
-    request_mocker.get(
+    request_mocker.post(
         phab_url('conduit.ping'), status_code=500, json=error_json
     )
     response = client.get('/__heartbeat__')
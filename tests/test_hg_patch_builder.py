@@ -2,7 +2,14 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
-from landoapi.hgexportbuilder import build_patch_for_revision
+import io
+
+import pytest
+
+from landoapi.hgexportbuilder import (
+    build_patch_chunks_for_revision,
+    build_patch_for_revision,
+)
 
 GIT_DIFF_FROM_REVISION = """diff --git a/hello.c b/hello.c
 --- a/hello.c   Fri Aug 26 01:21:28 2005 -0700
@@ -58,3 +65,27 @@ def test_build_patch():
     )
 
     assert patch == HG_PATCH
+
+
+@pytest.mark.parametrize(
+    'diff', [
+        GIT_DIFF_FROM_REVISION,
+        GIT_DIFF_FROM_REVISION.encode('utf-8'),
+        '',
+        'diff --git a/い漢 b/い漢\n+🏄🦈\n',
+    ]
+)
+def test_build_patch_chunks_matches_build_patch(diff):
+    str_diff = diff.decode('utf-8') if isinstance(diff, bytes) else diff
+    expected = build_patch_for_revision(
+        str_diff, 'Jöe User', 'joe@example.com', COMMIT_MESSAGE, '1496239141'
+    ).encode('utf-8')
+
+    chunks = build_patch_chunks_for_revision(
+        diff, 'Jöe User', 'joe@example.com', COMMIT_MESSAGE, '1496239141'
+    )
+    assert b''.join(chunks) == expected
+
+    f = io.BytesIO()
+    f.writelines(chunks)
+    assert f.getvalue() == expected
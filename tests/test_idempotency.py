@@ -0,0 +1,130 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+from flask import g
+
+from landoapi.cache import cache
+from landoapi.idempotency import (
+    idempotency_cache_key,
+    idempotent,
+    request_fingerprint,
+)
+from landoapi.models.landing import Landing
+
+
+def land(client, auth0_mock, revision, diff, key='key-1'):
+    return client.post(
+        '/landings',
+        json={
+            'revision_id': 'D{}'.format(revision['id']),
+            'diff_id': diff['id'],
+        },
+        headers=auth0_mock.mock_headers + [('Idempotency-Key', key)],
+    )
+
+
+def test_retried_landing_replays_response(
+    db, client, phabdouble, transfactory, s3, auth0_mock, redis_cache
+):
+    diff = phabdouble.diff()
+    revision = phabdouble.revision(diff=diff, repo=phabdouble.repo())
+    phabdouble.reviewer(revision, phabdouble.user(username='reviewer'))
+    transfactory.mock_successful_response(3)
+
+    response = land(client, auth0_mock, revision, diff)
+    assert response.status_code == 202
+    assert 'Idempotent-Replayed' not in response.headers
+
+    retry = land(client, auth0_mock, revision, diff)
+    assert retry.status_code == 202
+    assert retry.json == response.json
+    assert retry.headers['Idempotent-Replayed'] == 'true'
+    assert Landing.query.count() == 1
+
+    other_diff = phabdouble.diff(revision=revision)
+    reused = land(client, auth0_mock, revision, other_diff)
+    assert reused.status_code == 422
+
+
+def test_failed_landing_is_not_replayed(
+    db, client, phabdouble, transfactory, s3, auth0_mock, redis_cache
+):
+    diff = phabdouble.diff()
+    revision = phabdouble.revision(diff=diff, repo=phabdouble.repo())
+    phabdouble.reviewer(revision, phabdouble.user(username='reviewer'))
+    transfactory.mock_http_error_response()
+
+    assert land(client, auth0_mock, revision, diff).status_code == 502
+
+    transfactory.mock_successful_response(3)
+    assert land(client, auth0_mock, revision, diff).status_code == 202
+
+
+@pytest.fixture
+def idempotent_request(app):
+    with app.test_request_context(headers={'Idempotency-Key': 'key-1'}):
+        g.auth0_user = SimpleNamespace(email='tuser@example.com')
+        g.phabricator = SimpleNamespace(api_token='api-token')
+        yield idempotency_cache_key(g.auth0_user, 'api-token', 'key-1')
+
+
+def claim(cache_key, data):
+    cache.add('{}_claim'.format(cache_key), request_fingerprint(data))
+
+
+def test_retry_waits_for_in_flight_request(
+    app, redis_cache, idempotent_request
+):
+    claim(idempotent_request, {'a': 1})
+
+    def respond():
+        with app.app_context():
+            cache.set(
+                idempotent_request, {
+                    'fingerprint': request_fingerprint({
+                        'a': 1
+                    }),
+                    'body': {
+                        'id': 7
+                    },
+                    'status': 202,
+                }
+            )
+
+    threading.Timer(0.3, respond).start()
+    handler = idempotent(lambda data: pytest.fail('handled twice'))
+
+    assert handler({
+        'a': 1
+    }) == ({
+        'id': 7
+    }, 202, {
+        'Idempotent-Replayed': 'true'
+    })
+
+
+def test_in_flight_request_conflicts_at_deadline(
+    app, redis_cache, idempotent_request
+):
+    claim(idempotent_request, {'a': 1})
+    g._deadline = time.monotonic() + 0.2
+    handler = idempotent(lambda data: pytest.fail('handled twice'))
+
+    assert handler({'a': 1}).status_code == 409
+
+
+def test_claimed_key_reused_for_other_body(
+    app, redis_cache, idempotent_request
+):
+    claim(idempotent_request, {'a': 1})
+    g._deadline = time.monotonic() + 5
+    handler = idempotent(lambda data: pytest.fail('handled twice'))
+
+    start = time.monotonic()
+    assert handler({'a': 2}).status_code == 422
+    assert time.monotonic() - start < 1
@@ -1,9 +1,19 @@
 # This Source Code Form is subject to the terms of the Mozilla Public
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
+import datetime
+
 import pytest
 
-from landoapi.landings import LandingAssessment, LandingProblem
+from landoapi.auth import A0User
+from landoapi.landings import (
+    assessment_cache_key,
+    DiffNotLatest,
+    LandingAssessment,
+    LandingProblem,
+    merge_stack_assessments,
+    PreviouslyLanded,
+)
 from landoapi.mocks.canned_responses.auth0 import CANNED_USERINFO
 from landoapi.models.landing import Landing, LandingStatus
 from landoapi.phabricator import RevisionStatus
@@ -445,3 +455,142 @@ def test_diff_author_unknown_blocks(db, client, phabdouble, auth0_mock):
     )
     assert response.status_code == 200
     assert response.json['blockers'][0]['id'] == 'E007'
+
+
+def test_assessment_from_dict_round_trips():
+    assessment = LandingAssessment(
+        warnings=[PreviouslyLanded('landed'), MockProblem('oops')],
+        blockers=[DiffNotLatest('not latest')],
+    )
+    details = assessment.to_dict()
+
+    assert LandingAssessment.from_dict(details).to_dict() == details
+
+
+def test_merge_stack_assessments_prefixes_revisions():
+    single = LandingAssessment(warnings=[MockProblem('a')])
+    assert merge_stack_assessments([(1, single)]) is single
+
+    merged = merge_stack_assessments(
+        [(1, single), (2, LandingAssessment(warnings=[MockProblem('b')]))]
+    )
+    assert [w.serialize() for w in merged.warnings] == [
+        {
+            'id': 'M0CK',
+            'message': 'D1: a'
+        },
+        {
+            'id': 'M0CK',
+            'message': 'D2: b'
+        },
+    ]
+
+    blocked = merge_stack_assessments(
+        [(1, single), (2, LandingAssessment(blockers=[MockProblem('c')]))]
+    )
+    assert blocked.warnings == []
+    assert [b.message for b in blocked.blockers] == ['D2: c']
+
+
+def test_dryrun_stack_allows_parents_landing_before(
+    db, client, phabdouble, auth0_mock
+):
+    repo = phabdouble.repo()
+    reviewer = phabdouble.user(username='reviewer')
+    bottom_diff = phabdouble.diff()
+    bottom = phabdouble.revision(diff=bottom_diff, repo=repo)
+    top_diff = phabdouble.diff()
+    top = phabdouble.revision(diff=top_diff, repo=repo, depends_on=[bottom])
+    phabdouble.reviewer(bottom, reviewer)
+    phabdouble.reviewer(top, reviewer)
+
+    response = client.post(
+        '/landings/dryrun',
+        json={
+            'revision_id':
+            'D{}'.format(top['id']),
+            'diff_id':
+            top_diff['id'],
+            'stack': [
+                {
+                    'revision_id': 'D{}'.format(bottom['id']),
+                    'diff_id': bottom_diff['id'],
+                },
+            ],
+        },
+        headers=auth0_mock.mock_headers,
+    )
+    assert response.status_code == 200
+    assert response.json['blockers'] == []
+
+
+def test_dryrun_assessment_is_cached(
+    client, db, phabdouble, auth0_mock, redis_cache, monkeypatch
+):
+    diff = phabdouble.diff()
+    revision = phabdouble.revision(
+        diff=diff, repo=phabdouble.repo(), status=RevisionStatus.NEEDS_REVIEW
+    )
+    request = dict(
+        revision_id='D{}'.format(revision['id']), diff_id=diff['id']
+    )
+
+    response = client.post(
+        '/landings/dryrun', json=request, headers=auth0_mock.mock_headers
+    )
+    assert response.status_code == 200
+    assert response.json['warnings'][0]['id'] == 'W004'
+
+    def fail(*args, **kwargs):
+        raise AssertionError('assessment should have been cached')
+
+    monkeypatch.setattr('landoapi.api.landings.check_landing_conditions', fail)
+    cached_response = client.post(
+        '/landings/dryrun', json=request, headers=auth0_mock.mock_headers
+    )
+    assert cached_response.status_code == 200
+    assert cached_response.json == response.json
+
+
+def test_assessment_cache_key_changes_with_landing_version(
+    app, get_phab_client, phabdouble
+):
+    revision = phabdouble.revision(repo=phabdouble.repo())
+    revision = phabdouble.call_conduit(
+        'differential.revision.search',
+        constraints={'ids': [revision['id']]},
+    )['data'][0]
+    user = A0User('token', CANNED_USERINFO['STANDARD'])
+    phab = get_phab_client()
+    landing = Landing(
+        id=1,
+        revision_id=revision['id'],
+        status=LandingStatus.submitted,
+        updated_at=datetime.datetime(2018, 1, 1),
+    )
+
+    submitted_key = assessment_cache_key(phab, user, 1, revision, landing)
+    assert submitted_key == assessment_cache_key(
+        phab, user, 1, revision, landing
+    )
+    assert submitted_key != assessment_cache_key(phab, user, 1, revision, None)
+    assert submitted_key != assessment_cache_key(
+        phab, user, 2, revision, landing
+    )
+
+    # A pingback updates the landing, invalidating earlier assessments.
+    landing.status = LandingStatus.landed
+    landing.updated_at = datetime.datetime(2018, 1, 2)
+    assert submitted_key != assessment_cache_key(
+        phab, user, 1, revision, landing
+    )
+
+    other_user = A0User('token', CANNED_USERINFO['EXPIRED_L3'])
+    assert submitted_key != assessment_cache_key(
+        phab, other_user, 1, revision, landing
+    )
+
+
+def test_assessment_cache_key_none_for_missing_revision(get_phab_client):
+    user = A0User('token', CANNED_USERINFO['STANDARD'])
+    assert assessment_cache_key(get_phab_client(), user, 1, None, None) is None
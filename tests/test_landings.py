@@ -73,6 +73,7 @@ def test_landing_revision_saves_data_in_db(
     assert landing.status == LandingStatus.submitted
     assert landing.active_diff_id == diff['id']
     assert landing.request_id == land_request_id
+    assert len(landing.patch_hash) == 64
 
 
 def test_landing_without_auth0_permissions(client, auth0_mock, phabdouble, db):
@@ -317,6 +318,114 @@ def test_land_with_open_parent(db, client, phabdouble, auth0_mock):
     assert response.json['blockers'][0]['id'] == 'E004'
 
 
+def test_land_stack_in_one_transplant_request(
+    db, client, phabdouble, monkeypatch, s3, auth0_mock
+):
+    repo = phabdouble.repo(name='mozilla-central')
+    reviewer = phabdouble.user(username='reviewer')
+    bottom_diff = phabdouble.diff()
+    bottom = phabdouble.revision(diff=bottom_diff, repo=repo)
+    top_diff = phabdouble.diff()
+    top = phabdouble.revision(diff=top_diff, repo=repo, depends_on=[bottom])
+    phabdouble.reviewer(bottom, reviewer)
+    phabdouble.reviewer(top, reviewer)
+
+    tsclient = MagicMock(spec=TransplantClient)
+    tsclient().land.return_value = 5
+    monkeypatch.setattr('landoapi.api.landings.TransplantClient', tsclient)
+    response = client.post(
+        '/landings',
+        json={
+            'revision_id':
+            'D{}'.format(top['id']),
+            'diff_id':
+            top_diff['id'],
+            'stack': [
+                {
+                    'revision_id': 'D{}'.format(bottom['id']),
+                    'diff_id': bottom_diff['id'],
+                },
+            ],
+        },
+        headers=auth0_mock.mock_headers,
+    )
+    assert response.status_code == 202
+    assert response.json == {'id': 2, 'stack': [1, 2]}
+
+    tsclient().land.assert_called_once_with(
+        revision_id=top['id'],
+        ldap_username='tuser@example.com',
+        patch_urls=[
+            patches.url(
+                'landoapi.test.bucket',
+                patches.name(bottom['id'], bottom_diff['id'])
+            ),
+            patches.url(
+                'landoapi.test.bucket',
+                patches.name(top['id'], top_diff['id'])
+            ),
+        ],
+        tree='mozilla-central',
+        pingback='{}/landings/update'.format(os.getenv('PINGBACK_HOST_URL')),
+        push_bookmark=''
+    )
+
+    db.session.close()
+    landings = Landing.query.order_by(Landing.id).all()
+    landed = [
+        (landing.revision_id, landing.request_id) for landing in landings
+    ]
+    assert landed == [(bottom['id'], 5), (top['id'], 5)]
+
+
+def test_land_stack_in_wrong_order_is_blocked(
+    db, client, phabdouble, s3, auth0_mock
+):
+    repo = phabdouble.repo()
+    bottom_diff = phabdouble.diff()
+    bottom = phabdouble.revision(diff=bottom_diff, repo=repo)
+    top_diff = phabdouble.diff()
+    top = phabdouble.revision(diff=top_diff, repo=repo, depends_on=[bottom])
+
+    response = client.post(
+        '/landings',
+        json={
+            'revision_id':
+            'D{}'.format(bottom['id']),
+            'diff_id':
+            bottom_diff['id'],
+            'stack': [
+                {
+                    'revision_id': 'D{}'.format(top['id']),
+                    'diff_id': top_diff['id'],
+                },
+            ],
+        },
+        headers=auth0_mock.mock_headers,
+    )
+    assert response.status_code == 400
+    assert response.json['blockers'][0]['id'] == 'E004'
+    message = response.json['blockers'][0]['message']
+    assert message.startswith('D{}: '.format(top['id']))
+
+
+def test_land_stack_with_repeated_revision(db, client, phabdouble, auth0_mock):
+    diff = phabdouble.diff()
+    revision = phabdouble.revision(diff=diff, repo=phabdouble.repo())
+    entry = {
+        'revision_id': 'D{}'.format(revision['id']),
+        'diff_id': diff['id']
+    }
+
+    response = client.post(
+        '/landings',
+        json=dict(entry, stack=[entry]),
+        headers=auth0_mock.mock_headers,
+    )
+    assert response.status_code == 400
+    assert response.json['title'] == 'Bad Request'
+
+
 @freeze_time('2017-11-02T00:00:00')
 def test_get_jobs_by_revision_id(db, client, phabdouble):
     repo = phabdouble.repo()
@@ -448,6 +557,27 @@ def test_update_landing(db, client):
     assert landing.status == LandingStatus.landed
 
 
+def test_update_landing_updates_whole_stack(db, client):
+    _create_landing(db, 1, 1, 1, status=LandingStatus.submitted)
+    _create_landing(db, 1, 2, 2, status=LandingStatus.submitted)
+    response = client.post(
+        '/landings/update',
+        json={'request_id': 1,
+              'landed': True,
+              'result': 'sha123'},
+        headers=[('API-Key', 'someapikey')],
+    )
+
+    assert response.status_code == 200
+
+    db.session.close()
+    landings = Landing.query.order_by(Landing.id).all()
+    assert [(landing.status, landing.result) for landing in landings] == [
+        (LandingStatus.landed, 'sha123'),
+        (LandingStatus.landed, 'sha123'),
+    ]
+
+
 def test_update_landing_bad_request_id(db, client):
     _create_landing(db, 1, 1, 1, status=LandingStatus.submitted)
     response = client.post(
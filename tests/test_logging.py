@@ -0,0 +1,110 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+import io
+import json
+import logging
+import queue
+import sys
+
+from landoapi.logging import (
+    DroppingQueueHandler,
+    MozLogFormatter,
+    start_async_logging,
+    stop_async_logging,
+)
+
+
+def make_record(msg='a message', exc_info=None, **extra):
+    record = logging.LogRecord(
+        'landoapi.test', logging.INFO, __file__, 1, msg, (), exc_info
+    )
+    record.__dict__.update(extra)
+    return record
+
+
+def test_mozlog_record_fields():
+    formatter = MozLogFormatter(mozlog_logger='lando-api')
+    record = json.loads(formatter.format(make_record(revision_id=1)))
+
+    assert record['Logger'] == 'lando-api'
+    assert record['Type'] == 'landoapi.test'
+    assert record['Severity'] == MozLogFormatter.SL_INFO
+    assert record['Fields'] == {'msg': 'a message', 'revision_id': 1}
+
+
+def test_unserializable_extras_are_logged_as_repr():
+    class Unserializable:
+        def __repr__(self):
+            return '<Unserializable>'
+
+    formatter = MozLogFormatter()
+    record = json.loads(
+        formatter.
+        format(make_record(arguments=(Unserializable(), ), kw={1: b'bytes'}))
+    )
+
+    assert record['Fields']['arguments'] == ['<Unserializable>']
+    assert record['Fields']['kw'] == {'1': "b'bytes'"}
+
+
+def test_exception_is_logged():
+    try:
+        raise ValueError('oops')
+    except ValueError:
+        exc_info = sys.exc_info()
+
+    formatter = MozLogFormatter()
+    record = json.loads(formatter.format(make_record(exc_info=exc_info)))
+
+    assert record['Fields']['exc']['error'].startswith('ValueError(')
+    assert 'test_exception_is_logged' in record['Fields']['exc']['traceback']
+
+
+def test_queue_handler_formats_before_enqueue():
+    handler = DroppingQueueHandler(queue.Queue())
+    handler.setFormatter(MozLogFormatter())
+    state = {'status': 'started'}
+    handler.handle(make_record(state=state))
+    state['status'] = 'finished'
+
+    record = handler.queue.get_nowait()
+    assert json.loads(record.msg)['Fields']['state'] == {'status': 'started'}
+    assert record.args is None
+
+
+def test_queue_handler_drops_and_reports_when_full():
+    handler = DroppingQueueHandler(queue.Queue(2))
+    handler.setFormatter(MozLogFormatter())
+    for _ in range(3):
+        handler.handle(make_record())
+
+    assert handler.dropped == 1
+    handler.queue.get_nowait()
+    handler.queue.get_nowait()
+
+    handler.handle(make_record('after'))
+    fields = [
+        json.loads(handler.queue.get_nowait().msg)['Fields'] for _ in range(2)
+    ]
+    assert fields[0]['msg'] == 'after'
+    assert fields[1] == {'msg': 'dropped log records', 'dropped': 1}
+
+
+def test_async_logging_writes_from_listener():
+    stream = io.StringIO()
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(MozLogFormatter())
+    logger = logging.getLogger('landoapi.test.async')
+    logger.propagate = False
+    logger.handlers = [handler]
+
+    try:
+        start_async_logging(handler, [logger], maxsize=10)
+        logger.warning('queued', extra={'revision_id': 1})
+    finally:
+        stop_async_logging()
+        logger.handlers = []
+
+    record = json.loads(stream.getvalue())
+    assert record['Fields'] == {'msg': 'queued', 'revision_id': 1}
@@ -0,0 +1,170 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from landoapi.cache import cache
+from landoapi.metrics import (
+    CACHE_REQUESTS,
+    Counter,
+    Gauge,
+    Histogram,
+    DEAD_SNAPSHOT_FILENAME,
+    merge_snapshot,
+    Registry,
+    render,
+)
+
+
+@pytest.fixture
+def registry():
+    return Registry()
+
+
+def test_counter_and_gauge_render(registry):
+    counter = Counter(
+        'test_total', 'A counter.', ('result', ), registry=registry
+    )
+    gauge = Gauge('test_gauge', 'A gauge.', registry=registry)
+    counter.inc(result='hit')
+    counter.inc(2, result='hit')
+    counter.inc(result='mi"ss')
+    gauge.set(3)
+
+    assert render(registry.snapshot()).splitlines() == [
+        '# HELP test_gauge A gauge.',
+        '# TYPE test_gauge gauge',
+        'test_gauge 3',
+        '# HELP test_total A counter.',
+        '# TYPE test_total counter',
+        'test_total{result="hit"} 3',
+        'test_total{result="mi\\"ss"} 1',
+    ]
+
+
+def test_histogram_buckets_are_cumulative(registry):
+    histogram = Histogram(
+        'test_seconds',
+        'A histogram.', ('method', ),
+        buckets=(0.1, 1),
+        registry=registry
+    )
+    for value in (0.05, 0.5, 0.5, 5):
+        histogram.observe(value, method='a')
+
+    assert render(registry.snapshot()).splitlines()[2:] == [
+        'test_seconds_bucket{method="a",le="0.1"} 1',
+        'test_seconds_bucket{method="a",le="1"} 3',
+        'test_seconds_bucket{method="a",le="+Inf"} 4',
+        'test_seconds_sum{method="a"} 6.05',
+        'test_seconds_count{method="a"} 4',
+    ]
+
+
+def test_wrong_labels_raise(registry):
+    counter = Counter('test_total', 'A counter.', ('a', ), registry=registry)
+    with pytest.raises(ValueError):
+        counter.inc(b='1')
+
+    with pytest.raises(ValueError):
+        Counter('test_total', 'Duplicate.', registry=registry)
+
+
+def test_merge_snapshot_sums_samples_and_drops_dead_gauges(registry):
+    counter = Counter('test_total', 'A counter.', registry=registry)
+    gauge = Gauge('test_gauge', 'A gauge.', registry=registry)
+    histogram = Histogram(
+        'test_seconds', 'A histogram.', buckets=(1, ), registry=registry
+    )
+    counter.inc()
+    gauge.set(2)
+    histogram.observe(0.5)
+
+    merged = {}
+    merge_snapshot(merged, registry.snapshot())
+    merge_snapshot(merged, registry.snapshot(), alive=False)
+
+    assert merged['test_total']['samples'] == [[[], 2]]
+    assert merged['test_gauge']['samples'] == [[[], 2]]
+    assert merged['test_seconds']['samples'] == [[[], [2, 0, 1.0, 2]]]
+
+
+def test_collect_merges_process_snapshots(registry, tmpdir):
+    counter = Counter('test_total', 'A counter.', registry=registry)
+    counter.inc()
+
+    other = Registry()
+    Counter('test_total', 'A counter.', registry=other).inc(4)
+    write_snapshot(tmpdir, 'metrics-1-a.json', other)
+
+    merged = registry.collect(str(tmpdir))
+    assert merged['test_total']['samples'] == [[[], 5]]
+    assert os.path.exists(
+        os.path.join(str(tmpdir), registry.snapshot_filename())
+    )
+
+
+def write_snapshot(tmpdir, filename, registry, mtime=None):
+    path = os.path.join(str(tmpdir), filename)
+    with open(path, 'w') as f:
+        json.dump(registry.snapshot(), f)
+
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+
+
+def test_collect_folds_snapshots_of_exited_processes(registry, tmpdir):
+    Counter('test_total', 'A counter.', registry=registry)
+    Gauge('test_gauge', 'A gauge.', registry=registry).set(1)
+
+    exited = subprocess.Popen([sys.executable, '-c', ''])
+    exited.wait()
+    old = Registry()
+    Counter('test_total', 'A counter.', registry=old).inc(2)
+    Gauge('test_gauge', 'A gauge.', registry=old).set(5)
+    write_snapshot(tmpdir, 'metrics-{}-a.json'.format(exited.pid), old)
+
+    # An older snapshot of a reused pid belongs to an exited process.
+    reused = Registry()
+    Counter('test_total', 'A counter.', registry=reused).inc(3)
+    Gauge('test_gauge', 'A gauge.', registry=reused).set(7)
+    write_snapshot(tmpdir, 'metrics-1-b.json', reused, mtime=1)
+    write_snapshot(tmpdir, 'metrics-1-c.json', Registry())
+
+    for _ in range(2):
+        merged = registry.collect(str(tmpdir))
+        assert merged['test_total']['samples'] == [[[], 5]]
+        assert merged['test_gauge']['samples'] == [[[], 1]]
+
+    assert sorted(os.listdir(str(tmpdir))) == sorted(
+        [
+            DEAD_SNAPSHOT_FILENAME, 'metrics-1-c.json', 'metrics.lock',
+            registry.snapshot_filename()
+        ]
+    )
+
+
+def test_cache_get_many_counts_misses(app):
+    def misses():
+        samples = CACHE_REQUESTS.snapshot()['samples']
+        return dict((tuple(k), v) for k, v in samples).get(('miss', ), 0)
+
+    before = misses()
+    with app.app_context():
+        assert cache.get_many('missing-a', 'missing-b') == [None, None]
+
+    assert misses() == before + 2
+
+
+def test_metrics_endpoint(client):
+    assert client.get('/__lbheartbeat__').status_code == 200
+
+    response = client.get('/__metrics__')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    assert 'lando_request_duration_seconds_count' in response.data.decode()
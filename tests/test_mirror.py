@@ -0,0 +1,136 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+from datetime import timedelta
+
+import pytest
+
+from landoapi.landings import (
+    lazy_get_latest_diff,
+    lazy_get_revision,
+    lazy_identity_search,
+)
+from landoapi.mirror import allow_mirror_reads, MIRROR_STATE_ID, sync_mirror
+from landoapi.models.phabricator_mirror import MirroredObject, MirrorState
+
+
+def mirrored_phids():
+    return {o.phid for o in MirroredObject.query.all()}
+
+
+def test_first_sync_starts_at_newest_story(
+    app, db, phabdouble, get_phab_client
+):
+    revision = phabdouble.revision(repo=phabdouble.repo())
+    story = phabdouble.feed_story(revision)
+
+    with app.app_context():
+        assert sync_mirror(get_phab_client()) == 0
+
+        state = MirrorState.query.get(MIRROR_STATE_ID)
+        assert state.feed_cursor == story['chronologicalKey']
+        assert state.synced_at is not None
+        assert mirrored_phids() == set()
+
+
+def test_sync_mirrors_revisions_with_diffs_and_identities(
+    app, db, phabdouble, get_phab_client
+):
+    with app.app_context():
+        sync_mirror(get_phab_client())
+
+    reviewer = phabdouble.user(username='reviewer')
+    diff = phabdouble.diff()
+    revision = phabdouble.revision(diff=diff, repo=phabdouble.repo())
+    phabdouble.reviewer(revision, reviewer)
+    phabdouble.feed_story(revision)
+    other = phabdouble.revision(repo=phabdouble.repo(name='other'))
+    newest = phabdouble.feed_story(other)
+
+    with app.app_context():
+        sync_mirror(get_phab_client(), page_size=1)
+
+        assert {
+            revision['phid'],
+            diff['phid'],
+            revision['authorPHID'],
+            reviewer['phid'],
+            other['phid'],
+        } <= mirrored_phids()
+        state = MirrorState.query.get(MIRROR_STATE_ID)
+        assert state.feed_cursor == newest['chronologicalKey']
+        mirrored = MirroredObject.query.get(revision['phid'])
+        assert mirrored.object_type == 'DREV'
+        assert mirrored.object_id == revision['id']
+
+
+@pytest.fixture
+def mirrored_revision(app, db, config, phabdouble, get_phab_client):
+    config['PHABRICATOR_MIRROR'] = 'y'
+    with app.app_context():
+        sync_mirror(get_phab_client())
+
+    diff = phabdouble.diff()
+    revision = phabdouble.revision(diff=diff, repo=phabdouble.repo())
+    phabdouble.feed_story(revision)
+    with app.app_context():
+        sync_mirror(get_phab_client())
+
+    return revision, diff
+
+
+@allow_mirror_reads
+def load_revision(phab, revision_id):
+    revision = lazy_get_revision(phab, revision_id)()
+    latest_diff = lazy_get_latest_diff(phab, revision)()
+    users, _ = lazy_identity_search(phab, [revision['authorPHID']])()
+    return revision, latest_diff, users
+
+
+def test_loaders_read_fresh_mirror(
+    app, db, mirrored_revision, get_phab_client, conduit_calls
+):
+    revision, diff = mirrored_revision
+    del conduit_calls[:]
+    with app.app_context():
+        revision_data, latest_diff, users = load_revision(
+            get_phab_client(), revision['id']
+        )
+
+    assert conduit_calls == []
+    assert revision_data['phid'] == revision['phid']
+    assert latest_diff['id'] == diff['id']
+    assert list(users) == [revision['authorPHID']]
+
+    # A stale mirror is not used.
+    with app.app_context():
+        state = MirrorState.query.get(MIRROR_STATE_ID)
+        state.synced_at -= timedelta(hours=1)
+        db.session.commit()
+
+    with app.app_context():
+        load_revision(get_phab_client(), revision['id'])
+
+    assert 'differential.revision.search' in conduit_calls
+
+
+def test_loaders_only_read_mirror_when_allowed(
+    app, db, mirrored_revision, get_phab_client, conduit_calls
+):
+    revision, _ = mirrored_revision
+    del conduit_calls[:]
+    with app.app_context():
+        lazy_get_revision(get_phab_client(), revision['id'])()
+
+    assert conduit_calls == ['differential.revision.search']
+
+
+def test_get_revision_reads_mirror(
+    client, db, mirrored_revision, conduit_calls
+):
+    revision, _ = mirrored_revision
+    del conduit_calls[:]
+    response = client.get('/revisions/D{}'.format(revision['id']))
+
+    assert response.status_code == 200
+    assert 'differential.revision.search' not in conduit_calls
@@ -0,0 +1,272 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+from concurrent import futures
+
+import pytest
+
+from landoapi import patches
+from landoapi.patch_preparation import (
+    get_speculation_executor,
+    PATCH_PREPARATION_STAGES,
+    PatchSource,
+    prepare_patches,
+    speculate_patches,
+)
+
+BUCKET = 'landoapi.test.bucket'
+
+
+def patch_source(phab, revision, diff):
+    revision_data = phab.single(
+        phab.call_conduit(
+            'differential.revision.search',
+            constraints={'ids': [revision['id']]}
+        ), 'data'
+    )
+    return PatchSource(
+        revision['id'],
+        diff['id'],
+        lambda: revision_data,
+        lambda: ('Test User', 'test@example.com'),
+        lambda: {},
+        lambda: ({}, {}),
+    )
+
+
+def uploaded_names(s3):
+    return sorted(o.key for o in s3.Bucket(BUCKET).objects.all())
+
+
+@pytest.mark.parametrize('max_workers', [0, 4])
+def test_prepare_patches_in_order(
+    app, phabdouble, s3, get_phab_client, max_workers
+):
+    repo = phabdouble.repo()
+    revisions = [
+        (phabdouble.revision(diff=diff, repo=repo), diff)
+        for diff in (phabdouble.diff() for _ in range(3))
+    ]
+
+    with app.app_context():
+        phab = get_phab_client()
+        prepared = prepare_patches(
+            phab, [patch_source(phab, r, d) for r, d in revisions],
+            BUCKET,
+            aws_access_key=None,
+            aws_secret_key=None,
+            max_workers=max_workers
+        )
+
+    assert [(p.revision_id, p.diff_id)
+            for p in prepared] == [(r['id'], d['id']) for r, d in revisions]
+    assert [p.url for p in prepared] == [
+        patches.url(BUCKET, patches.name(r['id'], d['id']))
+        for r, d in revisions
+    ]
+    for p in prepared:
+        assert set(p.timings) == set(PATCH_PREPARATION_STAGES)
+        body = s3.Object(BUCKET, patches.name(p.revision_id, p.diff_id))
+        assert patches.content_hash(body.get()['Body'].read()) == p.hash
+
+
+@pytest.mark.parametrize('max_workers', [0, 4])
+def test_failed_preparation_deletes_new_uploads(
+    app, phabdouble, s3, get_phab_client, max_workers
+):
+    repo = phabdouble.repo()
+    revisions = [
+        (phabdouble.revision(diff=diff, repo=repo), diff)
+        for diff in (phabdouble.diff() for _ in range(3))
+    ]
+
+    with app.app_context():
+        phab = get_phab_client()
+        sources = [patch_source(phab, r, d) for r, d in revisions]
+
+        # A patch uploaded by an earlier attempt is left in place.
+        prepare_patches(
+            phab,
+            sources[:1],
+            BUCKET,
+            aws_access_key=None,
+            aws_secret_key=None
+        )
+
+        def fail():
+            raise ValueError('no author')
+
+        sources[2] = sources[2]._replace(get_diff_author=fail)
+        with pytest.raises(ValueError):
+            prepare_patches(
+                phab,
+                sources,
+                BUCKET,
+                aws_access_key=None,
+                aws_secret_key=None,
+                max_workers=max_workers
+            )
+
+    assert uploaded_names(s3) == [
+        patches.name(revisions[0][0]['id'], revisions[0][1]['id'])
+    ]
+
+
+def test_landing_reuses_speculative_patch(
+    app, config, phabdouble, conduit_calls, s3, get_phab_client, redis_cache
+):
+    config['SPECULATIVE_PATCH_PREPARATION'] = 'y'
+    diff = phabdouble.diff()
+    revision = phabdouble.revision(diff=diff, repo=phabdouble.repo())
+
+    with app.app_context():
+        phab = get_phab_client()
+        source = patch_source(phab, revision, diff)
+        futures.wait(
+            speculate_patches(
+                phab, [source],
+                BUCKET,
+                aws_access_key=None,
+                aws_secret_key=None,
+                max_workers=2
+            )
+        )
+        assert conduit_calls.count('differential.getrawdiff') == 1
+
+        prepared, = prepare_patches(
+            phab, [source], BUCKET, aws_access_key=None, aws_secret_key=None
+        )
+        assert conduit_calls.count('differential.getrawdiff') == 1
+        assert prepared.url == patches.url(
+            BUCKET, patches.name(revision['id'], diff['id'], prepared.hash)
+        )
+
+        # A changed commit message is built again.
+        changed = source._replace(get_diff_author=lambda: ('Other', 'o@x.y'))
+        prepare_patches(
+            phab, [changed], BUCKET, aws_access_key=None, aws_secret_key=None
+        )
+        assert conduit_calls.count('differential.getrawdiff') == 2
+
+
+def speculate(phab, sources):
+    futures.wait(
+        speculate_patches(
+            phab,
+            sources,
+            BUCKET,
+            aws_access_key=None,
+            aws_secret_key=None,
+            max_workers=2
+        )
+    )
+
+
+def test_speculation_skips_recorded_patches(
+    app, config, phabdouble, conduit_calls, s3, get_phab_client, redis_cache
+):
+    config['SPECULATIVE_PATCH_PREPARATION'] = 'y'
+    diff = phabdouble.diff()
+    revision = phabdouble.revision(diff=diff, repo=phabdouble.repo())
+
+    with app.app_context():
+        phab = get_phab_client()
+        source = patch_source(phab, revision, diff)
+        speculate(phab, [source])
+        speculate(phab, [source])
+
+    assert conduit_calls.count('differential.getrawdiff') == 1
+
+
+def test_speculation_dropped_while_pool_is_busy(
+    app, config, phabdouble, s3, get_phab_client
+):
+    config['SPECULATIVE_PATCH_PREPARATION'] = 'y'
+    diff = phabdouble.diff()
+    revision = phabdouble.revision(diff=diff, repo=phabdouble.repo())
+
+    _, slots = get_speculation_executor(2)
+    taken = 0
+    while slots.acquire(blocking=False):
+        taken += 1
+
+    try:
+        with app.app_context():
+            phab = get_phab_client()
+            assert speculate_patches(
+                phab, [patch_source(phab, revision, diff)],
+                BUCKET,
+                aws_access_key=None,
+                aws_secret_key=None,
+                max_workers=2
+            ) == []
+    finally:
+        for _ in range(taken):
+            slots.release()
+
+    assert uploaded_names(s3) == []
+
+
+def test_deleted_speculative_patch_is_uploaded_again(
+    app, config, phabdouble, conduit_calls, s3, get_phab_client, redis_cache
+):
+    config['SPECULATIVE_PATCH_PREPARATION'] = 'y'
+    diff = phabdouble.diff()
+    revision = phabdouble.revision(diff=diff, repo=phabdouble.repo())
+    patch_name = patches.name(revision['id'], diff['id'])
+
+    with app.app_context():
+        phab = get_phab_client()
+        source = patch_source(phab, revision, diff)
+        speculate(phab, [source])
+        speculative_name, = uploaded_names(s3)
+        s3.Object(BUCKET, speculative_name).delete()
+
+        prepared, = prepare_patches(
+            phab, [source], BUCKET, aws_access_key=None, aws_secret_key=None
+        )
+
+    assert conduit_calls.count('differential.getrawdiff') == 2
+    assert prepared.url == patches.url(BUCKET, patch_name)
+    assert uploaded_names(s3) == [patch_name]
+
+
+def test_stale_speculation_does_not_replace_landed_patch(
+    app, config, phabdouble, s3, get_phab_client, redis_cache
+):
+    config['SPECULATIVE_PATCH_PREPARATION'] = 'y'
+    diff = phabdouble.diff()
+    revision = phabdouble.revision(diff=diff, repo=phabdouble.repo())
+    patch_name = patches.name(revision['id'], diff['id'])
+
+    with app.app_context():
+        phab = get_phab_client()
+        source = patch_source(phab, revision, diff)
+        landed, = prepare_patches(
+            phab, [source], BUCKET, aws_access_key=None, aws_secret_key=None
+        )
+
+        stale = source._replace(get_diff_author=lambda: ('Other', 'o@x.y'))
+        speculate(phab, [stale])
+
+    assert len(uploaded_names(s3)) == 2
+    landed_object = s3.Object(BUCKET, patch_name)
+    assert landed_object.metadata == {'sha256': landed.hash}
+    assert patches.content_hash(landed_object.get()['Body'].read()) == (
+        landed.hash
+    )
+
+
+def test_speculation_is_opt_in(app, phabdouble, s3, get_phab_client):
+    diff = phabdouble.diff()
+    revision = phabdouble.revision(diff=diff, repo=phabdouble.repo())
+
+    with app.app_context():
+        phab = get_phab_client()
+        assert speculate_patches(
+            phab, [patch_source(phab, revision, diff)],
+            BUCKET,
+            aws_access_key=None,
+            aws_secret_key=None,
+            max_workers=2
+        ) == []
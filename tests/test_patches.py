@@ -1,7 +1,9 @@
 # This Source Code Form is subject to the terms of the Mozilla Public
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
+import functools
 
+import boto3
 import pytest
 
 from landoapi import patches
@@ -51,3 +53,110 @@ def test_upload(s3, contents):
 
     assert patch == contents
     assert url == patches.url('landoapi.test.bucket', patches.name(1, 1))
+
+
+def test_upload_chunks(s3):
+    chunks = (b'# HG changeset patch\n', memoryview('🏄🦈\n'.encode('utf-8')))
+    patches.upload(
+        1,
+        1,
+        chunks,
+        'landoapi.test.bucket',
+        aws_access_key=None,
+        aws_secret_key=None
+    )
+    patch = s3.Object('landoapi.test.bucket', patches.name(1, 1))
+
+    assert patch.get()['Body'].read() == b''.join(chunks)
+
+
+def test_upload_records_content_hash(s3):
+    patches.upload(
+        1,
+        1,
+        SIMPLE_PATCH,
+        'landoapi.test.bucket',
+        aws_access_key=None,
+        aws_secret_key=None
+    )
+    patch = s3.Object('landoapi.test.bucket', patches.name(1, 1))
+
+    assert patch.metadata == {'sha256': patches.content_hash(SIMPLE_PATCH)}
+
+
+def test_content_hash_of_chunks_matches_string():
+    chunks = [chunk.encode('utf-8') for chunk in SIMPLE_PATCH.splitlines(True)]
+    assert patches.content_hash(chunks) == patches.content_hash(SIMPLE_PATCH)
+    encoded = SIMPLE_PATCH.encode('utf-8')
+    assert patches.content_hash(encoded) == patches.content_hash(SIMPLE_PATCH)
+    assert patches.content_hash(memoryview(encoded)) == (
+        patches.content_hash(SIMPLE_PATCH)
+    )
+
+
+def test_upload_skips_identical_existing_patch(s3, monkeypatch):
+    upload = functools.partial(
+        patches.upload,
+        1,
+        1,
+        s3_bucket='landoapi.test.bucket',
+        aws_access_key=None,
+        aws_secret_key=None
+    )
+    upload(SIMPLE_PATCH)
+
+    uploads = []
+    real_resource = boto3.session.Session.resource
+
+    def resource(self, *args, **kwargs):
+        r = real_resource(self, *args, **kwargs)
+        real_upload = r.meta.client.upload_fileobj
+
+        def upload_fileobj(*args, **kwargs):
+            uploads.append(args)
+            return real_upload(*args, **kwargs)
+
+        monkeypatch.setattr(r.meta.client, 'upload_fileobj', upload_fileobj)
+        return r
+
+    monkeypatch.setattr(boto3.session.Session, 'resource', resource)
+
+    url = upload(SIMPLE_PATCH)
+    assert url == patches.url('landoapi.test.bucket', patches.name(1, 1))
+    assert not uploads
+
+    upload(UNICODE_CHARACTERS)
+    assert len(uploads) == 1
+    patch = s3.Object('landoapi.test.bucket', patches.name(1, 1))
+    assert patch.get()['Body'].read().decode('utf-8') == UNICODE_CHARACTERS
+
+
+def test_on_uploaded_only_called_for_transfers(s3):
+    uploaded = []
+    upload = functools.partial(
+        patches.upload,
+        1,
+        1,
+        s3_bucket='landoapi.test.bucket',
+        aws_access_key=None,
+        aws_secret_key=None,
+        on_uploaded=uploaded.append
+    )
+    url = upload(SIMPLE_PATCH)
+    upload(SIMPLE_PATCH)
+
+    assert uploaded == [url]
+
+
+def test_delete(s3):
+    url = patches.upload(
+        1,
+        1,
+        SIMPLE_PATCH,
+        'landoapi.test.bucket',
+        aws_access_key=None,
+        aws_secret_key=None
+    )
+    patches.delete(url, aws_access_key=None, aws_secret_key=None)
+
+    assert not list(s3.Bucket('landoapi.test.bucket').objects.all())
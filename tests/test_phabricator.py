@@ -1,13 +1,16 @@
 # This Source Code Form is subject to the terms of the Mozilla Public
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
+import json
 
 import pytest
 
 from landoapi.phabricator import (
     collate_reviewer_attachments,
     PhabricatorCommunicationException,
+    phid_type,
     result_list_to_phid_dict,
+    RevisionQueryProfile,
     RevisionStatus,
 )
 
@@ -150,3 +153,70 @@ def test_result_list_to_phid_dict_duplicate_phids_raises():
                 },
             ]
         )
+
+
+@pytest.mark.parametrize(
+    'phid, expected', [
+        ('PHID-USER-abc', 'USER'),
+        ('PHID-PROJ-abc-def', 'PROJ'),
+        ('PHID-DREV-', 'DREV'),
+        ('PHID-USER', None),
+        ('PHID--abc', None),
+        ('USER-abc-def', None),
+        ('', None),
+        (None, None),
+    ]
+)
+def test_phid_type(phid, expected):
+    assert phid_type(phid) == expected
+
+
+def test_resolve_phids_one_call_per_type(
+    get_phab_client, phabdouble, conduit_calls
+):
+    users = [phabdouble.user(username='user{}'.format(i)) for i in range(3)]
+    projects = [phabdouble.project('project{}'.format(i)) for i in range(2)]
+    repo = phabdouble.repo()
+
+    phids = [i['phid'] for i in users + projects + [repo]]
+    resolved = get_phab_client().resolve_phids(phids + ['PHID-USER-missing'])
+
+    assert set(resolved) == set(phids)
+    assert resolved[users[0]['phid']]['fields']['username'] == 'user0'
+    assert sorted(conduit_calls) == [
+        'diffusion.repository.search', 'project.search', 'user.search'
+    ]
+
+
+def test_resolve_phids_falls_back_to_phid_query(get_phab_client, phabdouble):
+    revision = phabdouble.revision(repo=phabdouble.repo())
+    phab = get_phab_client()
+
+    assert phab.resolve_phids([]) == {}
+    assert phab.resolve_phids(['PHID-XYZZ-unknown']) == {}
+    assert revision['phid'] in phab.resolve_phids([revision['phid']])
+
+
+@pytest.mark.parametrize('profile', list(RevisionQueryProfile))
+def test_get_revision_missing_returns_none(
+    get_phab_client, phabdouble, profile
+):
+    assert get_phab_client().get_revision(1, profile=profile) is None
+
+
+def test_get_revision_profiles_trim_payload(get_phab_client, phabdouble):
+    revision = phabdouble.revision(repo=phabdouble.repo())
+    for i in range(5):
+        user = phabdouble.user(username='reviewer{}'.format(i))
+        phabdouble.reviewer(revision, user)
+
+    phab = get_phab_client()
+    permission, full = [
+        phab.get_revision(revision['id'], profile=profile)
+        for profile in
+        (RevisionQueryProfile.PERMISSION, RevisionQueryProfile.FULL)
+    ]
+
+    assert permission['phid'] == full['phid']
+    assert len(full['attachments']['reviewers']['reviewers']) == 5
+    assert len(json.dumps(permission)) < len(json.dumps(full))
@@ -4,12 +4,29 @@
 """
 Tests for the PhabricatorClient
 """
+import gzip
+import json
+import os
+import threading
+import time
+import urllib.parse
+from concurrent import futures
 
 import pytest
 import requests
 import requests_mock
 
-from landoapi.phabricator import PhabricatorAPIException
+from landoapi.phabricator import (
+    PhabricatorAPIException,
+    PhabricatorClient,
+    PhabricatorCommunicationException,
+)
+from landoapi.resilience import (
+    Bulkhead,
+    LatencyTracker,
+    PHABRICATOR,
+    RetryBudget,
+)
 
 from tests.utils import phab_url
 
@@ -19,7 +36,7 @@ pytestmark = pytest.mark.usefixtures('docker_env_vars')
 def test_ping_success(get_phab_client):
     phab = get_phab_client(api_key='api-key')
     with requests_mock.mock() as m:
-        m.get(
+        m.post(
             phab_url('conduit.ping'),
             status_code=200,
             json={
@@ -37,7 +54,7 @@ def test_raise_exception_if_ping_encounters_connection_error(get_phab_client):
     with requests_mock.mock() as m:
         # Test with the generic ConnectionError, which is a superclass for
         # other connection error types.
-        m.get(phab_url('conduit.ping'), exc=requests.ConnectionError)
+        m.post(phab_url('conduit.ping'), exc=requests.ConnectionError)
 
         with pytest.raises(PhabricatorAPIException):
             phab.call_conduit('conduit.ping')
@@ -49,7 +66,7 @@ def test_raise_exception_if_api_ping_times_out(get_phab_client):
     with requests_mock.mock() as m:
         # Test with the generic Timeout exception, which all other timeout
         # exceptions derive from.
-        m.get(phab_url('conduit.ping'), exc=requests.Timeout)
+        m.post(phab_url('conduit.ping'), exc=requests.Timeout)
 
         with pytest.raises(PhabricatorAPIException):
             phab.call_conduit('conduit.ping')
@@ -67,7 +84,7 @@ def test_raise_exception_if_api_returns_error_json_response(get_phab_client):
     with requests_mock.mock() as m:
         # Test with the generic Timeout exception, which all other timeout
         # exceptions derive from.
-        m.get(phab_url('conduit.ping'), status_code=500, json=error_json)
+        m.post(phab_url('conduit.ping'), status_code=500, json=error_json)
 
         with pytest.raises(PhabricatorAPIException):
             phab.call_conduit('conduit.ping')
@@ -86,8 +103,367 @@ def test_phabricator_exception(get_phab_client):
     }
 
     with requests_mock.mock() as m:
-        m.get(phab_url('differential.query'), status_code=200, json=error)
+        m.post(phab_url('differential.query'), status_code=200, json=error)
         with pytest.raises(PhabricatorAPIException) as e_info:
             phab.call_conduit('differential.query', ids=["1"])[0]
         assert e_info.value.error_code == error['error_code']
         assert e_info.value.error_info == error['error_info']
+
+
+def test_memoized_calls_are_only_sent_once():
+    phab = PhabricatorClient(
+        os.getenv('PHABRICATOR_URL'), 'api-key', memoize=True
+    )
+    with requests_mock.mock() as m:
+        m.post(
+            phab_url('user.search'),
+            status_code=200,
+            json={
+                "result": {
+                    "data": []
+                },
+                "error_code": None,
+                "error_info": None,
+            }
+        )
+        first = phab.call_conduit('user.search', constraints={'phids': ['A']})
+        second = phab.call_conduit('user.search', constraints={'phids': ['A']})
+        assert first == second
+        assert m.call_count == 1
+
+        phab.call_conduit('user.search', constraints={'phids': ['B']})
+        assert m.call_count == 2
+
+    assert phab.stats['calls'] == 2
+    assert phab.stats['memoized_calls'] == 1
+
+
+def test_non_idempotent_calls_are_not_memoized():
+    phab = PhabricatorClient(
+        os.getenv('PHABRICATOR_URL'), 'api-key', memoize=True
+    )
+    with requests_mock.mock() as m:
+        m.post(
+            phab_url('conduit.ping'),
+            status_code=200,
+            json={
+                "result": [],
+                "error_code": None,
+                "error_info": None,
+            }
+        )
+        phab.call_conduit('conduit.ping')
+        phab.call_conduit('conduit.ping')
+        assert m.call_count == 2
+
+
+def test_calls_not_memoized_by_default(get_phab_client):
+    phab = get_phab_client(api_key='api-key')
+    with requests_mock.mock() as m:
+        m.post(
+            phab_url('user.search'),
+            status_code=200,
+            json={
+                "result": {
+                    "data": []
+                },
+                "error_code": None,
+                "error_info": None,
+            }
+        )
+        phab.call_conduit('user.search', constraints={'phids': ['A']})
+        phab.call_conduit('user.search', constraints={'phids': ['A']})
+        assert m.call_count == 2
+
+
+def test_response_decoded_without_charset_detection(
+    get_phab_client, monkeypatch
+):
+    def fail(*args, **kwargs):
+        raise AssertionError('charset detection should not be used')
+
+    monkeypatch.setattr(requests.Response, 'apparent_encoding', property(fail))
+    phab = get_phab_client(api_key='api-key')
+    body = '{"result": "diff --git a/\\u00e9", "error_code": null}'
+    with requests_mock.mock() as m:
+        m.post(
+            phab_url('differential.getrawdiff'),
+            status_code=200,
+            content=body.encode('utf-8')
+        )
+        result = phab.call_conduit('differential.getrawdiff', diffID=1)
+
+    assert result == 'diff --git a/é'
+
+
+@pytest.mark.parametrize('content', [b'not json', b'{"result": "\xff"}'])
+def test_undecodable_response_raises(get_phab_client, content):
+    phab = get_phab_client(api_key='api-key')
+    with requests_mock.mock() as m:
+        m.post(phab_url('conduit.ping'), status_code=200, content=content)
+        with pytest.raises(PhabricatorCommunicationException):
+            phab.call_conduit('conduit.ping')
+
+
+def test_custom_decoder_is_used():
+    decoded = []
+
+    def decoder(content):
+        decoded.append(content)
+        return {'result': 'decoded', 'error_code': None}
+
+    phab = PhabricatorClient(
+        os.getenv('PHABRICATOR_URL'), 'api-key', decoder=decoder
+    )
+    with requests_mock.mock() as m:
+        m.post(phab_url('conduit.ping'), status_code=200, content=b'raw')
+        assert phab.call_conduit('conduit.ping') == 'decoded'
+
+    assert decoded == [b'raw']
+
+
+def test_calls_are_form_encoded_posts(get_phab_client):
+    phab = get_phab_client(api_key='api-key')
+    with requests_mock.mock() as m:
+        m.post(
+            phab_url('conduit.ping'),
+            status_code=200,
+            json={
+                "result": [],
+                "error_code": None,
+                "error_info": None,
+            }
+        )
+        phab.call_conduit('conduit.ping')
+
+        request = m.request_history[0]
+        assert request.headers['Accept-Encoding'] == 'gzip'
+        assert 'Content-Encoding' not in request.headers
+        assert urllib.parse.parse_qs(request.text)['output'] == ['json']
+
+    stats = phab.transfer_stats['conduit.ping']
+    assert stats['calls'] == 1
+    assert stats['request_bytes'] == len(request.body)
+    assert stats['response_bytes'] > 0
+
+
+def test_response_bytes_are_counted_before_decoding(get_phab_client):
+    phab = get_phab_client(api_key='api-key')
+    payload = json.dumps(
+        {
+            "result": ['x' * 1000],
+            "error_code": None,
+            "error_info": None,
+        }
+    ).encode()
+    compressed = gzip.compress(payload)
+    with requests_mock.mock() as m:
+        m.post(
+            phab_url('conduit.ping'),
+            status_code=200,
+            content=compressed,
+            headers={'Content-Encoding': 'gzip'}
+        )
+        assert phab.call_conduit('conduit.ping') == ['x' * 1000]
+
+    stats = phab.transfer_stats['conduit.ping']
+    assert stats['response_bytes'] == len(compressed)
+
+
+def test_each_thread_has_its_own_session():
+    phab = PhabricatorClient('http://phabricator.test/', 'api-key')
+    sessions = []
+    thread = threading.Thread(target=lambda: sessions.append(phab.session))
+    thread.start()
+    thread.join()
+
+    assert phab.session is phab.session
+    assert sessions[0] is not phab.session
+
+
+def test_client_shared_between_threads():
+    phab = PhabricatorClient(
+        'http://phabricator.test/', 'api-key', memoize=True
+    )
+    with requests_mock.mock() as m:
+        m.post(
+            phab_url('user.search'),
+            json={
+                'result': {
+                    'data': []
+                },
+                'error_code': None,
+                'error_info': None,
+            }
+        )
+
+        def search(i):
+            return phab.call_conduit('user.search', constraints={'ids': [i]})
+
+        with futures.ThreadPoolExecutor(4) as executor:
+            list(executor.map(search, [i % 10 for i in range(40)]))
+
+    calls = phab.stats['calls']
+    assert calls + phab.stats['memoized_calls'] == 40
+    assert phab.transfer_stats['user.search']['calls'] == calls
+
+
+def test_large_request_bodies_are_compressed():
+    phab = PhabricatorClient(
+        os.getenv('PHABRICATOR_URL'), 'api-key', compress_min_bytes=500
+    )
+    with requests_mock.mock() as m:
+        m.post(
+            phab_url('user.search'),
+            status_code=200,
+            json={
+                "result": {
+                    "data": []
+                },
+                "error_code": None,
+                "error_info": None,
+            }
+        )
+        phab.call_conduit('user.search', constraints={'phids': ['A']})
+        assert 'Content-Encoding' not in m.request_history[0].headers
+
+        phids = ['PHID-USER-{}'.format(i) for i in range(100)]
+        phab.call_conduit('user.search', constraints={'phids': phids})
+        request = m.request_history[1]
+        assert request.headers['Content-Encoding'] == 'gzip'
+
+        params = urllib.parse.parse_qs(gzip.decompress(request.body).decode())
+        assert json.loads(params['params'][0])['constraints']['phids'] == (
+            phids
+        )
+
+
+@pytest.mark.parametrize(
+    'error_code, forgotten', [
+        ('ERR-INVALID-AUTH', ['api-key']),
+        ('ERR-CONDUIT-CORE', []),
+    ]
+)
+def test_on_auth_error_called_for_rejected_token(error_code, forgotten):
+    called = []
+    phab = PhabricatorClient(
+        'http://phabricator.test/', 'api-key', on_auth_error=called.append
+    )
+    with requests_mock.mock() as m:
+        m.post(
+            phab_url('user.whoami'),
+            json={
+                'result': None,
+                'error_code': error_code,
+                'error_info': 'Error',
+            }
+        )
+        with pytest.raises(PhabricatorAPIException):
+            phab.call_conduit('user.whoami')
+
+    assert called == forgotten
+
+
+def test_idempotent_call_retried_after_connection_error(monkeypatch):
+    monkeypatch.setattr('landoapi.phabricator.RETRY_BACKOFF', 0)
+    phab = PhabricatorClient(
+        'http://phabricator.test/', 'api-key', max_retries=1
+    )
+    with requests_mock.mock() as m:
+        m.post(
+            phab_url('user.whoami'), [
+                {'exc': requests.ConnectionError},
+                {'json': {'result': {'phid': 'PHID-USER-1'},
+                          'error_code': None,
+                          'error_info': None}},
+            ]
+        )  # yapf: disable
+        assert phab.call_conduit('user.whoami') == {'phid': 'PHID-USER-1'}
+        assert m.call_count == 2
+
+        m.post(
+            phab_url('differential.revision.edit'),
+            exc=requests.ConnectionError
+        )
+        with pytest.raises(PhabricatorCommunicationException):
+            phab.call_conduit('differential.revision.edit')
+        assert m.call_count == 3
+
+    assert phab.stats['retried_calls'] == 1
+
+
+def test_retries_limited_by_budget(monkeypatch):
+    monkeypatch.setattr('landoapi.phabricator.RETRY_BACKOFF', 0)
+    monkeypatch.setattr(PHABRICATOR, 'retry_budget', RetryBudget(max_tokens=1))
+    phab = PhabricatorClient(
+        'http://phabricator.test/', 'api-key', max_retries=5
+    )
+    with requests_mock.mock() as m:
+        m.post(phab_url('user.whoami'), exc=requests.ConnectionError)
+        with pytest.raises(PhabricatorCommunicationException):
+            phab.call_conduit('user.whoami')
+
+        assert m.call_count == 2
+
+
+class SlowFirstSession:
+    """A session whose first post is slow and later ones are fast.
+
+    Each response's result is the number of the post it answers. The
+    slow first post raises a ConnectionError if `first_fails` is True.
+    """
+
+    def __init__(self, *, first_fails=False):
+        self.first_fails = first_fails
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def post(self, url, **kwargs):
+        with self._lock:
+            self.calls += 1
+            call = self.calls
+
+        if call == 1:
+            time.sleep(0.5)
+            if self.first_fails:
+                raise requests.ConnectionError()
+
+        response = requests.Response()
+        response.status_code = 200
+        response._content = json.dumps(
+            {
+                'result': call,
+                'error_code': None,
+                'error_info': None,
+            }
+        ).encode('utf-8')
+        return response
+
+
+@pytest.fixture
+def fast_latency(monkeypatch):
+    latency = LatencyTracker(min_samples=1)
+    latency.record('user.whoami', 0.01)
+    monkeypatch.setattr('landoapi.phabricator.CONDUIT_LATENCY', latency)
+
+
+@pytest.mark.parametrize('first_fails', [False, True])
+def test_slow_read_is_hedged(fast_latency, first_fails):
+    session = SlowFirstSession(first_fails=first_fails)
+    phab = PhabricatorClient(
+        'http://phabricator.test/', 'api-key', session=session, hedge=True
+    )
+    assert phab.call_conduit('user.whoami') == 2
+    assert phab.stats['hedged_calls'] == 1
+    assert session.calls == 2
+
+
+def test_hedge_uses_the_bulkhead_slot_of_the_call(fast_latency, monkeypatch):
+    monkeypatch.setattr(PHABRICATOR, 'bulkhead', Bulkhead(1, wait=0))
+    session = SlowFirstSession()
+    phab = PhabricatorClient(
+        'http://phabricator.test/', 'api-key', session=session, hedge=True
+    )
+    assert phab.call_conduit('user.whoami') == 2
+    assert phab.stats['hedged_calls'] == 1
+    assert session.calls == 2
@@ -0,0 +1,70 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+import pytest
+
+from landoapi.phabricator import PhabricatorCommunicationException
+from landoapi.repos import Repo, RepositoryIndex, SCM_LEVEL_3
+
+
+@pytest.fixture
+def index(clock):
+    return RepositoryIndex(refresh_interval=600, negative_ttl=60, clock=clock)
+
+
+def test_index_resolves_configured_repos_without_lookups(
+    app, phabdouble, conduit_calls, get_phab_client, index
+):
+    repo = phabdouble.repo(name='mozilla-central')
+    with app.app_context():
+        phab = get_phab_client()
+        for _ in range(3):
+            assert index.get(phab, 'test', repo['phid']) == Repo(
+                'mozilla-central', SCM_LEVEL_3, ''
+            )
+
+    assert conduit_calls == ['diffusion.repository.search']
+
+
+def test_index_refreshes_after_interval(
+    app, phabdouble, conduit_calls, get_phab_client, index
+):
+    repo = phabdouble.repo(name='mozilla-central')
+    with app.app_context():
+        phab = get_phab_client()
+        index.get(phab, 'test', repo['phid'])
+        index._clock.now += 600
+        index.get(phab, 'test', repo['phid'])
+
+    assert len(conduit_calls) == 2
+
+
+def test_index_negative_caches_unconfigured_repos(
+    app, phabdouble, conduit_calls, get_phab_client, index
+):
+    phabdouble.repo(name='mozilla-central')
+    other = phabdouble.repo(name='not-landable')
+    with app.app_context():
+        phab = get_phab_client()
+        assert index.get(phab, 'test', other['phid']) is None
+        assert index.get(phab, 'test', other['phid']) is None
+        assert len(conduit_calls) == 2
+
+        index._clock.now += 60
+        assert index.get(phab, 'test', other['phid']) is None
+        assert len(conduit_calls) == 3
+
+
+def test_index_falls_back_to_conduit_for_new_repos(
+    app, phabdouble, conduit_calls, get_phab_client, index
+):
+    with app.app_context():
+        phab = get_phab_client()
+        with pytest.raises(PhabricatorCommunicationException):
+            index.get(phab, 'test', 'PHID-REPO-missing')
+
+        repo = phabdouble.repo(name='mozilla-central')
+        assert index.get(phab, 'test', repo['phid']) is not None
+        assert index.get(phab, 'test', repo['phid']) is not None
+
+    assert len(conduit_calls) == 3
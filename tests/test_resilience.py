@@ -0,0 +1,186 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+import pytest
+import requests
+import requests_mock
+
+from landoapi.resilience import (
+    Bulkhead,
+    CircuitBreaker,
+    Dependency,
+    DependencyUnavailable,
+    LatencyTracker,
+    PHABRICATOR,
+    RetryBudget,
+)
+
+from tests.utils import phab_url
+
+
+def test_breaker_opens_at_failure_threshold(clock):
+    breaker = CircuitBreaker(
+        'test', failure_threshold=0.5, min_calls=4, clock=clock
+    )
+    for success in (True, False, True):
+        assert breaker.allow()
+        breaker.record(success)
+    assert breaker.state == CircuitBreaker.CLOSED
+
+    assert breaker.allow()
+    breaker.record(False)
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+
+def test_breaker_forgets_results_outside_window(clock):
+    breaker = CircuitBreaker('test', min_calls=2, window=10, clock=clock)
+    breaker.record(False)
+    clock.now += 11
+    breaker.record(False)
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+@pytest.mark.parametrize(
+    'probe_succeeds, expected', [
+        (True, CircuitBreaker.CLOSED),
+        (False, CircuitBreaker.OPEN),
+    ]
+)
+def test_breaker_half_open_probe(clock, probe_succeeds, expected):
+    breaker = CircuitBreaker(
+        'test', min_calls=1, reset_timeout=30, clock=clock
+    )
+    breaker.record(False)
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.retry_after() == 30
+
+    clock.now += 30
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.allow()
+
+    # Only a single probe is let through at a time.
+    assert not breaker.allow()
+
+    breaker.record(probe_succeeds)
+    assert breaker.state == expected
+
+
+def test_dependency_refuses_calls_while_open(clock):
+    dependency = Dependency('test', max_concurrent=1, min_calls=1, clock=clock)
+    with pytest.raises(ValueError):
+        with dependency.guard():
+            raise ValueError()
+
+    with pytest.raises(DependencyUnavailable) as exc_info:
+        with dependency.guard():
+            pass
+
+    assert exc_info.value.status == 503
+    assert exc_info.value.reason == 'circuit open'
+
+
+def test_dependency_ignores_non_failures(clock):
+    dependency = Dependency('test', max_concurrent=1, min_calls=1, clock=clock)
+    with pytest.raises(KeyError):
+        with dependency.guard(is_failure=lambda exc: False):
+            raise KeyError()
+
+    assert dependency.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_dependency_bulkhead_limits_concurrency():
+    dependency = Dependency('test', max_concurrent=1)
+    dependency.bulkhead.wait = 0
+
+    with dependency.guard():
+        with pytest.raises(DependencyUnavailable) as exc_info:
+            with dependency.guard():
+                pass
+
+    assert exc_info.value.reason == 'bulkhead full'
+
+    # The slot is released once the first call finishes.
+    with dependency.guard():
+        pass
+
+
+def test_bulkhead_slot_shared_by_holder():
+    bulkhead = Bulkhead(1, wait=0)
+    holder = object()
+    assert bulkhead.acquire(holder)
+    assert bulkhead.acquire(holder)
+    assert not bulkhead.acquire()
+
+    bulkhead.release(holder)
+    assert not bulkhead.acquire()
+
+    bulkhead.release(holder)
+    assert bulkhead.acquire()
+
+
+def test_dependency_slot_shared_within_app_context(app):
+    dependency = Dependency('test', max_concurrent=1)
+    dependency.bulkhead.wait = 0
+
+    with app.app_context():
+        with dependency.guard():
+            # A prefetch thread shares flask.g, and with it the slot.
+            with dependency.guard():
+                pass
+
+            with app.app_context():
+                with pytest.raises(DependencyUnavailable):
+                    with dependency.guard():
+                        pass
+
+
+def test_phabricator_breaker_fails_fast(client):
+    PHABRICATOR.configure(max_concurrent=1, min_calls=2)
+    with requests_mock.mock() as m:
+        m.post(phab_url('differential.revision.search'), exc=requests.Timeout)
+
+        for _ in range(2):
+            response = client.get('/revisions/D1')
+            assert response.status_code == 500
+
+        response = client.get('/revisions/D1')
+        assert m.call_count == 2
+
+    assert response.status_code == 503
+    assert int(response.headers['Retry-After']) > 0
+
+
+def test_retry_budget_limits_retries_to_ratio_of_calls():
+    budget = RetryBudget(ratio=0.5, max_tokens=2)
+    assert budget.withdraw()
+    assert budget.withdraw()
+    assert not budget.withdraw()
+
+    budget.deposit()
+    assert not budget.withdraw()
+    budget.deposit()
+    assert budget.withdraw()
+
+    for _ in range(10):
+        budget.deposit()
+    assert budget.withdraw()
+    assert budget.withdraw()
+    assert not budget.withdraw()
+
+
+def test_latency_tracker_percentile():
+    tracker = LatencyTracker(size=100, min_samples=10)
+    for i in range(9):
+        tracker.record('method', i)
+    assert tracker.percentile('method', 95) is None
+
+    for i in range(9, 100):
+        tracker.record('method', i)
+    assert tracker.percentile('method', 95) == 95
+    assert tracker.percentile('other', 95) is None
+
+    # Only the most recent durations are kept.
+    for _ in range(100):
+        tracker.record('method', 1)
+    assert tracker.percentile('method', 95) == 1
@@ -136,3 +136,21 @@ def test_get_revision_multiple_reviewers(client, phabdouble):
                 'for_other_diff': False,
                 'blocking_landing': True,
             }
+
+
+def test_get_revision_caches_identities(
+    client, phabdouble, conduit_calls, redis_cache
+):
+    revision = phabdouble.revision(repo=phabdouble.repo())
+    phabdouble.reviewer(revision, phabdouble.user(username='reviewer'))
+    phabdouble.reviewer(revision, phabdouble.project('test-project'))
+
+    response = client.get('/revisions/D{}'.format(revision['id']))
+    assert response.status_code == 200
+
+    del conduit_calls[:]
+    cached_response = client.get('/revisions/D{}'.format(revision['id']))
+    assert cached_response.status_code == 200
+    assert cached_response.json == response.json
+    assert 'user.search' not in conduit_calls
+    assert 'project.search' not in conduit_calls
@@ -0,0 +1,127 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+from landoapi.landings import lazy_get_stack
+from landoapi.phabricator import RevisionStatus
+from landoapi.stacks import RevisionStack, search_stack_edges
+
+
+def test_stack_levels_are_searched_in_batches(
+    app, phabdouble, conduit_calls, get_phab_client
+):
+    root = phabdouble.revision()
+    children = [phabdouble.revision(depends_on=[root]) for _ in range(3)]
+    grandchild = phabdouble.revision(depends_on=children[1:])
+
+    with app.app_context():
+        edges, truncated = search_stack_edges(
+            get_phab_client(), children[0]['phid']
+        )
+
+    assert not truncated
+    assert set(edges) == {
+        (children[0]['phid'], root['phid']),
+        (children[1]['phid'], root['phid']),
+        (children[2]['phid'], root['phid']),
+        (grandchild['phid'], children[1]['phid']),
+        (grandchild['phid'], children[2]['phid']),
+    }
+
+    # One search each for the start, the root, the other children and
+    # the grandchild.
+    assert conduit_calls == ['edge.search'] * 4
+
+
+def test_stack_search_stops_at_cycles(app, phabdouble, get_phab_client):
+    first = phabdouble.revision()
+    second = phabdouble.revision(depends_on=[first])
+    phabdouble._edges.append(
+        {
+            'edgeType': 'revision.parent',
+            'sourcePHID': first['phid'],
+            'destinationPHID': second['phid'],
+        }
+    )
+
+    with app.app_context():
+        edges, truncated = search_stack_edges(
+            get_phab_client(), second['phid']
+        )
+
+    assert not truncated
+    assert set(edges) == {
+        (second['phid'], first['phid']),
+        (first['phid'], second['phid']),
+    }
+
+
+def test_stack_search_depth_limit(app, phabdouble, get_phab_client):
+    revision = phabdouble.revision()
+    for _ in range(3):
+        revision = phabdouble.revision(depends_on=[revision])
+
+    with app.app_context():
+        edges, truncated = search_stack_edges(
+            get_phab_client(), revision['phid'], max_depth=2
+        )
+
+    assert truncated
+    assert len(edges) == 2
+
+
+def test_revision_stack_graph():
+    stack = RevisionStack(
+        [('c', 'b'), ('b', 'a'), ('c', 'x')], {
+            'a': {
+                'fields': {
+                    'status': {
+                        'closed': False
+                    }
+                }
+            },
+            'b': {
+                'fields': {
+                    'status': {
+                        'closed': True
+                    }
+                }
+            },
+            'x': {
+                'fields': {
+                    'status': {
+                        'closed': False
+                    }
+                }
+            },
+        }
+    )
+
+    assert stack.ancestors('c') == ['b', 'x', 'a']
+    assert stack.children('b') == ['c']
+    assert stack.open_parents('c') == [stack.revisions['x']]
+    assert not stack.is_open('c')
+
+
+def test_lazy_get_stack_caches_edges(
+    app, phabdouble, redis_cache, conduit_calls, get_phab_client
+):
+    parent = phabdouble.revision(status=RevisionStatus.PUBLISHED)
+    revision = phabdouble.revision(depends_on=[parent])
+    child = phabdouble.revision(depends_on=[revision])
+
+    with app.app_context():
+        phab = get_phab_client()
+        data = phab.single(
+            phab.call_conduit(
+                'differential.revision.search',
+                constraints={'ids': [revision['id']]}
+            ), 'data'
+        )
+        stack = lazy_get_stack(phab, data)()
+        assert conduit_calls.count('edge.search') == 2
+
+        stack = lazy_get_stack(phab, data)()
+        assert conduit_calls.count('edge.search') == 2
+
+    assert stack.open_parents(revision['phid']) == []
+    assert stack.is_open(child['phid'])
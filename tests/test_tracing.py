@@ -0,0 +1,72 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+import logging
+
+from landoapi.tracing import span, span_summary
+
+
+def test_span_totals_are_recorded(app):
+    with app.app_context():
+        with span('conduit'):
+            pass
+        with span('conduit'):
+            pass
+        with span('s3'):
+            pass
+
+        summary = span_summary()
+
+    assert summary['conduit']['count'] == 2
+    assert summary['s3']['count'] == 1
+    assert summary['s3']['ms'] >= 0
+
+
+def test_span_outside_app_context_is_ignored():
+    with span('conduit'):
+        pass
+
+
+def test_db_queries_are_traced(app, db):
+    with app.app_context():
+        db.session.execute('SELECT 1;')
+        assert span_summary()['db']['count'] == 1
+
+
+def test_request_summary_includes_spans(app, client, caplog):
+    caplog.set_level(logging.INFO)
+
+    @app.route('/__testing__/traced')
+    def traced():
+        with span('transplant'):
+            return 'traced'
+
+    response = client.get('/__testing__/traced')
+    assert response.status_code == 200
+
+    summaries = [r for r in caplog.records if r.name == 'request.summary']
+    assert summaries[-1].spans['transplant']['count'] == 1
+    assert not [r for r in caplog.records if r.name == 'request.trace']
+
+
+def test_request_trace_export(app, client, config, caplog):
+    caplog.set_level(logging.INFO)
+    config['TRACE_EXPORT'] = 'y'
+
+    @app.route('/__testing__/traced')
+    def traced():
+        with span('conduit'):
+            pass
+        with span('s3'):
+            pass
+        return 'traced'
+
+    response = client.get('/__testing__/traced')
+    assert response.status_code == 200
+
+    traces = [r for r in caplog.records if r.name == 'request.trace']
+    assert len(traces) == 1
+
+    events = traces[0].traceEvents
+    assert [e['name'] for e in events] == ['conduit', 's3']
+    assert all(e['ph'] == 'X' and e['ts'] >= 0 for e in events)